@@ -0,0 +1,111 @@
+"""Measures how long each run mode takes to import, in fresh interpreters.
+
+For every mode, imports stock_notifier.main and the mode's modules in a new
+process ``--runs`` times and reports the median wall time. One extra run with
+``-X importtime`` lists the slowest packages to import and whether the heavy
+dependencies were loaded.
+
+python -m benchmarks.bench_import --runs 10 --output bench_import.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from stock_notifier.main import MODE_MODULES
+
+ROOT = Path(__file__).parent.parent
+HEAVY_MODULES = ("discord", "aiohttp", "aiohttp.web", "sqlalchemy", "yaml")
+
+SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+from stock_notifier import main
+main.import_mode({mode!r})
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def slowest_packages(stderr: str, count: int) -> list[dict]:
+    """Parses -X importtime output into the packages that took longest to import,
+    including everything each imported first."""
+    packages = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        if "." not in name:
+            packages.append(dict(package=name, ms=int(cumulative) / 1000))
+    return sorted(packages, key=lambda p: p["ms"], reverse=True)[:count]
+
+
+def bench_mode(mode: str, runs: int, top: int) -> dict:
+    code = SNIPPET.format(mode=mode, heavy=HEAVY_MODULES)
+    times = []
+    loaded = []
+    for _ in range(runs):
+        elapsed, loaded = json.loads(run_python(code).stdout)
+        times.append(elapsed)
+    profile = run_python(code, "-X", "importtime")
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 1),
+        "min_ms": round(min(times) * 1000, 1),
+        "max_ms": round(max(times) * 1000, 1),
+        "heavy_modules": loaded,
+        "slowest_packages": slowest_packages(profile.stderr, top),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODE_MODULES), default=list(MODE_MODULES)
+    )
+    parser.add_argument("--output", default="bench_import.json")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    results = {mode: bench_mode(mode, args.runs, args.top) for mode in args.modes}
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for mode, result in results.items():
+        print(
+            f"{mode}: median {result['median_ms']}ms "
+            f"(min {result['min_ms']}ms, max {result['max_ms']}ms), "
+            f"loads {', '.join(result['heavy_modules'])}"
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
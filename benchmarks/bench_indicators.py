@@ -0,0 +1,110 @@
+"""Compares ways of finding which of many literal indicators occur in a page.
+
+Times LiteralSetMatcher against searching each literal with ``in`` and against
+one lookahead alternation scanned with finditer, on a generated page where a
+few of the literals occur near the end.
+
+python -m benchmarks.bench_indicators --page-bytes 1000000 --literals 2 10 100
+"""
+
+import argparse
+import json
+import platform
+import random
+import re
+import string
+import timeit
+from datetime import datetime
+
+from stock_notifier.indicators import LiteralSetMatcher
+
+
+def make_page(size: int, literals: list[str], seed: int) -> str:
+    rng = random.Random(seed)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9)))
+        for _ in range(2000)
+    ]
+    page = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        page.append(word)
+        length += len(word) + 1
+    # Every tenth literal occurs, late in the page like most stock buttons.
+    page[-10:-10] = literals[::10]
+    return " ".join(page)
+
+
+def make_literals(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(['Add to', 'In', 'Only'])} {rng.choice(['cart', 'stock'])} {i}"
+        for i in range(count)
+    ]
+
+
+def alternation_finder(literals: list[str]):
+    ordered = sorted(set(literals), key=len, reverse=True)
+    regex = re.compile("(?=(%s))" % "|".join(map(re.escape, ordered)))
+    return lambda text: {match.group(1) for match in regex.finditer(text)}
+
+
+def naive_finder(literals: list[str]):
+    return lambda text: {literal for literal in literals if literal in text}
+
+
+def bench(count: int, page_bytes: int, repeat: int, seed: int) -> dict:
+    literals = make_literals(count, seed)
+    page = make_page(page_bytes, literals, seed)
+    finders = {
+        "literal_set_matcher": LiteralSetMatcher(literals).find,
+        "per_literal_in": naive_finder(literals),
+        "lookahead_alternation": alternation_finder(literals),
+    }
+    expected = finders["per_literal_in"](page)
+    results = {}
+    for name, find in finders.items():
+        assert find(page) == expected, name
+        seconds = min(timeit.repeat(lambda: find(page), number=1, repeat=repeat))
+        results[name] = round(seconds * 1000, 3)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--page-bytes", type=int, default=1_000_000)
+    parser.add_argument("--literals", type=int, nargs="+", default=[2, 10, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_indicators.json")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    results = {
+        count: bench(count, args.page_bytes, args.repeat, args.seed)
+        for count in args.literals
+    }
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "page_bytes": args.page_bytes,
+        "milliseconds": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for count, timings in results.items():
+        print(
+            f"{count} literals: "
+            + ", ".join(f"{name} {ms}ms" for name, ms in timings.items())
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Replays a recorded cassette through scraper.check, with no network.
+
+Record a cassette from live retailers with ``python -m stock_notifier.main scrape
+--record pages.cassette``, then time or profile the check pipeline against those
+pages anywhere. Products come from a catalog file in the format of
+stock_notifier.catalog, or are one product per recorded URL with
+``--indicator``. Every pass checks each page once, back to back.
+
+python -m benchmarks.bench_replay pages.cassette --catalog products.csv \
+    --passes 3 --profile replay.prof --output bench_replay.json
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import platform
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from benchmarks.bench_scraper import peak_rss_mb, percentile
+from stock_notifier import health, models, scraper, storage
+from stock_notifier.cassette import Cassette, ReplayClient
+from stock_notifier.catalog import CatalogImporter
+from stock_notifier.registry import ProductRegistry
+from stock_notifier.response_cache import ResponseCache
+
+
+async def seed_catalog(cassette: Cassette, args):
+    await storage.setup({"url": "sqlite+aiosqlite://"})
+    if args.catalog:
+        report = await CatalogImporter().import_file(args.catalog)
+        print(f"Catalog: {report}")
+    else:
+        await models.add_products(
+            [
+                dict(name=f"product {i}", url=url, indicator=args.indicator)
+                for i, url in enumerate(cassette.urls(), 1)
+            ]
+        )
+    # One subscriber per product, so detections queue notifications.
+    product_ids = [row[0] for row in await models.get_product_rows()]
+    async with models.global_async_session() as session:
+        async with session.begin():
+            await session.execute(insert(models.User), [dict(name="u", discord_id=1)])
+            await session.execute(
+                insert(models.subscription_table),
+                [dict(user_id=1, product_id=id) for id in product_ids],
+            )
+
+
+async def run_pass(client: ReplayClient, targets: list, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_check(target):
+        async with semaphore:
+            start = time.perf_counter()
+            await scraper.check(list(target.products), client)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*map(timed_check, targets))
+    return latencies
+
+
+async def run_benchmark(args) -> dict:
+    with Cassette(args.cassette, use_mmap=not args.no_mmap) as cassette:
+        await seed_catalog(cassette, args)
+        registry = ProductRegistry(scraper.global_indicator_engine)
+        registry.load(await models.get_product_rows())
+        targets = [t for t in registry.targets() if t.url in cassette]
+        health.global_host_health = health.HealthTracker()
+        client = ReplayClient(cassette)
+        profiler = cProfile.Profile() if args.profile else None
+        passes = []
+        for _ in range(args.passes):
+            if not args.revalidate:
+                # Otherwise unchanged pages skip the indicators after one pass.
+                scraper.global_response_cache = ResponseCache()
+            if profiler is not None:
+                profiler.enable()
+            start = time.perf_counter()
+            latencies = await run_pass(client, targets, args.concurrency)
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            passes.append(
+                {
+                    "elapsed_seconds": round(elapsed, 3),
+                    "checks_per_second": round(len(latencies) / elapsed, 1),
+                    "check_latency_ms": {
+                        "p50": round(percentile(latencies, 0.5) * 1000, 3),
+                        "p99": round(percentile(latencies, 0.99) * 1000, 3),
+                        "max": round(max(latencies, default=0) * 1000, 3),
+                    },
+                }
+            )
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cassette": str(args.cassette),
+            "recorded_pages": len(cassette),
+            "pages_checked": len(targets),
+            "mmap": not args.no_mmap,
+            "revalidate": args.revalidate,
+            "replay": client.stats(),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "passes": passes,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("cassette")
+    parser.add_argument("--catalog", help="CSV or JSON lines file of products")
+    parser.add_argument("--indicator", default="Add to cart")
+    parser.add_argument("--passes", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--no-mmap", action="store_true")
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="keep the response cache between passes, so later passes get 304s",
+    )
+    parser.add_argument("--profile", help="writes cProfile stats of the passes here")
+    parser.add_argument("--output", default="bench_replay.json")
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
+    report = await run_benchmark(args)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for i, result in enumerate(report["passes"], 1):
+        print(
+            f"pass {i}: {result['checks_per_second']} checks/s, "
+            f"p50 {result['check_latency_ms']['p50']}ms "
+            f"p99 {result['check_latency_ms']['p99']}ms"
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,276 @@
+"""Benchmarks the scraper against a local stub retailer farm.
+
+Runs scraper.check_products (one pass over the catalog) and scraper_loop (until
+every page was checked once) against an in-memory SQLite catalog, and writes
+products/second, per-check latency percentiles, peak RSS and event loop lag to
+a JSON file.
+
+python -m benchmarks.bench_scraper --hosts 20 --products-per-host 50 \
+    --output bench_scraper.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from dataclasses import asdict
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from benchmarks.stub_farm import FarmConfig, StubFarm
+from stock_notifier import health, models, scraper, storage
+from stock_notifier.http_client import HttpClient
+from stock_notifier.polling import AdaptivePoller
+from stock_notifier.registry import ProductRegistry
+from stock_notifier.response_cache import ResponseCache
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class LoopLagSampler:
+    """Records how late a task sleeping ``interval`` seconds is woken."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+
+class CheckTimer:
+    """Wraps scraper.check to time every page check."""
+
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.products = 0
+        self.all_checked = asyncio.Event()
+        self.expected_pages = 0
+        self._check = scraper.check
+
+    async def check(self, products, client):
+        start = time.perf_counter()
+        try:
+            return await self._check(products, client)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+            self.products += len(products)
+            if len(self.latencies) >= self.expected_pages:
+                self.all_checked.set()
+
+    def __enter__(self):
+        scraper.check = self.check
+        return self
+
+    def __exit__(self, *exc_info):
+        scraper.check = self._check
+
+
+async def seed_catalog(farm: StubFarm, indicator: str):
+    await storage.setup({"url": "sqlite+aiosqlite://"})
+    urls = farm.urls()
+    async with models.global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(models.Product),
+                [
+                    dict(name=f"product {i}", url=url, indicator=indicator)
+                    for i, url in enumerate(urls, 1)
+                ],
+            )
+            await session.execute(insert(models.User), [dict(name="u", discord_id=1)])
+            await session.execute(
+                insert(models.subscription_table),
+                [dict(user_id=1, product_id=i) for i in range(1, len(urls) + 1)],
+            )
+
+
+def reset_scraper_state(args):
+    scraper.global_response_cache = ResponseCache()
+    scraper.global_registry = ProductRegistry(scraper.global_indicator_engine)
+    scraper.global_poller = AdaptivePoller(scraper.global_poller.policy)
+    health.global_host_health = health.HealthTracker()
+    scraper.CONCURRENT_HOSTS_LIMIT = args.workers
+    # scraper_loop derives its default host rate from this, so it can't be 0.
+    scraper.SLEEP_SAME_HOST = max(args.same_host_sleep, 1 / args.host_rate)
+    scraper.SLEEP_GLOBAL_JITTER = 0
+    scraper.config["rate_limits"] = {
+        "default": {"rate": args.host_rate, "burst": args.host_rate}
+    }
+
+
+async def run_check_products(client: HttpClient, timer: CheckTimer) -> float:
+    start = time.perf_counter()
+    await scraper.check_products(client)
+    return time.perf_counter() - start
+
+
+async def run_scraper_loop(client: HttpClient, timer: CheckTimer, timeout: float):
+    start = time.perf_counter()
+    loop_task = asyncio.create_task(scraper.scraper_loop(client))
+    checked = asyncio.create_task(timer.all_checked.wait())
+    try:
+        done, _ = await asyncio.wait(
+            {loop_task, checked}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if loop_task in done:
+            # scraper_loop only returns by raising.
+            loop_task.result()
+        if not done:
+            raise asyncio.TimeoutError(f"Not every page was checked in {timeout}s")
+    finally:
+        for task in (loop_task, checked):
+            task.cancel()
+        await asyncio.gather(loop_task, checked, return_exceptions=True)
+    return time.perf_counter() - start
+
+
+async def run_mode(mode: str, farm: StubFarm, args) -> dict:
+    reset_scraper_state(args)
+    await seed_catalog(farm, args.indicator)
+    requests_before = farm.requests
+    with CheckTimer() as timer, LoopLagSampler() as lag:
+        timer.expected_pages = len(farm.urls())
+        async with HttpClient(limit_per_host=args.connections_per_host) as client:
+            if mode == "check_products":
+                elapsed = await run_check_products(client, timer)
+            else:
+                elapsed = await run_scraper_loop(client, timer, args.timeout)
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "checks": len(timer.latencies),
+        "products_checked": timer.products,
+        "products_per_second": round(timer.products / elapsed, 1),
+        "check_latency_ms": {
+            "p50": round(percentile(timer.latencies, 0.5) * 1000, 2),
+            "p99": round(percentile(timer.latencies, 0.99) * 1000, 2),
+            "max": round(max(timer.latencies, default=0) * 1000, 2),
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag.lags, 0.5) * 1000, 2),
+            "p99": round(percentile(lag.lags, 0.99) * 1000, 2),
+            "max": round(max(lag.lags, default=0) * 1000, 2),
+            "mean": round(statistics.fmean(lag.lags) * 1000, 2) if lag.lags else 0,
+        },
+        # ru_maxrss is a process-wide high-water mark, so later modes include
+        # earlier ones.
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "farm_requests": farm.requests - requests_before,
+    }
+
+
+async def run_benchmark(args) -> dict:
+    farm_config = FarmConfig(
+        hosts=args.hosts,
+        products_per_host=args.products_per_host,
+        page_bytes=args.page_bytes,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limited_rate=args.rate_limited_rate,
+        in_stock_rate=args.in_stock_rate,
+        etags=not args.no_etags,
+        seed=args.seed,
+    )
+    results = {}
+    async with StubFarm(farm_config) as farm:
+        for mode in args.modes:
+            results[mode] = await run_mode(mode, farm, args)
+        responses = dict(sorted(farm.responses.items()))
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "farm": asdict(farm_config),
+        "scraper": {
+            "workers": args.workers,
+            "connections_per_host": args.connections_per_host,
+            "host_rate": args.host_rate,
+            "same_host_sleep": args.same_host_sleep,
+            "indicator": args.indicator,
+        },
+        "farm_responses": responses,
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--products-per-host", type=int, default=50)
+    parser.add_argument("--page-bytes", type=int, default=100_000)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--latency-jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limited-rate", type=float, default=0.0)
+    parser.add_argument("--in-stock-rate", type=float, default=0.0)
+    parser.add_argument("--no-etags", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--indicator", default="Add to cart")
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--connections-per-host", type=int, default=5)
+    parser.add_argument("--host-rate", type=float, default=50)
+    parser.add_argument(
+        "--same-host-sleep",
+        type=float,
+        default=0,
+        help="check_products sleeps at least 0.1s between pages of a host",
+    )
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["check_products", "scraper_loop"],
+        default=["check_products", "scraper_loop"],
+    )
+    parser.add_argument("--output", default="bench_scraper.json")
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
+    report = await run_benchmark(args)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    for mode, result in report["results"].items():
+        print(
+            f"{mode}: {result['products_per_second']} products/s, "
+            f"check p50 {result['check_latency_ms']['p50']}ms "
+            f"p99 {result['check_latency_ms']['p99']}ms, "
+            f"loop lag p99 {result['loop_lag_ms']['p99']}ms, "
+            f"peak RSS {result['peak_rss_mb']}MB"
+        )
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""Measures scraper read latency while the bot writes, per SQLite journal mode.
+
+The bot runs in its own process, as in ``bot`` run mode, committing large
+batches of subscriptions, like bulk imports do, for ``--seconds``. Meanwhile
+the scraper's queries are timed in this process. Under the rollback journal
+every commit locks readers out until the journal is synced and deleted. Under
+WAL readers keep reading the last committed snapshot.
+
+python -m benchmarks.bench_storage --seconds 5 --batch 50000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import insert
+
+from stock_notifier import models, storage
+
+PRODUCTS = 100
+
+
+def write_subscriptions(path: str, journal_mode: str, seconds: float, batch: int):
+    """The bot process: commits batches of subscriptions until time is up."""
+    connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+    connection.execute(f"PRAGMA journal_mode={journal_mode}")
+    connection.execute("PRAGMA synchronous=full")
+    deadline = time.monotonic() + seconds
+    user_id = 0
+    while time.monotonic() < deadline:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany(
+            "INSERT INTO subscription_table (user_id, product_id) VALUES (?, ?)",
+            [(user_id + i, i % PRODUCTS + 1) for i in range(batch)],
+        )
+        connection.execute("COMMIT")
+        user_id += batch
+    connection.close()
+
+
+async def run(journal_mode: str, seconds: float, batch: int, readers: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "bench.db"
+        engine = await storage.setup(
+            {
+                "url": f"sqlite+aiosqlite:///{path}",
+                "pragmas": {"journal_mode": journal_mode, "synchronous": "full"},
+            }
+        )
+        async with models.global_async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    insert(models.Product),
+                    [
+                        dict(name=f"p{i}", url=f"https://shop.com/{i}", indicator="x")
+                        for i in range(1, PRODUCTS + 1)
+                    ],
+                )
+        bot = multiprocessing.get_context("spawn").Process(
+            target=write_subscriptions, args=(str(path), journal_mode, seconds, batch)
+        )
+        bot.start()
+        latencies = []
+        errors = 0
+
+        async def scraper():
+            nonlocal errors
+            while bot.is_alive():
+                start = time.perf_counter()
+                try:
+                    await models.get_product_rows()
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(scraper() for _ in range(readers)))
+        bot.join()
+        await engine.dispose()
+        return dict(latencies=latencies, errors=errors)
+
+
+def summary(result: dict) -> str:
+    latencies = sorted(result["latencies"])
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return (
+        f"reads {len(latencies)}, p50 {statistics.median(latencies) * 1000:.2f}ms, "
+        f"p99 {p99 * 1000:.2f}ms, max {latencies[-1] * 1000:.2f}ms, "
+        f"errors {result['errors']}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--batch", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    for journal_mode in ("delete", "wal"):
+        result = await run(journal_mode, args.seconds, args.batch, args.readers)
+        print(f"{journal_mode:>6}: {summary(result)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Compares removing N subscribers of a product one by one against in bulk.
+
+python -m benchmarks.bench_subscriptions --subscribers 10000
+"""
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from stock_notifier import models
+
+
+async def seed(subscribers: int, products_per_user: int) -> list[int]:
+    """Creates users subscribed to one hot product and a few others each."""
+    async with models.global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(models.Product),
+                [
+                    dict(name=f"p{i}", url=f"https://shop.com/{i}", indicator="x")
+                    for i in range(1, products_per_user + 1)
+                ],
+            )
+            await session.execute(
+                insert(models.User),
+                [dict(name=f"u{i}", discord_id=i) for i in range(1, subscribers + 1)],
+            )
+            await session.execute(
+                insert(models.subscription_table),
+                [
+                    dict(user_id=u, product_id=p)
+                    for u in range(1, subscribers + 1)
+                    for p in range(1, products_per_user + 1)
+                ],
+            )
+    return list(range(1, subscribers + 1))
+
+
+async def setup_database():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    models.global_async_session = async_sessionmaker(engine, expire_on_commit=False)
+    return engine
+
+
+async def bench_per_user(subscribers: int, products_per_user: int) -> float:
+    engine = await setup_database()
+    user_ids = await seed(subscribers, products_per_user)
+    start = time.perf_counter()
+    for discord_id in user_ids:
+        await models.remove_discord_subscription(discord_id, id=1)
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return elapsed
+
+
+async def bench_bulk(subscribers: int, products_per_user: int) -> float:
+    engine = await setup_database()
+    user_ids = await seed(subscribers, products_per_user)
+    start = time.perf_counter()
+    removed = await models.remove_subscriptions(1, user_ids)
+    elapsed = time.perf_counter() - start
+    assert len(removed) == subscribers
+    await engine.dispose()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--products-per-user", type=int, default=5)
+    args = parser.parse_args()
+
+    per_user = await bench_per_user(args.subscribers, args.products_per_user)
+    bulk = await bench_bulk(args.subscribers, args.products_per_user)
+    print(f"subscribers: {args.subscribers}")
+    print(f"per-user ORM removal: {per_user:.3f}s")
+    print(f"bulk DELETE removal:  {bulk:.3f}s ({per_user / bulk:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
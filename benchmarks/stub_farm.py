@@ -0,0 +1,133 @@
+"""A local aiohttp server posing as many retailers.
+
+Each simulated host listens on its own loopback address (127.0.0.2, 127.0.0.3,
+...) so the scraper sees distinct hostnames, with per-host rate limits and
+circuit breakers, while everything is served by one process. Loopback
+addresses other than 127.0.0.1 need Linux.
+"""
+
+import asyncio
+import hashlib
+import random
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+IN_STOCK = "Add to cart"
+OUT_OF_STOCK = "Sold out"
+
+
+@dataclass
+class FarmConfig:
+    hosts: int = 10
+    products_per_host: int = 100
+    page_bytes: int = 100_000
+    latency_ms: float = 20
+    latency_jitter_ms: float = 10
+    error_rate: float = 0.0
+    rate_limited_rate: float = 0.0
+    retry_after: int = 1
+    in_stock_rate: float = 0.0
+    etags: bool = True
+    seed: int = 0
+
+
+def host_address(i: int) -> str:
+    return f"127.0.{(i + 1) // 254}.{(i + 1) % 254 + 1}"
+
+
+class StubFarm:
+    def __init__(self, config: FarmConfig, port: int = 0):
+        self.config = config
+        self.port = port
+        self.random = random.Random(config.seed)
+        self.requests = 0
+        self.responses: dict[int, int] = {}
+        self.bytes_sent = 0
+        self._pages: dict[tuple[str, int], tuple[bytes, str]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def hosts(self) -> list[str]:
+        return [host_address(i) for i in range(self.config.hosts)]
+
+    def urls(self) -> list[str]:
+        return [
+            f"http://{host}:{self.port}/product/{product}"
+            for host in self.hosts
+            for product in range(self.config.products_per_host)
+        ]
+
+    def page(self, host: str, product: int) -> tuple[bytes, str]:
+        """The page body and its ETag, fixed per product for the farm's seed."""
+        key = (host, product)
+        page = self._pages.get(key)
+        if page is None:
+            rng = random.Random(f"{self.config.seed}/{host}/{product}")
+            indicator = (
+                IN_STOCK if rng.random() < self.config.in_stock_rate else OUT_OF_STOCK
+            )
+            head = (
+                f"<html><head><title>Product {product}</title></head><body>"
+                f'<div class="buy"><button>{indicator}</button></div>'
+            ).encode()
+            filler = b"<p>" + b"lorem ipsum dolor sit amet " * 40 + b"</p>\n"
+            body = head + filler * max(
+                (self.config.page_bytes - len(head)) // len(filler), 0
+            )
+            body += b"</body></html>"
+            page = (body, f'"{hashlib.md5(body).hexdigest()}"')
+            self._pages[key] = page
+        return page
+
+    def _respond(self, status: int, **kwargs) -> web.Response:
+        self.responses[status] = self.responses.get(status, 0) + 1
+        return web.Response(status=status, **kwargs)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        config = self.config
+        delay = config.latency_ms + self.random.uniform(
+            -config.latency_jitter_ms, config.latency_jitter_ms
+        )
+        await asyncio.sleep(max(delay, 0) / 1000)
+        roll = self.random.random()
+        if roll < config.error_rate:
+            return self._respond(500, text="Internal Server Error")
+        if roll < config.error_rate + config.rate_limited_rate:
+            return self._respond(429, headers={"Retry-After": str(config.retry_after)})
+        body, etag = self.page(
+            request.host.split(":")[0], int(request.match_info["id"])
+        )
+        if config.etags and request.headers.get("If-None-Match") == etag:
+            return self._respond(304, headers={"ETag": etag})
+        self.bytes_sent += len(body)
+        headers = {"ETag": etag} if config.etags else {}
+        return self._respond(
+            200, body=body, content_type="text/html", charset="utf-8", headers=headers
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/product/{id}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        for host in self.hosts:
+            site = web.TCPSite(self._runner, host, self.port)
+            await site.start()
+            if not self.port:
+                # Every host shares the port picked for the first one.
+                self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "StubFarm":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,6 +1,22 @@
 from pathlib import Path
 
-import yaml
+CONFIG_PATH = Path(__file__).parent.joinpath("config.yaml")
 
-with open(Path(__file__).parent.joinpath("config.yaml"), "r") as stream:
-    config = yaml.safe_load(stream)
+
+def load_config(path: Path = CONFIG_PATH) -> dict:
+    import yaml
+
+    # The C loader is several times faster when libyaml is available.
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r") as stream:
+        return yaml.load(stream, Loader=loader)
+
+
+def __getattr__(name: str):
+    # config.yaml is parsed on first use, so importing a module that doesn't
+    # read it, like the regex worker in a spawned process, stays cheap.
+    if name == "config":
+        global config
+        config = load_config()
+        return config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,310 @@
+"""Records fetched pages into a cassette and replays them without the network.
+
+A cassette is a single file: a magic line, one zlib-compressed record per
+response, a compressed JSON index mapping each URL to its record, and a footer
+locating the index. Replaying reads only the index up front and decompresses a
+record when its URL is fetched, from a memory map by default, so cassettes
+larger than memory replay fine.
+"""
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, NamedTuple, Optional, Union
+
+import aiohttp
+from aiohttp.helpers import parse_mimetype
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from stock_notifier.http_client import HttpClient
+from stock_notifier.logger import logger
+
+MAGIC = b"STOCKCASSETTE1\n"
+FOOTER = struct.Struct(">QQ")
+# Request headers that would get the page recorded as a bodiless 304.
+CONDITIONAL_HEADERS = {"if-none-match", "if-modified-since"}
+# They describe the body on the wire, which aiohttp has already decoded.
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+Buffer = Union[bytes, memoryview]
+
+
+class CassetteError(Exception):
+    pass
+
+
+class Recording(NamedTuple):
+    status: int
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+def encode_recording(url: str, recording: Recording, level: int) -> bytes:
+    meta = json.dumps(
+        dict(url=url, status=recording.status, headers=recording.headers)
+    ).encode()
+    return zlib.compress(meta + b"\n" + recording.body, level)
+
+
+def decode_recording(data: Buffer) -> Recording:
+    raw = zlib.decompress(data)
+    meta_end = raw.index(b"\n")
+    meta = json.loads(raw[:meta_end])
+    headers = [tuple(header) for header in meta["headers"]]
+    return Recording(meta["status"], headers, raw[meta_end + 1 :])
+
+
+class CassetteWriter:
+    """Appends recordings to a new cassette. The last recording of a URL wins.
+
+    The cassette is written next to ``path`` and moved in place by close(), so
+    a crashed recording never leaves a cassette without an index.
+    """
+
+    def __init__(self, path: Union[str, Path], level: int = 6):
+        self.path = Path(path)
+        self.level = level
+        self.index: dict[str, tuple[int, int]] = {}
+        self._tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def add(self, url: str, recording: Recording):
+        data = encode_recording(url, recording, self.level)
+        self.index[url] = (self._file.tell(), len(data))
+        self._file.write(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        index = zlib.compress(json.dumps(self.index).encode(), self.level)
+        index_offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(index_offset, len(index)) + MAGIC)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        logger.info("Recorded %d pages to %s", len(self.index), self.path)
+
+    def __enter__(self) -> "CassetteWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Cassette:
+    """Read-only access to a recorded cassette by URL."""
+
+    def __init__(self, path: Union[str, Path], use_mmap: bool = True):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap: Optional[mmap.mmap] = None
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            tail_size = FOOTER.size + len(MAGIC)
+            if size < len(MAGIC) + tail_size or self._file.read(len(MAGIC)) != MAGIC:
+                raise CassetteError(f"{self.path} isn't a cassette")
+            self._file.seek(size - tail_size)
+            tail = self._file.read(tail_size)
+            if tail[FOOTER.size :] != MAGIC:
+                raise CassetteError(f"{self.path} is truncated")
+            index_offset, index_size = FOOTER.unpack(tail[: FOOTER.size])
+            if use_mmap:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            index = json.loads(zlib.decompress(self._read(index_offset, index_size)))
+        except Exception:
+            self.close()
+            raise
+        self.index: dict[str, tuple[int, int]] = {
+            url: tuple(entry) for url, entry in index.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.index
+
+    def urls(self) -> list[str]:
+        return list(self.index)
+
+    def _read(self, offset: int, size: int) -> Buffer:
+        if self._mmap is not None:
+            return memoryview(self._mmap)[offset : offset + size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def get(self, url: str) -> Optional[Recording]:
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+        data = self._read(*entry)
+        try:
+            return decode_recording(data)
+        finally:
+            if isinstance(data, memoryview):
+                # An exported view would keep the map from closing.
+                data.release()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self) -> "Cassette":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordedContent:
+    """The subset of aiohttp.StreamReader the scraper reads bodies with."""
+
+    def __init__(self, body: bytes):
+        self._body = body
+        self._offset = 0
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        while self._offset < len(self._body):
+            chunk = self._body[self._offset : self._offset + size]
+            self._offset += len(chunk)
+            yield chunk
+
+    async def read(self, size: int = -1) -> bytes:
+        end = len(self._body) if size < 0 else self._offset + size
+        chunk = self._body[self._offset : end]
+        self._offset += len(chunk)
+        return chunk
+
+    def at_eof(self) -> bool:
+        return self._offset >= len(self._body)
+
+
+class RecordedResponse:
+    """Stands in for an aiohttp.ClientResponse with a recorded status, headers and
+    body."""
+
+    def __init__(self, url: str, recording: Recording):
+        self.url = URL(url)
+        self.status = recording.status
+        self.headers = CIMultiDictProxy(CIMultiDict(recording.headers))
+        self.content = RecordedContent(recording.body)
+
+    @property
+    def charset(self) -> Optional[str]:
+        content_type = self.headers.get("Content-Type")
+        if content_type is None:
+            return None
+        return parse_mimetype(content_type).parameters.get("charset")
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(
+                aiohttp.RequestInfo(self.url, "GET", CIMultiDictProxy(CIMultiDict())),
+                (),
+                status=self.status,
+                headers=self.headers,
+            )
+
+
+async def read_body(response: aiohttp.ClientResponse, max_bytes: int) -> bytes:
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(64 * 1024):
+        chunks.append(chunk[: max_bytes - size])
+        size += len(chunks[-1])
+        if size >= max_bytes:
+            break
+    return b"".join(chunks)
+
+
+class RecordingClient:
+    """Fetches through an HttpClient and records every response into a cassette.
+
+    Conditional headers are dropped so that every recording has a body to
+    replay, and each body is read completely even when the scraper would have
+    stopped at the first match.
+    """
+
+    def __init__(
+        self,
+        client: HttpClient,
+        writer: CassetteWriter,
+        max_body_bytes: int = 8 * 1024 * 1024,
+    ):
+        self.client = client
+        self.writer = writer
+        self.max_body_bytes = max_body_bytes
+
+    @asynccontextmanager
+    async def get(self, url: str, headers: Optional[dict] = None, **kwargs):
+        headers = {
+            name: value
+            for name, value in (headers or {}).items()
+            if name.lower() not in CONDITIONAL_HEADERS
+        }
+        async with self.client.get(url, headers=headers, **kwargs) as response:
+            recording = Recording(
+                response.status,
+                [
+                    (name, value)
+                    for name, value in response.headers.items()
+                    if name.lower() not in DROPPED_HEADERS
+                ],
+                await read_body(response, self.max_body_bytes),
+            )
+        self.writer.add(url, recording)
+        yield RecordedResponse(url, recording)
+
+    def stats(self) -> dict:
+        return {**self.client.stats(), "recorded": len(self.writer)}
+
+
+class ReplayClient:
+    """Serves fetches from a cassette instead of the network.
+
+    Conditional requests get a 304 when they name the recorded validators, like
+    the retailer would answer, and URLs missing from the cassette get a 404.
+    """
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self._counters = dict.fromkeys(["requests", "replayed", "missing"], 0)
+
+    @asynccontextmanager
+    async def get(self, url: str, headers: Optional[dict] = None, **kwargs):
+        self._counters["requests"] += 1
+        recording = self.cassette.get(url)
+        if recording is None:
+            self._counters["missing"] += 1
+            logger.debug("%s isn't in the cassette", url)
+            recording = Recording(404, [], b"")
+        else:
+            self._counters["replayed"] += 1
+            if self._not_modified(recording, headers or {}):
+                recording = Recording(304, recording.headers, b"")
+        yield RecordedResponse(url, recording)
+
+    @staticmethod
+    def _not_modified(recording: Recording, headers: dict) -> bool:
+        recorded = CIMultiDict(recording.headers)
+        etag = headers.get("If-None-Match")
+        if etag is not None:
+            return etag == recorded.get("ETag")
+        last_modified = headers.get("If-Modified-Since")
+        return last_modified is not None and last_modified == recorded.get(
+            "Last-Modified"
+        )
+
+    def stats(self) -> dict:
+        return dict(self._counters)
@@ -0,0 +1,313 @@
+"""Bulk import and export of products as CSV or JSON lines.
+
+Files have the columns name, url, indicator and regex, optionally gzipped. Rows
+are streamed in batches, so memory use doesn't grow with the file:
+
+python -m stock_notifier.catalog import products.csv
+python -m stock_notifier.catalog export products.jsonl.gz
+
+Running scrapers schedule imported products at their next refresh, and the bot
+offers them in autocomplete within ten seconds, without restarting.
+"""
+
+import argparse
+import asyncio
+import csv
+import functools
+import gzip
+import json
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+import validators
+
+from stock_notifier import config, models, regex_pool, storage
+from stock_notifier.indicators import literal_of
+from stock_notifier.logger import logger
+
+FIELDS = ("name", "url", "indicator", "regex")
+FORMATS = ("csv", "jsonl")
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+# Column lengths of the product table.
+MAX_NAME_LENGTH = 128
+MAX_URL_LENGTH = 512
+MAX_INDICATOR_LENGTH = 512
+
+
+class InvalidRowError(ValueError):
+    pass
+
+
+def detect_format(path: Path) -> str:
+    suffixes = [suffix.lower() for suffix in path.suffixes if suffix.lower() != ".gz"]
+    suffix = suffixes[-1] if suffixes else ""
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Can't tell the format of {path}, pass csv or jsonl")
+
+
+def open_text(path: Path, mode: str) -> IO[str]:
+    if path.suffix.lower() == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def read_rows(file: IO[str], format: str) -> Iterator[tuple[int, dict]]:
+    """Yields (line number, row) for every row of the file."""
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            row = InvalidRowError(f"Invalid JSON: {e}")
+        yield line_number, row
+
+
+@functools.lru_cache(maxsize=10000)
+def valid_origin(origin: str) -> bool:
+    return bool(validators.url(origin))
+
+
+def valid_url(url: str) -> bool:
+    """Checks a URL like the bot does, validating each scheme and host once since
+    a catalog has many URLs on few hosts."""
+    if len(url) > MAX_URL_LENGTH or any(char.isspace() for char in url):
+        return False
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    if not parts.scheme or not parts.netloc:
+        return False
+    return valid_origin(f"{parts.scheme}://{parts.netloc}")
+
+
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def normalize_row(row) -> tuple[dict, bool]:
+    """Checks a row and returns the product's columns and whether the indicator
+    is a regex that still needs validating."""
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise InvalidRowError("Row isn't an object")
+    name = str(row.get("name") or "").strip()
+    url = str(row.get("url") or "").strip()
+    indicator = str(row.get("indicator") or "")
+    regex = parse_bool(row.get("regex"))
+    if not name or len(name) > MAX_NAME_LENGTH:
+        raise InvalidRowError(f"Name must have 1 to {MAX_NAME_LENGTH} characters")
+    if not valid_url(url):
+        raise InvalidRowError(f"URL isn't valid: {url!r}")
+    if not indicator:
+        raise InvalidRowError("Indicator is empty")
+    if not regex:
+        indicator = re.escape(indicator)
+    if len(indicator) > MAX_INDICATOR_LENGTH:
+        raise InvalidRowError(
+            f"Indicator is longer than {MAX_INDICATOR_LENGTH} characters"
+        )
+    return dict(name=name, url=url, indicator=indicator), regex
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    # The first few errors as "line N: reason".
+    errors: list[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"Read {self.rows} rows: inserted {self.inserted}, skipped "
+            f"{self.duplicates} duplicates and {self.invalid} invalid rows"
+        )
+
+
+class CatalogImporter:
+    """Validates rows and inserts them ``batch_size`` at a time, one transaction
+    per batch.
+
+    Regex indicators are validated by the regex pool when one is given, so a
+    catastrophic pattern is rejected before the scraper runs it, and otherwise
+    only compiled. Results are cached per pattern, since large catalogs reuse a
+    handful of indicators.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[regex_pool.RegexPool] = None,
+        batch_size: int = 10000,
+        max_errors: int = 20,
+        pattern_cache_size: int = 10000,
+    ):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.pattern_cache_size = pattern_cache_size
+        self._pattern_errors: OrderedDict[str, Optional[str]] = OrderedDict()
+
+    async def _validate_pattern(self, pattern: str) -> Optional[str]:
+        if self.pool is not None:
+            return await self.pool.validate(pattern)
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"Invalid regular expression: {e}"
+        return None
+
+    async def validate_patterns(self, patterns: Iterable[str]) -> dict[str, str]:
+        """Returns the error of every invalid pattern."""
+        cache = self._pattern_errors
+        results = {}
+        unknown = []
+        for pattern in set(patterns):
+            if pattern in cache:
+                results[pattern] = cache[pattern]
+            else:
+                unknown.append(pattern)
+        errors = await asyncio.gather(*map(self._validate_pattern, unknown))
+        for pattern, error in zip(unknown, errors):
+            results[pattern] = cache[pattern] = error
+            if len(cache) > self.pattern_cache_size:
+                cache.popitem(last=False)
+        return {p: e for p, e in results.items() if e is not None}
+
+    def _reject(self, report: ImportReport, line_number: int, error: Exception):
+        report.invalid += 1
+        if len(report.errors) < self.max_errors:
+            report.errors.append(f"line {line_number}: {error}")
+            logger.warning("Skipped line %d: %s", line_number, error)
+
+    async def _flush(self, batch: list[tuple[int, dict, bool]], report: ImportReport):
+        pattern_errors = await self.validate_patterns(
+            row["indicator"] for _, row, regex in batch if regex
+        )
+        rows = []
+        for line_number, row, regex in batch:
+            error = pattern_errors.get(row["indicator"]) if regex else None
+            if error:
+                self._reject(report, line_number, InvalidRowError(error))
+            else:
+                rows.append(row)
+        added, duplicates = await models.add_products(rows)
+        report.inserted += len(added)
+        report.duplicates += duplicates
+        logger.info("%s", report)
+
+    async def import_rows(self, rows: Iterable[tuple[int, dict]]) -> ImportReport:
+        report = ImportReport()
+        batch = []
+        for line_number, row in rows:
+            report.rows += 1
+            try:
+                product, regex = normalize_row(row)
+            except InvalidRowError as e:
+                self._reject(report, line_number, e)
+                continue
+            batch.append((line_number, product, regex))
+            if len(batch) >= self.batch_size:
+                await self._flush(batch, report)
+                batch = []
+        if batch:
+            await self._flush(batch, report)
+        return report
+
+    async def import_file(self, path: Path, format: Optional[str] = None):
+        path = Path(path)
+        with open_text(path, "r") as file:
+            return await self.import_rows(
+                read_rows(file, format or detect_format(path))
+            )
+
+
+def export_row(name: str, url: str, indicator: str) -> dict:
+    # Literals are exported as typed when escaping them gives back the stored
+    # pattern, so the file imports back the same rows.
+    literal = literal_of(indicator)
+    if literal is not None and re.escape(literal) == indicator:
+        return dict(name=name, url=url, indicator=literal, regex=False)
+    return dict(name=name, url=url, indicator=indicator, regex=True)
+
+
+async def export_products(
+    path: Path, format: Optional[str] = None, batch_size: int = 1000
+) -> int:
+    """Writes every product to a file. Returns the number written."""
+    path = Path(path)
+    format = format or detect_format(path)
+    count = 0
+    with open_text(path, "w") as file:
+        writer = None
+        if format == "csv":
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+        async for name, url, indicator in models.stream_product_rows(batch_size):
+            row = export_row(name, url, indicator)
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(row) + "\n")
+            count += 1
+    return count
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument(
+        "--no-regex-pool",
+        action="store_true",
+        help="only compile regex indicators instead of timing them in the pool",
+    )
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    engine = await storage.setup(config.get("database", {}))
+    try:
+        if args.command == "export":
+            count = await export_products(args.path, args.format)
+            logger.info("Exported %d products to %s", count, args.path)
+            return
+        pool = None
+        if not args.no_regex_pool:
+            pool = regex_pool.RegexPool.from_config(config.get("regex", {}))
+            await pool.start()
+        try:
+            importer = CatalogImporter(pool, args.batch_size)
+            report = await importer.import_file(args.path, args.format)
+        finally:
+            if pool is not None:
+                pool.close()
+        logger.info("Imported %s: %s", args.path, report)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import asyncio
+import cProfile
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from stock_notifier import metrics
+from stock_notifier.logger import LOG_DIR, logger
+
+
+class LoopLagMonitor:
+    """Warns with the event loop's stack when it is blocked past ``threshold``.
+
+    A task on the loop records a heartbeat every ``interval`` seconds and a
+    watchdog thread checks it. When the heartbeat is late, the watchdog captures
+    what the loop thread is running at that moment, so the blocking call shows up
+    in the log rather than just its delay.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.last_stack: Optional[str] = None
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, diagnostics_config: dict) -> "LoopLagMonitor":
+        return cls(
+            threshold=diagnostics_config.get("loop_lag_threshold", 0.5),
+            interval=diagnostics_config.get("loop_lag_interval", 0.1),
+        )
+
+    def start(self):
+        """Starts monitoring the running loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-lag-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            metrics.LOOP_LAG_SECONDS.observe(
+                max(self._beat - before - self.interval, 0.0)
+            )
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            lag = time.monotonic() - beat
+            if lag < self.threshold or beat == reported:
+                continue
+            # Report each stall once, with the stack at the time it was noticed.
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+            self.stalls += 1
+            self.last_stack = stack
+            logger.warning(
+                "Event loop blocked for over %.2fs, loop thread stack:\n%s", lag, stack
+            )
+
+
+class CycleProfiler:
+    """Profiles whole scraper cycles with cProfile and writes them under logs/.
+
+    With ``always`` every cycle is profiled; otherwise ``arm()``, bound to SIGUSR1
+    by main, profiles the next ``cycles`` cycles. Profiles are pstats files that
+    can be opened with ``python -m pstats`` or snakeviz.
+    """
+
+    def __init__(
+        self,
+        always: bool = False,
+        cycles: int = 1,
+        directory: Path = LOG_DIR.joinpath("profiles"),
+    ):
+        self.always = always
+        self.cycles = cycles
+        self.directory = Path(directory)
+        self._remaining = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._name: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, diagnostics_config: dict) -> "CycleProfiler":
+        directory = diagnostics_config.get("profile_dir")
+        return cls(
+            always=diagnostics_config.get("profile", False),
+            cycles=diagnostics_config.get("profile_cycles", 1),
+            **({"directory": Path(directory)} if directory else {}),
+        )
+
+    def arm(self):
+        self._remaining = self.cycles
+        logger.info("Profiling the next %d scraper cycles", self.cycles)
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start_cycle(self, name: str):
+        """Ends the current cycle's profile, if any, and starts the next one."""
+        self.end_cycle()
+        if not self.always and self._remaining <= 0:
+            return
+        self._remaining -= 1
+        self._name = name
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def end_cycle(self) -> Optional[Path]:
+        """Stops profiling and returns the written profile's path."""
+        if self._profile is None:
+            return None
+        self._profile.disable()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = self.directory.joinpath(f"{self._name}-{timestamp}.prof")
+        self._profile.dump_stats(path)
+        self._profile = None
+        logger.info("Wrote profile %s", path)
+        return path
+
+    @contextmanager
+    def cycle(self, name: str):
+        self.start_cycle(name)
+        try:
+            yield
+        finally:
+            self.end_cycle()
+
+
+global_profiler = CycleProfiler()
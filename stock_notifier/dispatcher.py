@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional, Union
+
+from stock_notifier import metrics, models
+from stock_notifier.logger import logger
+from stock_notifier.scheduler import TokenBucket
+
+# Sends a user one message covering all of their notifications. Returns False if
+# the user can never be reached and raises if delivery should be retried.
+Sender = Callable[[models.User, list[models.Notification]], Awaitable[bool]]
+
+
+class PartiallySent(Exception):
+    """Raised by a sender that delivered only some of a user's notifications."""
+
+    def __init__(self, sent: list[models.Notification]):
+        super().__init__(f"Sent {len(sent)} notifications before failing")
+        self.sent = sent
+
+
+class NotificationDispatcher:
+    """Drains the notification outbox independently of the scraper.
+
+    Pending rows are taken oldest first in batches and sent concurrently, within
+    a global rate limit. Notifications wait ``digest_seconds`` after being queued,
+    and each user then gets one digest of all their pending notifications, so a
+    retailer restocking many products at once costs one message per user.
+    Users who were notified are unsubscribed from the products. Failed sends are
+    retried with exponential backoff until ``max_attempts`` is reached.
+    """
+
+    def __init__(
+        self,
+        send: Sender,
+        concurrency: int = 5,
+        rate: float = 5,
+        burst: float = 5,
+        batch_size: int = 100,
+        poll_seconds: float = 5,
+        max_attempts: int = 5,
+        retry_seconds: float = 30,
+        digest_seconds: float = 10,
+    ):
+        self.send = send
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst, time.monotonic)
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.digest_seconds = digest_seconds
+        self._wakeup = asyncio.Event()
+
+    @classmethod
+    def from_config(
+        cls, send: Sender, notifications_config: dict
+    ) -> "NotificationDispatcher":
+        return cls(
+            send,
+            concurrency=notifications_config.get("concurrency", 5),
+            rate=notifications_config.get("rate", 5),
+            burst=notifications_config.get("burst", 5),
+            batch_size=notifications_config.get("batch_size", 100),
+            poll_seconds=notifications_config.get("poll_seconds", 5),
+            max_attempts=notifications_config.get("max_attempts", 5),
+            retry_seconds=notifications_config.get("retry_seconds", 30),
+            digest_seconds=notifications_config.get("digest_seconds", 10),
+        )
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _acquire(self):
+        while (wait := self.bucket.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    async def _send(
+        self,
+        user: models.User,
+        notifications: list[models.Notification],
+        semaphore: asyncio.Semaphore,
+    ) -> Union[bool, set[int], None]:
+        """Returns True if sent, False if undeliverable and None to retry, or the
+        ids of the notifications sent if only some were."""
+        wait_start = time.monotonic()
+        async with semaphore:
+            await self._acquire()
+            metrics.SEMAPHORE_WAIT_SECONDS.observe(
+                time.monotonic() - wait_start, "notifications"
+            )
+            try:
+                return await self.send(user, notifications)
+            except PartiallySent as e:
+                logger.warning(
+                    "Sent %d of %d notifications to %s: %s",
+                    len(e.sent),
+                    len(notifications),
+                    user,
+                    e.__cause__,
+                )
+                return {notification.id for notification in e.sent}
+            except Exception as e:
+                logger.warning(
+                    "Failed sending %d notifications to %s: %s",
+                    len(notifications),
+                    user,
+                    e,
+                )
+                return None
+
+    async def dispatch_pending(self) -> int:
+        """Sends one batch of due notifications. Returns how many were due."""
+        due = await models.get_pending_notifications(
+            self.batch_size,
+            datetime.now() - timedelta(seconds=self.digest_seconds),
+        )
+        if not due:
+            return 0
+        # Digests include the users' notifications that are not due yet.
+        by_user: dict[int, list[models.Notification]] = defaultdict(list)
+        for notification in await models.get_pending_notifications_of_users(
+            {notification.user_id for notification in due}
+        ):
+            by_user[notification.user_id].append(notification)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        user_results = await asyncio.gather(
+            *(
+                self._send(notifications[0].user, notifications, semaphore)
+                for notifications in by_user.values()
+            )
+        )
+
+        done, retry, failed = [], [], []
+        notified_users = defaultdict(list)
+        now = datetime.now()
+        sent = [
+            (notification, result)
+            for notifications, result in zip(by_user.values(), user_results)
+            for notification in notifications
+        ]
+        for notification, result in sent:
+            if isinstance(result, set):
+                result = True if notification.id in result else None
+            if result is True:
+                done.append(notification.id)
+                notified_users[notification.product_id].append(notification.user_id)
+                metrics.NOTIFICATION_LATENCY_SECONDS.observe(
+                    (now - notification.created_at).total_seconds()
+                )
+            elif result is False or notification.attempts + 1 >= self.max_attempts:
+                failed.append(notification.id)
+            else:
+                retry.append(notification)
+        metrics.NOTIFICATIONS.inc(len(done), "sent")
+        metrics.NOTIFICATIONS.inc(len(retry), "retry")
+        metrics.NOTIFICATIONS.inc(len(failed), "failed")
+        if done:
+            # Notified users are unsubscribed with one DELETE per product.
+            removed = await models.complete_notifications(done, notified_users)
+            for product_id, user_ids in removed.items():
+                logger.info(
+                    "Removed %d subscriptions to product %s", len(user_ids), product_id
+                )
+        if failed:
+            logger.error("Giving up on notifications: %s", failed)
+            await models.fail_notifications(failed)
+        # Notifications with the same attempt count share a backoff delay.
+        by_attempts = {}
+        for notification in retry:
+            by_attempts.setdefault(notification.attempts, []).append(notification.id)
+        for attempts, ids in by_attempts.items():
+            delay = self.retry_seconds * 2**attempts
+            await models.retry_notifications(
+                ids, datetime.now() + timedelta(seconds=delay)
+            )
+        logger.info(
+            "Dispatched %d notifications in %d messages, %d to retry, %d failed",
+            len(done),
+            len(by_user),
+            len(retry),
+            len(failed),
+        )
+        return len(due)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                taken = await self.dispatch_pending()
+            except Exception as e:
+                logger.exception("Error dispatching notifications: %s", e)
+                taken = 0
+            if taken >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+global_dispatcher: Optional[NotificationDispatcher] = None
+
+
+def wake_dispatcher():
+    """Tells an in-process dispatcher that new notifications were queued."""
+    if global_dispatcher is not None:
+        global_dispatcher.wake()
@@ -0,0 +1,172 @@
+"""Per-host plugins that check stock through a retailer's JSON endpoints.
+
+Checking a product normally downloads its whole HTML page to search for the
+indicator. An extractor instead rewrites product URLs to a small availability
+endpoint of the retailer and reads the stock state from it, optionally for many
+products in one request. Hosts are mapped to plugins in the ``extractors``
+config section; hosts without one keep using the indicator regexes.
+
+The endpoint's availability replaces the indicator: products on a host with an
+extractor are in stock when the retailer says so, whatever their indicator.
+Only pages the extractor has no item id for still use their indicator.
+"""
+
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Type
+from urllib.parse import quote, urlsplit, urlunsplit
+
+PLUGINS: dict[str, Type["Extractor"]] = {}
+
+
+class ExtractorError(Exception):
+    pass
+
+
+def register(name: str) -> Callable[[Type["Extractor"]], Type["Extractor"]]:
+    """Class decorator making an extractor available to the config as ``name``."""
+
+    def decorator(cls: Type["Extractor"]) -> Type["Extractor"]:
+        cls.name = name
+        PLUGINS[name] = cls
+        return cls
+
+    return decorator
+
+
+class Extractor(ABC):
+    """Maps product pages to items of an endpoint and parses their availability.
+
+    ``batch_size`` is the most items one request may ask for.
+    """
+
+    name = ""
+    batch_size = 1
+
+    def __init__(self, options: dict):
+        self.options = options
+
+    @abstractmethod
+    def item_id(self, url: str) -> Optional[str]:
+        """Returns the endpoint's id for a product page, or None if it has none."""
+
+    @abstractmethod
+    def endpoint(self, url: str, item_ids: list[str]) -> str:
+        """Returns the URL to fetch the items from, given one of their pages."""
+
+    @abstractmethod
+    def parse(self, body: str, item_ids: list[str]) -> dict[str, bool]:
+        """Returns whether each item found in the response is available."""
+
+
+@register("shopify")
+class ShopifyExtractor(Extractor):
+    """Reads /products/<handle>.js, the storefront's product JSON, which is a
+    fraction of the size of the product page."""
+
+    PRODUCT_PATH = re.compile(r"/products/([^/?#.]+)")
+
+    def item_id(self, url: str) -> Optional[str]:
+        match = self.PRODUCT_PATH.search(urlsplit(url).path)
+        return match.group(1) if match else None
+
+    def endpoint(self, url: str, item_ids: list[str]) -> str:
+        parts = urlsplit(url)
+        path = f"/products/{quote(item_ids[0])}.js"
+        return urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+
+    def parse(self, body: str, item_ids: list[str]) -> dict[str, bool]:
+        product = json.loads(body)
+        if "available" in product:
+            available = bool(product["available"])
+        else:
+            variants = product.get("variants", [])
+            available = any(variant.get("available") for variant in variants)
+        return {item_ids[0]: available}
+
+
+@register("json_api")
+class JsonApiExtractor(Extractor):
+    """A retailer API answering for many items at once, configured per host.
+
+    ``endpoint`` is a URL template with ``{ids}`` replaced by the item ids joined
+    with ``separator``, and ``id_pattern`` a regex whose first group is the item
+    id in a product URL. The response is either an object mapping ids to items,
+    or a list of items (under ``items_field`` if given) holding their id in
+    ``id_field``. An item is a bool or an object with ``available_field``.
+    """
+
+    def __init__(self, options: dict):
+        super().__init__(options)
+        try:
+            self.template = options["endpoint"]
+            self.id_pattern = re.compile(options["id_pattern"])
+        except KeyError as e:
+            raise ExtractorError(f"json_api extractor needs {e.args[0]}") from None
+        self.batch_size = options.get("batch_size", 50)
+        self.separator = options.get("separator", ",")
+        self.items_field = options.get("items_field")
+        self.id_field = options.get("id_field", "id")
+        self.available_field = options.get("available_field", "available")
+
+    def item_id(self, url: str) -> Optional[str]:
+        match = self.id_pattern.search(url)
+        return match.group(1) if match else None
+
+    def endpoint(self, url: str, item_ids: list[str]) -> str:
+        ids = self.separator.join(quote(item_id, safe="") for item_id in item_ids)
+        return self.template.format(ids=ids)
+
+    def _available(self, item) -> bool:
+        if isinstance(item, dict):
+            return bool(item.get(self.available_field))
+        return bool(item)
+
+    def parse(self, body: str, item_ids: list[str]) -> dict[str, bool]:
+        data = json.loads(body)
+        if self.items_field:
+            data = data[self.items_field]
+        if isinstance(data, dict):
+            items = data.items()
+        else:
+            items = ((str(item[self.id_field]), item) for item in data)
+        return {str(id): self._available(item) for id, item in items}
+
+
+class ExtractorRegistry:
+    """The extractor of every configured host."""
+
+    def __init__(self, extractors: Optional[dict[str, Extractor]] = None):
+        self.extractors = dict(extractors or {})
+
+    @classmethod
+    def from_config(cls, extractors_config: dict) -> "ExtractorRegistry":
+        extractors = {}
+        for host, options in extractors_config.items():
+            plugin = PLUGINS.get(options.get("plugin"))
+            if plugin is None:
+                raise ExtractorError(
+                    f"Unknown extractor {options.get('plugin')!r} for {host}, "
+                    f"expected one of {', '.join(PLUGINS)}"
+                )
+            extractors[host.lower()] = plugin(options)
+        return cls(extractors)
+
+    def __len__(self) -> int:
+        return len(self.extractors)
+
+    def get(self, host: str) -> Optional[Extractor]:
+        return self.extractors.get(host)
+
+    def for_url(self, url: str) -> Optional[Extractor]:
+        """Returns the extractor that checks a product page instead of its
+        indicator, if any."""
+        extractor = self.extractors.get(urlsplit(url).hostname or "")
+        if extractor is not None and extractor.item_id(url) is not None:
+            return extractor
+        return None
+
+    def batch_size(self, host: str) -> int:
+        extractor = self.extractors.get(host)
+        return extractor.batch_size if extractor else 1
@@ -0,0 +1,223 @@
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit for {host} is open, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class RetryLaterError(Exception):
+    """The host answered 429 or 503."""
+
+    def __init__(self, url: str, status: int, retry_after: Optional[float]):
+        super().__init__(f"{url} answered {status}, retry after {retry_after}s")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class HostHealth:
+    __slots__ = (
+        "state",
+        "results",
+        "consecutive_failures",
+        "latency",
+        "open_seconds",
+        "retry_at",
+        "probes",
+        "probe_started",
+        "last_error",
+    )
+
+    def __init__(self, window: int):
+        self.state = CLOSED
+        self.results = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.latency: Optional[float] = None
+        self.open_seconds = 0.0
+        self.retry_at = 0.0
+        self.probes = 0
+        self.probe_started = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def error_rate(self) -> float:
+        if not self.results:
+            return 0.0
+        return 1 - sum(self.results) / len(self.results)
+
+
+class HealthTracker:
+    """Per-host error rate, latency and circuit breaker.
+
+    After ``failure_threshold`` consecutive failures a host's circuit opens and no
+    requests are made to it for ``open_seconds``. Then up to ``half_open_probes``
+    requests are let through: a success closes the circuit, a failure opens it
+    again for twice as long, up to ``max_open_seconds``. 429 and 503 responses
+    pause the host for the ``Retry-After`` the server asked for.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_seconds: float = 60,
+        max_open_seconds: float = 900,
+        half_open_probes: int = 1,
+        window: int = 20,
+        latency_alpha: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_probes = half_open_probes
+        self.window = window
+        self.latency_alpha = latency_alpha
+        self.clock = clock
+        self.hosts: dict[str, HostHealth] = {}
+
+    @classmethod
+    def from_config(cls, health_config: dict) -> "HealthTracker":
+        return cls(
+            failure_threshold=health_config.get("failure_threshold", 5),
+            open_seconds=health_config.get("open_seconds", 60),
+            max_open_seconds=health_config.get("max_open_seconds", 900),
+            half_open_probes=health_config.get("half_open_probes", 1),
+            window=health_config.get("window", 20),
+        )
+
+    def host(self, host: str) -> HostHealth:
+        health = self.hosts.get(host)
+        if health is None:
+            health = HostHealth(self.window)
+            self.hosts[host] = health
+        return health
+
+    def ready_in(self, host: str) -> float:
+        """Seconds until a request to the host may be made, 0 if it may be now."""
+        health = self.hosts.get(host)
+        if health is None:
+            return 0.0
+        now = self.clock()
+        if health.retry_at > now:
+            return health.retry_at - now
+        if health.state == OPEN:
+            health.state = HALF_OPEN
+            health.probes = 0
+        if health.state == HALF_OPEN and health.probes >= self.half_open_probes:
+            if now - health.probe_started > self.max_open_seconds:
+                # The probes never reported back, e.g. their task was cancelled.
+                health.probes = 0
+                return 0.0
+            # Wait for the outstanding probes to report back.
+            return max(health.open_seconds / 10, 1.0)
+        return 0.0
+
+    def begin(self, host: str):
+        """Marks the start of a request that ready_in() allowed."""
+        health = self.hosts.get(host)
+        if health is not None and health.state == HALF_OPEN:
+            health.probes += 1
+            health.probe_started = self.clock()
+
+    def _observe_latency(self, health: HostHealth, latency: Optional[float]):
+        if latency is None:
+            return
+        if health.latency is None:
+            health.latency = latency
+        else:
+            health.latency += self.latency_alpha * (latency - health.latency)
+
+    def record_success(self, host: str, latency: Optional[float] = None):
+        health = self.host(host)
+        self._observe_latency(health, latency)
+        health.results.append(True)
+        health.consecutive_failures = 0
+        if health.state != CLOSED:
+            health.state = CLOSED
+            health.open_seconds = 0.0
+            health.probes = 0
+
+    def record_failure(
+        self,
+        host: str,
+        error: str,
+        latency: Optional[float] = None,
+        retry_after: Optional[float] = None,
+    ):
+        health = self.host(host)
+        self._observe_latency(health, latency)
+        health.results.append(False)
+        health.consecutive_failures += 1
+        health.last_error = error
+        now = self.clock()
+        if health.state == HALF_OPEN:
+            self._open(health, now, min(health.open_seconds * 2, self.max_open_seconds))
+        elif (
+            health.state == CLOSED
+            and health.consecutive_failures >= self.failure_threshold
+        ):
+            self._open(health, now, self.open_seconds)
+        if retry_after is not None:
+            health.retry_at = max(health.retry_at, now + retry_after)
+
+    def _open(self, health: HostHealth, now: float, seconds: float):
+        health.state = OPEN
+        health.open_seconds = seconds
+        health.retry_at = now + seconds
+        health.probes = 0
+
+    def is_degraded(self, host: str) -> bool:
+        health = self.hosts.get(host)
+        if health is None:
+            return False
+        return (
+            health.state != CLOSED
+            or health.retry_at > self.clock()
+            or health.error_rate >= 0.5
+        )
+
+    def snapshot(self, host: str) -> dict:
+        health = self.host(host)
+        return {
+            "state": health.state,
+            "error_rate": round(health.error_rate, 3),
+            "latency": None if health.latency is None else round(health.latency, 3),
+            "consecutive_failures": health.consecutive_failures,
+            "retry_in": round(max(health.retry_at - self.clock(), 0.0), 1),
+            "last_error": health.last_error,
+        }
+
+    def degraded_hosts(self) -> dict[str, dict]:
+        return {
+            host: self.snapshot(host) for host in self.hosts if self.is_degraded(host)
+        }
+
+
+global_host_health = HealthTracker()
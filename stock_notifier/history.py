@@ -0,0 +1,138 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from stock_notifier import models
+from stock_notifier.logger import logger
+
+
+class CheckHistory:
+    """Write-behind buffer of check results.
+
+    Results are kept in memory and written with one executemany once
+    ``batch_size`` are buffered or ``flush_seconds`` have passed. Every
+    ``compact_seconds``, raw results older than ``retention_hours`` are rolled up
+    into hourly stats per host, which are kept for ``hourly_retention_days``.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        flush_seconds: float = 10,
+        max_buffer: int = 50000,
+        retention_hours: float = 48,
+        hourly_retention_days: float = 90,
+        compact_seconds: float = 3600,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.retention_hours = retention_hours
+        self.hourly_retention_days = hourly_retention_days
+        self.compact_seconds = compact_seconds
+        self.clock = clock
+        self._buffer: list[dict] = []
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+
+    @classmethod
+    def from_config(cls, history_config: dict) -> "CheckHistory":
+        return cls(
+            batch_size=history_config.get("batch_size", 500),
+            flush_seconds=history_config.get("flush_seconds", 10),
+            max_buffer=history_config.get("max_buffer", 50000),
+            retention_hours=history_config.get("retention_hours", 48),
+            hourly_retention_days=history_config.get("hourly_retention_days", 90),
+            compact_seconds=history_config.get("compact_seconds", 3600),
+        )
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def record(
+        self,
+        url: str,
+        host: str,
+        status: Optional[int] = None,
+        latency: Optional[float] = None,
+        size: int = 0,
+        not_modified: bool = False,
+        changed: bool = False,
+        matched: bool = False,
+        error: Optional[str] = None,
+    ):
+        if len(self._buffer) >= self.max_buffer:
+            # The database is unreachable for long; history is best effort.
+            self._dropped += 1
+            return
+        self._buffer.append(
+            dict(
+                checked_at=self.clock(),
+                url=url,
+                host=host,
+                status=status,
+                latency=latency,
+                size=size,
+                not_modified=not_modified,
+                changed=changed,
+                matched=matched,
+                error=error[:255] if error else None,
+            )
+        )
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Writes the buffered results. Returns how many were written."""
+        rows, self._buffer = self._buffer, []
+        try:
+            await models.save_check_results(rows)
+        except Exception:
+            self._buffer[:0] = rows
+            raise
+        if self._dropped:
+            logger.warning("Dropped %d check results, buffer was full", self._dropped)
+            self._dropped = 0
+        return len(rows)
+
+    async def compact(self) -> int:
+        now = self.clock()
+        # Only whole hours are rolled up, so each hour is aggregated once.
+        before = (now - timedelta(hours=self.retention_hours)).replace(
+            minute=0, second=0, microsecond=0
+        )
+        compacted = await models.compact_check_results(
+            before, now - timedelta(days=self.hourly_retention_days)
+        )
+        logger.info("Compacted %d check results older than %s", compacted, before)
+        return compacted
+
+    async def run(self):
+        compacted_at = None
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if (
+                    compacted_at is None
+                    or time.monotonic() - compacted_at >= self.compact_seconds
+                ):
+                    await self.compact()
+                    compacted_at = time.monotonic()
+            except Exception as e:
+                logger.exception("Error saving check history: %s", e)
+
+
+global_check_history: Optional[CheckHistory] = None
+
+
+def record_check(url: str, host: str, **kwargs):
+    """Buffers a check result if an in-process history is running."""
+    if global_check_history is not None:
+        global_check_history.record(url, host, **kwargs)
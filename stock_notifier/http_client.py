@@ -0,0 +1,153 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import aiohttp
+
+from stock_notifier import metrics
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:134.0) Gecko/20100101 Firefox/134.0"
+)
+HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Connection": "keep-alive",
+    "DNT": "1",
+}
+
+
+class HttpClient:
+    """Process-wide HTTP connection pool shared by every scraper cycle.
+
+    Keeps keep-alive connections and resolved DNS entries across cycles and
+    caps the number of concurrent connections per host.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 5,
+        host_limits: dict[str, int] | None = None,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        timeout: float = 30,
+        headers: dict[str, str] | None = None,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.host_limits = dict(host_limits or {})
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.headers = HEADERS if headers is None else headers
+        self.session: aiohttp.ClientSession | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._counters = dict.fromkeys(
+            [
+                "requests",
+                "request_errors",
+                "connections_created",
+                "connections_reused",
+                "dns_cache_hits",
+                "dns_cache_misses",
+            ],
+            0,
+        )
+
+    @classmethod
+    def from_config(cls, client_config: dict) -> "HttpClient":
+        return cls(
+            limit=client_config.get("limit", 100),
+            limit_per_host=client_config.get("limit_per_host", 5),
+            host_limits=client_config.get("host_limits", {}),
+            dns_cache_ttl=client_config.get("dns_cache_ttl", 300),
+            keepalive_timeout=client_config.get("keepalive_timeout", 30),
+            timeout=client_config.get("timeout", 30),
+        )
+
+    async def start(self):
+        if self.session is not None:
+            return
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(self._count("requests"))
+        trace_config.on_request_exception.append(self._count("request_errors"))
+        trace_config.on_connection_create_end.append(self._count("connections_created"))
+        trace_config.on_connection_reuseconn.append(self._count("connections_reused"))
+        trace_config.on_dns_cache_hit.append(self._count("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(self._count("dns_cache_misses"))
+        # Per-host caps are enforced with semaphores in get() so that individual
+        # hosts can be configured above or below the default.
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=0,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=self.headers,
+            trace_configs=[trace_config],
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self) -> "HttpClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _count(self, name: str):
+        async def on_signal(session, trace_config_ctx, params):
+            self._counters[name] += 1
+
+        return on_signal
+
+    def host_limit(self, host: str) -> int:
+        return self.host_limits.get(host, self.limit_per_host)
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.host_limit(host))
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs):
+        if self.session is None:
+            raise RuntimeError("HttpClient used before start()")
+        wait_start = time.monotonic()
+        async with self._host_semaphore(urlparse(url).hostname):
+            metrics.SEMAPHORE_WAIT_SECONDS.observe(
+                time.monotonic() - wait_start, "host_connections"
+            )
+            async with self.session.get(url, **kwargs) as response:
+                yield response
+
+    def open_sockets(self) -> int:
+        if self.session is None:
+            return 0
+        connector = self.session.connector
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return idle + len(getattr(connector, "_acquired", ()))
+
+    def stats(self) -> dict:
+        created = self._counters["connections_created"]
+        reused = self._counters["connections_reused"]
+        total = created + reused
+        return {
+            **self._counters,
+            "reuse_ratio": reused / total if total else 0.0,
+            "open_sockets": self.open_sockets(),
+        }
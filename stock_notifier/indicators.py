@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import re
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional
+
+from stock_notifier import metrics, models
+from stock_notifier.logger import logger
+
+if TYPE_CHECKING:
+    from stock_notifier.regex_pool import RegexPool
+
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]|()")
+
+
+def literal_of(pattern: str) -> Optional[str]:
+    """Returns the plain text a pattern matches if it is only escaped literals, else None.
+
+    Indicators registered with ``regex=False`` are stored ``re.escape``d, so this
+    recovers the original text for them.
+    """
+    chars = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                # \\d, \\b, \\n and friends are regex syntax, not literals.
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            chars.append(char)
+    if escaped:
+        return None
+    return "".join(chars)
+
+
+class CompiledIndicator(NamedTuple):
+    pattern: str
+    literal: Optional[str]
+    regex: Optional[re.Pattern]
+
+
+class LiteralSetMatcher:
+    """Finds which of many literals occur in a document.
+
+    Each literal is searched with ``in``, whose C search skips through the text
+    far faster than a regex alternation tried at every position. Literals
+    contained in a longer literal that was found aren't searched again.
+    """
+
+    def __init__(self, literals: Iterable[str]):
+        self.literals = sorted(set(literals), key=len, reverse=True)
+        self._contained = {
+            literal: [other for other in self.literals[i + 1 :] if other in literal]
+            for i, literal in enumerate(self.literals)
+        }
+
+    def find(self, text: str) -> set[str]:
+        found = set()
+        for literal in self.literals:
+            if literal not in found and literal in text:
+                found.add(literal)
+                found.update(self._contained[literal])
+        return found
+
+
+class IndicatorEngine:
+    """Compiles each product's indicator once and evaluates many against a document.
+
+    Literal indicators on the same page are matched together with a
+    ``LiteralSetMatcher``; only real regular expressions are searched one by one,
+    in the ``pool`` when one is set so a slow pattern can't block the event loop.
+    """
+
+    def __init__(
+        self, max_literal_sets: int = 1024, pool: Optional["RegexPool"] = None
+    ):
+        self.max_literal_sets = max_literal_sets
+        self.pool = pool
+        self._compiled: dict[int, CompiledIndicator] = {}
+        self._literal_sets: OrderedDict[frozenset, LiteralSetMatcher] = OrderedDict()
+
+    def compile(self, product: models.Product) -> CompiledIndicator:
+        compiled = self._compiled.get(product.id)
+        if compiled is not None and compiled.pattern == product.indicator:
+            return compiled
+        compiled = compile_indicator(product.indicator)
+        if product.id is not None:
+            self._compiled[product.id] = compiled
+        return compiled
+
+    def invalidate(self, product_id: int):
+        self._compiled.pop(product_id, None)
+
+    def on_product_event(self, event: str, product: models.Product):
+        if event == "deleted":
+            self.invalidate(product.id)
+
+    def _literal_set(self, literals: frozenset) -> LiteralSetMatcher:
+        matcher = self._literal_sets.get(literals)
+        if matcher is None:
+            matcher = LiteralSetMatcher(literals)
+            self._literal_sets[literals] = matcher
+            while len(self._literal_sets) > self.max_literal_sets:
+                self._literal_sets.popitem(last=False)
+        else:
+            self._literal_sets.move_to_end(literals)
+        return matcher
+
+    async def match(
+        self, products: Iterable[models.Product], text: str
+    ) -> dict[str, bool]:
+        """Returns whether each product's indicator pattern matches the text."""
+        compiled = {}
+        for product in products:
+            indicator = self.compile(product)
+            compiled[indicator.pattern] = indicator
+        return await self.evaluate(compiled, text)
+
+    async def evaluate(
+        self, compiled: dict[str, CompiledIndicator], text: str
+    ) -> dict[str, bool]:
+        if self.pool is None:
+            with metrics.MATCH_SECONDS.time("all"):
+                return self.match_compiled(compiled, text)
+        regexes = [p for p, c in compiled.items() if c.regex is not None]
+        with metrics.MATCH_SECONDS.time("literal"):
+            results = self.match_compiled(
+                {p: c for p, c in compiled.items() if c.regex is None}, text
+            )
+        if regexes:
+            with metrics.MATCH_SECONDS.time("regex"):
+                matched = await asyncio.gather(
+                    *(self.pool.search(p, text) for p in regexes)
+                )
+            results.update(zip(regexes, matched))
+        return results
+
+    def match_compiled(
+        self, compiled: dict[str, CompiledIndicator], text: str
+    ) -> dict[str, bool]:
+        literals = {c.literal for c in compiled.values() if c.literal is not None}
+        if len(literals) > 1:
+            found = self._literal_set(frozenset(literals)).find(text)
+        else:
+            found = {literal for literal in literals if literal in text}
+
+        results = {}
+        for pattern, indicator in compiled.items():
+            if indicator.literal is not None:
+                results[pattern] = indicator.literal in found
+            elif indicator.regex is not None:
+                results[pattern] = indicator.regex.search(text) is not None
+            else:
+                results[pattern] = False
+        return results
+
+    def stream_matcher(
+        self, products: Iterable[models.Product], regex_overlap: int
+    ) -> "StreamMatcher":
+        return StreamMatcher(
+            self, [self.compile(product) for product in products], regex_overlap
+        )
+
+
+class StreamMatcher:
+    """Evaluates indicators incrementally over the decoded chunks of one document.
+
+    Each chunk is searched together with the tail of the previous one so matches
+    crossing a chunk boundary are found. Literals need ``len(literal) - 1``
+    characters of overlap; regex matches longer than ``regex_overlap`` characters,
+    or relying on anchors, can be missed.
+    """
+
+    def __init__(
+        self,
+        engine: IndicatorEngine,
+        compiled: list[CompiledIndicator],
+        regex_overlap: int,
+    ):
+        self.engine = engine
+        self.compiled = {indicator.pattern: indicator for indicator in compiled}
+        self.regex_overlap = regex_overlap
+        self.reset()
+
+    def reset(self):
+        self.results = dict.fromkeys(self.compiled, False)
+        self._pending = dict(self.compiled)
+        self._tail = ""
+
+    @property
+    def done(self) -> bool:
+        return not self._pending
+
+    def _overlap(self) -> int:
+        overlap = 0
+        for indicator in self._pending.values():
+            if indicator.literal is not None:
+                overlap = max(overlap, len(indicator.literal) - 1)
+            elif indicator.regex is not None:
+                overlap = max(overlap, self.regex_overlap)
+        return overlap
+
+    async def feed(self, text: str) -> bool:
+        """Searches the next chunk. Returns True once every indicator has matched."""
+        window = self._tail + text
+        for pattern, matched in (
+            await self.engine.evaluate(self._pending, window)
+        ).items():
+            if matched:
+                self.results[pattern] = True
+                del self._pending[pattern]
+        overlap = self._overlap()
+        self._tail = window[-overlap:] if overlap else ""
+        return self.done
+
+
+# Many products share an indicator, and compiled indicators are immutable.
+@functools.lru_cache(maxsize=4096)
+def compile_indicator(pattern: str) -> CompiledIndicator:
+    literal = literal_of(pattern)
+    if literal is not None:
+        return CompiledIndicator(pattern, literal, None)
+    try:
+        return CompiledIndicator(pattern, None, re.compile(pattern, re.DOTALL))
+    except re.error as e:
+        logger.error("Invalid indicator regex %r: %s", pattern, e)
+        return CompiledIndicator(pattern, None, None)
@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Bounded LRU cache whose entries expire ``ttl`` seconds after being stored."""
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._entries.pop(key, None)
+
+
+class DirectMessageDirectory:
+    """Caches the DM channel of each recipient by Discord id.
+
+    Looking up a user and opening a DM channel are REST calls; with the channel
+    cached, notifying a repeat recipient costs only the message itself.
+    """
+
+    def __init__(
+        self,
+        open_channel: Callable[[int], Awaitable[Any]],
+        max_entries: int = 1000,
+        ttl: float = 3600,
+    ):
+        self.open_channel = open_channel
+        self.cache: TTLCache[Any] = TTLCache(max_entries, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(
+        cls, open_channel: Callable[[int], Awaitable[Any]], notifications_config: dict
+    ) -> "DirectMessageDirectory":
+        return cls(
+            open_channel,
+            max_entries=notifications_config.get("user_cache_size", 1000),
+            ttl=notifications_config.get("user_cache_ttl", 3600),
+        )
+
+    async def get(self, discord_id: int):
+        channel = self.cache.get(discord_id)
+        if channel is not None:
+            self.hits += 1
+            return channel
+        self.misses += 1
+        channel = await self.open_channel(discord_id)
+        self.cache.put(discord_id, channel)
+        return channel
+
+    def invalidate(self, discord_id: int):
+        self.cache.pop(discord_id)
@@ -1,15 +1,23 @@
 import re
-from typing import List
+from typing import List, Optional
+from urllib.parse import urlsplit
 
 import discord
 import validators
 from dotenv import dotenv_values
 
-from stock_notifier import models
+from stock_notifier import health, models, regex_pool
+from stock_notifier.dispatcher import PartiallySent
+from stock_notifier.extractors import ExtractorRegistry
+from stock_notifier.interface.directory import DirectMessageDirectory
 from stock_notifier.logger import logger
+from stock_notifier.name_index import global_name_index
 
 config = dotenv_values(".env")
 
+# Discord rejects longer messages.
+MESSAGE_LIMIT = 2000
+
 
 class StockNotificationBot(discord.Bot):
     pass
@@ -20,17 +28,17 @@ bot = StockNotificationBot()
 
 @bot.event
 async def on_ready():
-    logger.info(f"{bot.user} is ready and online!")
+    logger.info("%s is ready and online!", bot.user)
 
 
 async def respond(ctx: discord.ApplicationContext, message: str):
     await ctx.respond(message, ephemeral=True)
-    logger.info(f"Responded to User {ctx.user.name}: {message}")
+    logger.info("Responded to User %s: %s", ctx.user.name, message)
 
 
 async def dm(user: discord.User, message: str):
     await user.send(message)
-    logger.info(f"DM'ed User {user.name}: {message}")
+    logger.info("DM'ed User %s: %s", user.name, message)
 
 
 @bot.slash_command(
@@ -56,8 +64,26 @@ async def register_product(
         return
     if not regex:
         indicator = re.escape(indicator)
+    elif regex_pool.global_regex_pool is not None:
+        error = await regex_pool.global_regex_pool.validate(indicator)
+        if error:
+            await respond(ctx, f"Indicator rejected! {error}")
+            return
     product = await models.add_product(name, url, indicator)
-    await respond(ctx, f"Successfully registered product: {product}")
+    message = f"Successfully registered product: {product}"
+    extractor = global_extractors.for_url(url)
+    if extractor is not None:
+        logger.warning(
+            "Indicator of %s is unused, %s checks it with %s",
+            product,
+            urlsplit(url).hostname,
+            extractor.name,
+        )
+        message += (
+            f"\nNote: stock on this site is read from the retailer's "
+            f"{extractor.name} data, so the indicator isn't used."
+        )
+    await respond(ctx, message)
 
 
 @bot.slash_command(name="sign_up", description="Sign up as a user.")
@@ -89,8 +115,19 @@ async def list_products(
     await respond(ctx, message)
 
 
+async def get_user_id(discord_id: int) -> Optional[int]:
+    user_id = global_name_index.user_id(discord_id)
+    if user_id is None:
+        user_id = await models.get_user_id(discord_id)
+        if user_id is not None:
+            global_name_index.remember_user(discord_id, user_id)
+    return user_id
+
+
 async def get_unsubscribed_product_names(ctx: discord.AutocompleteContext) -> List[str]:
-    return await models.get_unsubscribed_product_names(ctx.interaction.user.id)
+    user_id = await get_user_id(ctx.interaction.user.id)
+    await global_name_index.catch_up()
+    return global_name_index.unsubscribed_names(user_id, ctx.value or "")
 
 
 def filter_kwargs(kwargs: dict):
@@ -138,7 +175,8 @@ async def subscribe(
 
 
 async def get_subscribed_product_names(ctx: discord.AutocompleteContext) -> List[str]:
-    return await models.get_subscribed_product_names(ctx.interaction.user.id)
+    user_id = await get_user_id(ctx.interaction.user.id)
+    return global_name_index.subscribed_names(user_id, ctx.value or "")
 
 
 @bot.slash_command(
@@ -172,25 +210,94 @@ async def unsubscribe(
         await respond(ctx, f"Unsubscribed from product: {p}")
 
 
-async def notify(discord_id: int, product: models.Product):
+def digest_parts(
+    products: List[models.Product], limit: int = MESSAGE_LIMIT
+) -> List[tuple[str, List[models.Product]]]:
+    """The messages telling a user that products are in stock, within Discord's
+    message length limit, each with the products it lists."""
+    if len(products) == 1:
+        product = products[0]
+        return [
+            (
+                f"Product {product.name} in stock! URL: {product.url}\n"
+                f"Removed subscription to: {product}",
+                [product],
+            )
+        ]
+    parts = [
+        (
+            f"{len(products)} of your products are in stock! "
+            f"Removed your subscriptions to them.",
+            [],
+        )
+    ]
+    for product in products:
+        line = f"- {product.name}: {product.url}"
+        message, listed = parts[-1]
+        if len(message) + 1 + len(line) > limit:
+            parts.append((line, [product]))
+        else:
+            parts[-1] = (message + "\n" + line, listed + [product])
+    return parts
+
+
+def format_digest(
+    products: List[models.Product], limit: int = MESSAGE_LIMIT
+) -> List[str]:
+    return [message for message, _ in digest_parts(products, limit)]
+
+
+async def open_dm_channel(discord_id: int) -> discord.DMChannel:
+    user = bot.get_user(discord_id) or await bot.fetch_user(discord_id)
+    return user.dm_channel or await user.create_dm()
+
+
+global_dm_directory = DirectMessageDirectory(open_dm_channel)
+# Extractors of the scraper's config, to tell users their indicator is unused.
+global_extractors = ExtractorRegistry()
+# The scraper's tracker when it runs in this process, None in bot-only mode.
+global_host_health: Optional[health.HealthTracker] = None
+
+
+async def send_digest(
+    user: models.User, notifications: List[models.Notification]
+) -> bool:
+    """DMs a user one digest of their in-stock products. Returns False if the user
+    can't be reached.
+
+    The dispatcher removes the subscriptions of notified users in bulk afterwards.
+    Raises PartiallySent with the notifications already delivered if a digest
+    spanning several messages fails after its first one.
+    """
+    if not user.discord_id:
+        return False
     try:
-        user = await bot.fetch_user(discord_id)
+        channel = await global_dm_directory.get(user.discord_id)
     except discord.NotFound:
-        logger.exception(f"Couldn't find discord user id: {discord_id}")
-        await models.remove_discord_subscription(discord_id)
-        return
+        logger.exception("Couldn't find discord user id: %s", user.discord_id)
+        await models.remove_discord_subscription(user.discord_id)
+        return False
 
+    by_product = {n.product.id: n for n in notifications}
+    delivered = []
     try:
-        await dm(user, f"Product {product.name} in stock! URL: {product.url}")
-    except discord.Forbidden:
-        logger.warning(f"Don't have permission to message user: {user}")
-        return
-
-    removed_subscription = await models.remove_discord_subscription(
-        discord_id, id=product.id
+        for message, products in digest_parts([n.product for n in notifications]):
+            await channel.send(message)
+            delivered.extend(by_product[product.id] for product in products)
+    except discord.HTTPException as e:
+        global_dm_directory.invalidate(user.discord_id)
+        if delivered:
+            # Only the rest is retried, the user already has these.
+            raise PartiallySent(delivered) from e
+        if isinstance(e, discord.Forbidden):
+            logger.warning("Don't have permission to message user: %s", user)
+            return False
+        # The cached channel may be stale; open it again on the retry.
+        raise
+    logger.info(
+        "DM'ed User %s about %d products in stock", user.name, len(notifications)
     )
-    if removed_subscription:
-        await dm(user, f"Removed subscription to: {product}")
+    return True
 
 
 @bot.slash_command(
@@ -211,8 +318,40 @@ async def test_notify(ctx: discord.ApplicationContext):
         )
 
 
+@bot.slash_command(
+    name="host_health", description="List retailers that are failing or throttled."
+)
+async def host_health(ctx: discord.ApplicationContext):
+    if global_host_health is None:
+        message = (
+            "Host health is only known to the scraper, which doesn't run alongside "
+            "this bot."
+        )
+    elif not (degraded_hosts := global_host_health.degraded_hosts()):
+        message = "All hosts are healthy."
+    else:
+        message = "Degraded hosts:"
+        for host, snapshot in degraded_hosts.items():
+            message += (
+                f"\n{host}: {snapshot['state']}, "
+                f"error rate {snapshot['error_rate']:.0%}, "
+                f"latency {snapshot['latency']}s, retry in {snapshot['retry_in']}s"
+            )
+    quarantined = await models.get_quarantined_products()
+    if quarantined:
+        message += "\nProducts whose indicator ran too long and is no longer checked:"
+        for i, (id, name, indicator) in enumerate(quarantined):
+            line = f"\n{id}: {name} `{indicator}`"
+            if len(message) + len(line) > MESSAGE_LIMIT - 20:
+                message += f"\nand {len(quarantined) - i} more"
+                break
+            message += line
+    await respond(ctx, message)
+
+
 async def get_product_names(ctx: discord.AutocompleteContext):
-    return await models.get_product_names()
+    await global_name_index.catch_up()
+    return global_name_index.search(ctx.value or "")
 
 
 @bot.slash_command(name="delete_product", description="Remove a registered product.")
@@ -1,37 +1,237 @@
-import datetime
+import atexit
+import gzip
 import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
 from pathlib import Path
+from typing import Iterable, Optional
 
+from stock_notifier import config
 
-def setup_logger():
-    # Get the current date and time
-    current_time = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+LOG_DIR = Path(__file__).parent.parent.joinpath("logs")
+FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+
+
+class Join:
+    """Joins items with commas when the log record is formatted, not when logged."""
+
+    __slots__ = ("items", "attribute")
+
+    def __init__(self, items: Iterable, attribute: Optional[str] = None):
+        self.items = items
+        self.attribute = attribute
+
+    def __str__(self) -> str:
+        if self.attribute is None:
+            return ", ".join(map(str, self.items))
+        return ", ".join(str(getattr(item, self.attribute)) for item in self.items)
+
+
+class SampleFilter(logging.Filter):
+    """Passes one in ``every`` records and at most ``max_per_second`` a second."""
+
+    def __init__(self, every: int = 1, max_per_second: Optional[float] = None):
+        super().__init__()
+        self.every = max(every, 1)
+        self.max_per_second = max_per_second
+        self.suppressed = 0
+        self._seen = 0
+        self._window = 0
+        self._window_count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        self._seen += 1
+        if self._seen % self.every:
+            self.suppressed += 1
+            return False
+        if self.max_per_second is not None:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._window_count = window, 0
+            if self._window_count >= self.max_per_second:
+                self.suppressed += 1
+                return False
+            self._window_count += 1
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting them.
+
+    The stock QueueHandler merges the message and arguments before enqueueing,
+    which is the formatting cost this handler exists to move off the event
+    loop. Records are dropped, and counted, when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        dict(
+                            name=record.name,
+                            levelno=logging.WARNING,
+                            levelname="WARNING",
+                            msg="Dropped %d log records, the log queue was full",
+                            args=(dropped,),
+                        )
+                    )
+                )
+            except queue.Full:
+                self.dropped += dropped
+
+
+def gzip_namer(name: str) -> str:
+    return name + ".gz"
 
-    # Create a logger
-    logger = logging.getLogger("stock-notifier")
-    logger.setLevel(logging.DEBUG)
 
-    # Create a formatter for the log messages
-    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+def gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def create_file_handler(logging_config: dict) -> logging.Handler:
+    directory = Path(logging_config.get("directory", LOG_DIR))
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory.joinpath(logging_config.get("file", "stock-notifier.log"))
+    backup_count = logging_config.get("backup_count", 10)
+    # With delay, the file is only opened when the first record is written.
+    if logging_config.get("rotate", "size") == "time":
+        handler = TimedRotatingFileHandler(
+            path,
+            when=logging_config.get("when", "midnight"),
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+    else:
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=logging_config.get("max_bytes", 10 * 1024 * 1024),
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+    if logging_config.get("compress", True):
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+    return handler
+
+
+class BlockingQueueListener(QueueListener):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Held while a record is written, so forks can wait for just that one.
+        self.handling = threading.Lock()
+
+    def handle(self, record: logging.LogRecord):
+        with self.handling:
+            super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Waits for room rather than failing to stop when the queue is full.
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """The event loop only enqueues records; a listener thread writes them out.
+
+    The listener is paused around forks, between two records, and the queue is
+    locked, so worker processes are never forked while a handler or the queue
+    is locked. Records stay queued, so forking doesn't wait for them.
+    """
+
+    def __init__(self, handlers: list[logging.Handler], queue_size: int = 10000):
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.handler = DeferredQueueHandler(self.queue)
+        self.listener = BlockingQueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.listener._thread is None:
+                self.listener.start()
+
+    def stop(self):
+        """Writes out every queued record and stops the listener thread."""
+        with self._lock:
+            if self.listener._thread is not None:
+                self.listener.stop()
+
+    def pause(self):
+        self.listener.handling.acquire()
+        self.queue.mutex.acquire()
+
+    def resume(self):
+        self.queue.mutex.release()
+        self.listener.handling.release()
+
+
+def setup_logger(logging_config: dict) -> logging.Logger:
+    formatter = logging.Formatter(FORMAT)
 
-    # Create a console handler and set the level to INFO
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+    console_handler.setLevel(logging_config.get("console_level", "INFO"))
     console_handler.setFormatter(formatter)
 
-    # Create a file handler with the current date and time in the file name
-    log_dir = Path(__file__).parent.parent.joinpath("logs")
-    log_dir.mkdir(exist_ok=True)
-    log_file_path = log_dir.joinpath(f"{current_time}.log")
-    file_handler = logging.FileHandler(log_file_path)
-    file_handler.setLevel(logging.DEBUG)
+    file_handler = create_file_handler(logging_config)
+    file_handler.setLevel(logging_config.get("level", "DEBUG"))
     file_handler.setFormatter(formatter)
 
-    # Add the handlers to the logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    global pipeline
+    pipeline = LogPipeline(
+        [console_handler, file_handler], logging_config.get("queue_size", 10000)
+    )
+    pipeline.start()
 
+    logger = logging.getLogger("stock-notifier")
+    # Records below every handler's level are discarded before they are built.
+    logger.setLevel(min(console_handler.level, file_handler.level))
+    logger.addHandler(pipeline.handler)
     return logger
 
 
-logger = setup_logger()
+logging_config = config.get("logging", {})
+pipeline: Optional[LogPipeline] = None
+logger = setup_logger(logging_config)
+# Per product "Checking ..." lines, sampled to keep large catalogs readable.
+check_logger = logger.getChild("checks")
+check_logger.addFilter(
+    SampleFilter(
+        logging_config.get("check_sample_every", 1),
+        logging_config.get("check_max_per_second"),
+    )
+)
+
+atexit.register(pipeline.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=pipeline.pause,
+        after_in_parent=pipeline.resume,
+        after_in_child=pipeline.resume,
+    )
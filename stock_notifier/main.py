@@ -1,30 +1,281 @@
+import argparse
 import asyncio
+import importlib
+import signal
+from contextlib import AsyncExitStack
+from typing import Optional
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from stock_notifier import config, diagnostics, metrics, models, regex_pool, storage
+from stock_notifier.logger import logger
 
-from stock_notifier import models
-from stock_notifier.interface.discord import start_bot
-from stock_notifier.scraper import scraper_loop
+# Modules only some modes run, imported on demand so that the scraper never
+# loads py-cord and the bot never loads the scraping pipeline.
+SCRAPE_MODULES = (
+    "stock_notifier.extractors",
+    "stock_notifier.health",
+    "stock_notifier.history",
+    "stock_notifier.http_client",
+    "stock_notifier.response_cache",
+    "stock_notifier.scraper",
+    "stock_notifier.sharding",
+)
+BOT_MODULES = (
+    "stock_notifier.dispatcher",
+    "stock_notifier.interface.directory",
+    "stock_notifier.interface.discord",
+    "stock_notifier.name_index",
+)
+MODE_MODULES = {
+    "all": SCRAPE_MODULES + BOT_MODULES,
+    "scrape": SCRAPE_MODULES,
+    "bot": BOT_MODULES,
+}
 
 
-async def main():
-    engine = create_async_engine(
-        "sqlite+aiosqlite:///sqlite.db",
+def import_mode(mode: str):
+    """Imports every module a mode runs."""
+    for name in MODE_MODULES[mode]:
+        importlib.import_module(name)
+
+
+async def open_client(
+    stack: AsyncExitStack, record: Optional[str] = None, replay: Optional[str] = None
+):
+    """Opens the scraper's HTTP client, recording every page into a cassette or
+    replaying them from one when asked."""
+    from stock_notifier import scraper
+    from stock_notifier.http_client import HttpClient
+
+    cassette_config = config.get("cassette", {})
+    if replay:
+        from stock_notifier.cassette import Cassette, ReplayClient
+
+        cassette = stack.enter_context(
+            Cassette(replay, use_mmap=cassette_config.get("mmap", True))
+        )
+        logger.info("Replaying %d pages from %s", len(cassette), replay)
+        return ReplayClient(cassette)
+    client = await stack.enter_async_context(
+        HttpClient.from_config(config.get("http_client", {}))
+    )
+    if record:
+        from stock_notifier.cassette import CassetteWriter, RecordingClient
+
+        writer = stack.enter_context(
+            CassetteWriter(record, cassette_config.get("compression_level", 6))
+        )
+        return RecordingClient(client, writer, scraper.MAX_BODY_BYTES)
+    return client
+
+
+async def start_scraper(
+    stack: AsyncExitStack,
+    sharded: bool,
+    worker_id: Optional[str],
+    record: Optional[str] = None,
+    replay: Optional[str] = None,
+) -> list:
+    """Sets up the scraper and returns the coroutines to run."""
+    from stock_notifier import health, history, scraper, sharding
+    from stock_notifier.extractors import ExtractorRegistry
+    from stock_notifier.response_cache import ResponseCache
+
+    pool = regex_pool.global_regex_pool
+    pool.quarantined.update(await models.get_quarantined_patterns())
+    pool.on_quarantine = models.quarantine_pattern
+    scraper.global_indicator_engine.pool = pool
+    health.global_host_health = health.HealthTracker.from_config(
+        config.get("host_health", {})
+    )
+    scraper.global_extractors = ExtractorRegistry.from_config(
+        config.get("extractors", {})
+    )
+    sharding_config = config.get("sharding", {})
+    if replay:
+        # Replays never take leases from live workers nor message subscribers.
+        detections = []
+
+        async def record_detection(product: models.Product):
+            detections.append(product.id)
+            logger.info("Replay detected product in stock: %s", product)
+
+        scraper.notify = record_detection
+        stack.callback(
+            lambda: logger.info("Replay detected %d products in stock", len(detections))
+        )
+    elif sharded or sharding_config.get("enabled", False):
+        scraper.global_shard = sharding.ShardCoordinator.from_config(
+            sharding_config, worker_id
+        )
+        # Products are mostly added through another process.
+        scraper.PRODUCT_RESYNC_SECONDS = sharding_config.get("product_resync", 300)
+
+    response_cache = ResponseCache.from_config(config.get("response_cache", {}))
+    if replay:
+        # Validators of replayed pages don't belong with the live ones.
+        response_cache.path = None
+    if scraper.global_shard is not None and response_cache.path is not None:
+        # Each worker caches its own hosts.
+        path = response_cache.path
+        response_cache.path = path.with_name(
+            f"{path.stem}.{scraper.global_shard.worker_id}{path.suffix}"
+        )
+    response_cache.load()
+    scraper.global_response_cache = response_cache
+    stack.callback(response_cache.save)
+    models.add_product_listener(scraper.global_registry.on_product_event)
+    models.add_product_listener(scraper.global_poller.on_product_event)
+
+    history.global_check_history = history.CheckHistory.from_config(
+        config.get("check_history", {})
+    )
+    stack.push_async_callback(history.global_check_history.flush)
+
+    client = await open_client(stack, record, replay)
+    return [scraper.scraper_loop(client), history.global_check_history.run()]
+
+
+async def start_bot(host_health=None) -> list:
+    """Sets up the Discord bot and dispatcher and returns the coroutines to run.
+
+    ``host_health`` is the scraper's tracker when it runs in the same process.
+    """
+    from stock_notifier import dispatcher
+    from stock_notifier.extractors import ExtractorRegistry
+    from stock_notifier.interface import discord
+    from stock_notifier.interface.directory import DirectMessageDirectory
+    from stock_notifier.name_index import global_name_index
+
+    global_name_index.load(
+        await models.get_product_name_rows(), await models.get_subscription_rows()
     )
-    async_session = async_sessionmaker(engine, expire_on_commit=False)
-    models.global_async_session = async_session
-    async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    models.add_product_listener(global_name_index.on_product_event)
+    models.add_subscription_listener(global_name_index.on_subscription_event)
 
-    tasks = [asyncio.create_task(start_bot()), asyncio.create_task(scraper_loop())]
-    await asyncio.gather(*tasks)
+    discord.global_host_health = host_health
+    discord.global_extractors = ExtractorRegistry.from_config(
+        config.get("extractors", {})
+    )
+    notifications_config = config.get("notifications", {})
+    discord.global_dm_directory = DirectMessageDirectory.from_config(
+        discord.open_dm_channel, notifications_config
+    )
+    dispatcher.global_dispatcher = dispatcher.NotificationDispatcher.from_config(
+        discord.send_digest, notifications_config
+    )
+    return [discord.start_bot(), dispatcher.global_dispatcher.run()]
+
+
+async def main(
+    mode: str = "all",
+    worker_id: Optional[str] = None,
+    metrics_port: Optional[int] = None,
+    record: Optional[str] = None,
+    replay: Optional[str] = None,
+):
+    """Runs the scraper, the Discord bot and dispatcher, or both.
+
+    Scrape-only processes are workers that shard the hosts between them through
+    leases in the shared database. Their detections are queued in the
+    notification outbox, which the dispatcher of the bot process delivers.
+    """
+    if replay and mode != "scrape":
+        raise ValueError("Replays only run in scrape mode")
+    import_mode(mode)
+    # Started first so the workers are forked before any other thread exists.
+    regex_pool.global_regex_pool = regex_pool.RegexPool.from_config(
+        config.get("regex", {})
+    )
+    await regex_pool.global_regex_pool.start()
+
+    # Cleanups run in reverse, ending with the database and the regex pool.
+    async with AsyncExitStack() as stack:
+        stack.callback(regex_pool.global_regex_pool.close)
+        engine = await storage.setup(config.get("database", {}))
+        stack.push_async_callback(engine.dispose)
+
+        coroutines = []
+        if mode in ("all", "scrape"):
+            coroutines += await start_scraper(
+                stack, mode == "scrape", worker_id, record, replay
+            )
+        if mode == "all":
+            from stock_notifier import health
+
+            coroutines += await start_bot(health.global_host_health)
+        elif mode == "bot":
+            coroutines += await start_bot()
+
+        metrics_runner = await metrics.start_server(
+            port=metrics_port or metrics.METRICS_PORT
+        )
+        if metrics_runner is not None:
+            stack.push_async_callback(metrics_runner.cleanup)
+
+        diagnostics_config = config.get("diagnostics", {})
+        loop_lag_monitor = diagnostics.LoopLagMonitor.from_config(diagnostics_config)
+        loop_lag_monitor.start()
+        stack.callback(loop_lag_monitor.stop)
+        diagnostics.global_profiler = diagnostics.CycleProfiler.from_config(
+            diagnostics_config
+        )
+        if hasattr(signal, "SIGUSR1"):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, diagnostics.global_profiler.arm
+            )
+
+        await asyncio.gather(*(asyncio.create_task(c) for c in coroutines))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Discord stock notifier")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        choices=list(MODE_MODULES),
+        default="all",
+        help="scrape runs a scraper worker that shares the hosts with other "
+        "workers, bot runs the Discord bot and notification dispatcher, "
+        "all (the default) runs both",
+    )
+    parser.add_argument(
+        "--worker-id", help="stable name of this worker, defaults to hostname-pid"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="overrides metrics.port, for several processes on one machine",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record", metavar="PATH", help="records every fetched page into a cassette"
+    )
+    cassette.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="serves pages from a cassette instead of the network, scrape mode "
+        "only; detections are logged instead of notified",
+    )
+    args = parser.parse_args(argv)
+    if args.replay and args.mode != "scrape":
+        parser.error("--replay only runs in scrape mode")
+    return args
 
 
 def run():
+    args = parse_args()
     # https://github.com/Pycord-Development/pycord/issues/872#issuecomment-1111596201
     loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(main())
+        loop.run_until_complete(
+            main(
+                args.mode,
+                args.worker_id,
+                args.metrics_port,
+                args.record,
+                args.replay,
+            )
+        )
     finally:
         loop.close()
 
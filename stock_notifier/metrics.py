@@ -0,0 +1,278 @@
+"""Prometheus metrics for the scraper, dispatcher and database.
+
+Metrics are only collected when ``metrics.enabled`` is set in the config. When it
+isn't, every metric below is ``NULL_METRIC`` and ``timed`` returns functions
+unwrapped, so instrumented code pays at most a no-op method call.
+"""
+
+import bisect
+import functools
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from stock_notifier import config
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+metrics_config = config.get("metrics", {})
+METRICS_ENABLED = metrics_config.get("enabled", False)
+METRICS_HOST = metrics_config.get("host", "127.0.0.1")
+METRICS_PORT = metrics_config.get("port", 9108)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+
+    def samples(self) -> Iterator[str]:
+        for values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, function: Callable[[], float], *labels):
+        """Reads the value from ``function`` whenever the metrics are scraped."""
+        self._functions[labels] = function
+
+    def samples(self) -> Iterator[str]:
+        for labels, function in self._functions.items():
+            self._values[labels] = function()
+        return super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: a count per bucket plus +Inf, then the sum.
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> Iterator[str]:
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labels + ("le",), values + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class NullMetric:
+    """Stands in for every metric while metrics are disabled."""
+
+    def inc(self, amount: float = 1, *labels):
+        pass
+
+    def set(self, value: float, *labels):
+        pass
+
+    def set_function(self, function: Callable[[], float], *labels):
+        pass
+
+    def observe(self, value: float, *labels):
+        pass
+
+    def time(self, *labels):
+        return nullcontext()
+
+
+NULL_METRIC = NullMetric()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() + "\n" for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple[str, ...] = ()):
+    if not METRICS_ENABLED:
+        return NULL_METRIC
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: tuple[str, ...] = ()):
+    if not METRICS_ENABLED:
+        return NULL_METRIC
+    return REGISTRY.register(Gauge(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: tuple[str, ...] = (), **kwargs):
+    if not METRICS_ENABLED:
+        return NULL_METRIC
+    return REGISTRY.register(Histogram(name, help, labels, **kwargs))
+
+
+def timed(metric):
+    """Decorates a coroutine function to observe its duration, labelled by name."""
+
+    def decorator(function):
+        if metric is NULL_METRIC:
+            return function
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, function.__name__)
+
+        return wrapper
+
+    return decorator
+
+
+FETCH_SECONDS = histogram(
+    "stock_notifier_fetch_seconds", "Time to fetch a product page.", ("host",)
+)
+FETCH_BYTES = counter(
+    "stock_notifier_fetch_bytes_total", "Body bytes downloaded.", ("host",)
+)
+FETCH_ERRORS = counter(
+    "stock_notifier_fetch_errors_total", "Failed page fetches.", ("host",)
+)
+CHECK_SECONDS = histogram(
+    "stock_notifier_check_seconds",
+    "Time to check a page, from fetch to notification.",
+    ("host",),
+)
+MATCH_SECONDS = histogram(
+    "stock_notifier_match_seconds",
+    "Time spent evaluating indicators on a document or chunk.",
+    ("kind",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5),
+)
+CYCLE_SECONDS = histogram(
+    "stock_notifier_cycle_seconds",
+    "Time to check every product once in one-shot mode, or to refresh the "
+    "schedule in continuous mode.",
+    ("mode",),
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+QUEUE_DEPTH = gauge(
+    "stock_notifier_queue_depth", "Targets that are due but not yet being checked."
+)
+SEMAPHORE_WAIT_SECONDS = histogram(
+    "stock_notifier_semaphore_wait_seconds",
+    "Time spent waiting on a concurrency limit.",
+    ("semaphore",),
+)
+NOTIFICATION_LATENCY_SECONDS = histogram(
+    "stock_notifier_notification_latency_seconds",
+    "Time from queueing a notification to delivering it.",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+NOTIFICATIONS = counter(
+    "stock_notifier_notifications_total", "Notifications by outcome.", ("result",)
+)
+LOOP_LAG_SECONDS = histogram(
+    "stock_notifier_loop_lag_seconds",
+    "How late the event loop ran a heartbeat scheduled at a fixed interval.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_SECONDS = histogram(
+    "stock_notifier_db_seconds", "Time spent in each models function.", ("function",)
+)
+
+
+async def handle_metrics(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(
+        body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+async def start_server(
+    host: str = METRICS_HOST, port: int = METRICS_PORT
+) -> Optional["web.AppRunner"]:
+    """Serves /metrics. Returns the runner to clean up, or None when disabled."""
+    if not METRICS_ENABLED:
+        return None
+    # The server is optional, so aiohttp.web is only imported when it runs.
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,7 +1,28 @@
-from typing import List, Optional
-
-from sqlalchemy import Column, ForeignKey, Integer, String, Table, not_, select
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Table,
+    case,
+    delete,
+    func,
+    insert,
+    literal,
+    not_,
+    select,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -9,9 +30,19 @@ from sqlalchemy.orm import (
     relationship,
     selectinload,
 )
+from sqlalchemy.sql.functions import FunctionElement
+
+from stock_notifier.logger import logger
+from stock_notifier.metrics import DB_SECONDS, timed
 
 global_async_session: async_sessionmaker[AsyncSession]
 
+NOTIFICATION_PENDING = "pending"
+NOTIFICATION_FAILED = "failed"
+
+# Rows per statement for bulk writes, below SQLite's bound parameter limit.
+CHUNK_SIZE = 500
+
 
 class Base(AsyncAttrs, DeclarativeBase):
     pass
@@ -22,6 +53,8 @@ subscription_table = Table(
     Base.metadata,
     Column("user_id", ForeignKey("user.id"), primary_key=True),
     Column("product_id", ForeignKey("product.id"), primary_key=True),
+    # The primary key only covers lookups by user_id.
+    Index("ix_subscription_table_product_id", "product_id"),
 )
 
 
@@ -46,7 +79,8 @@ class Product(Base):
     __tablename__ = "product"
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(128))
-    url: Mapped[str] = mapped_column(String(512))
+    # Indexed for deduplicating bulk imports.
+    url: Mapped[str] = mapped_column(String(512), index=True)
     indicator: Mapped[str] = mapped_column(String(512))
     subscribers: Mapped[List[User]] = relationship(
         secondary=subscription_table, back_populates="products", passive_deletes=True
@@ -56,14 +90,238 @@ class Product(Base):
         return f"Product(id={self.id!r}, name={self.name!r}, url={self.url!r}, indicator={self.indicator!r})"
 
 
+class PollState(Base):
+    """Adaptive polling state of a product, kept across restarts."""
+
+    __tablename__ = "poll_state"
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), primary_key=True)
+    interval: Mapped[float] = mapped_column(Float())
+    last_checked: Mapped[Optional[datetime]] = mapped_column(DateTime(), nullable=True)
+    last_changed: Mapped[Optional[datetime]] = mapped_column(DateTime(), nullable=True)
+    last_restock: Mapped[Optional[datetime]] = mapped_column(DateTime(), nullable=True)
+
+    def __repr__(self) -> str:
+        return f"PollState(product_id={self.product_id!r}, interval={self.interval!r})"
+
+
+class Notification(Base):
+    """Outbox row for an in-stock notification to one subscriber."""
+
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+        Index("ix_notification_outbox_product_user", "product_id", "user_id"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"))
+    status: Mapped[str] = mapped_column(String(16), default=NOTIFICATION_PENDING)
+    attempts: Mapped[int] = mapped_column(Integer(), default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+    user: Mapped[User] = relationship(lazy="joined")
+    product: Mapped[Product] = relationship(lazy="joined")
+
+    def __repr__(self) -> str:
+        return (
+            f"Notification(id={self.id!r}, user_id={self.user_id!r}, "
+            f"product_id={self.product_id!r}, status={self.status!r}, "
+            f"attempts={self.attempts!r})"
+        )
+
+
+class CheckResult(Base):
+    """One fetch of a product page by the scraper."""
+
+    __tablename__ = "check_result"
+    __table_args__ = (Index("ix_check_result_url_checked_at", "url", "checked_at"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    checked_at: Mapped[datetime] = mapped_column(DateTime(), index=True)
+    url: Mapped[str] = mapped_column(String(512))
+    host: Mapped[str] = mapped_column(String(255))
+    status: Mapped[Optional[int]] = mapped_column(Integer(), nullable=True)
+    latency: Mapped[Optional[float]] = mapped_column(Float(), nullable=True)
+    size: Mapped[int] = mapped_column(Integer(), default=0)
+    not_modified: Mapped[bool] = mapped_column(Boolean(), default=False)
+    changed: Mapped[bool] = mapped_column(Boolean(), default=False)
+    matched: Mapped[bool] = mapped_column(Boolean(), default=False)
+    error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+
+    def __repr__(self) -> str:
+        return (
+            f"CheckResult(url={self.url!r}, checked_at={self.checked_at!r}, "
+            f"status={self.status!r}, matched={self.matched!r})"
+        )
+
+
+class HourlyCheckStats(Base):
+    """Check results of one host during one hour, kept after the raw rows expire."""
+
+    __tablename__ = "check_result_hourly"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    hour: Mapped[datetime] = mapped_column(DateTime(), index=True)
+    host: Mapped[str] = mapped_column(String(255))
+    checks: Mapped[int] = mapped_column(Integer())
+    errors: Mapped[int] = mapped_column(Integer())
+    not_modified: Mapped[int] = mapped_column(Integer())
+    changed: Mapped[int] = mapped_column(Integer())
+    matched: Mapped[int] = mapped_column(Integer())
+    total_bytes: Mapped[int] = mapped_column(Integer())
+    avg_latency: Mapped[Optional[float]] = mapped_column(Float(), nullable=True)
+    max_latency: Mapped[Optional[float]] = mapped_column(Float(), nullable=True)
+
+    def __repr__(self) -> str:
+        return (
+            f"HourlyCheckStats(hour={self.hour!r}, host={self.host!r}, "
+            f"checks={self.checks!r}, errors={self.errors!r})"
+        )
+
+
+class Worker(Base):
+    """A scraper process taking part in sharding, alive while it heartbeats."""
+
+    __tablename__ = "worker"
+    id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    started_at: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime(), index=True)
+
+    def __repr__(self) -> str:
+        return f"Worker(id={self.id!r}, heartbeat_at={self.heartbeat_at!r})"
+
+
+class HostLease(Base):
+    """Which worker scrapes a host, until the lease expires unless renewed."""
+
+    __tablename__ = "host_lease"
+    host: Mapped[str] = mapped_column(String(255), primary_key=True)
+    worker_id: Mapped[str] = mapped_column(String(128), index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime())
+
+    def __repr__(self) -> str:
+        return (
+            f"HostLease(host={self.host!r}, worker_id={self.worker_id!r}, "
+            f"expires_at={self.expires_at!r})"
+        )
+
+
+class QuarantinedPattern(Base):
+    """An indicator regex that kept running too long and is no longer evaluated."""
+
+    __tablename__ = "quarantined_pattern"
+    pattern: Mapped[str] = mapped_column(String(512), primary_key=True)
+    reason: Mapped[str] = mapped_column(String(1024))
+    quarantined_at: Mapped[datetime] = mapped_column(DateTime(), default=datetime.now)
+
+    def __repr__(self) -> str:
+        return f"QuarantinedPattern(pattern={self.pattern!r}, reason={self.reason!r})"
+
+
+ProductListener = Callable[[str, "Product"], None]
+product_listeners: List[ProductListener] = []
+
+
+def add_product_listener(listener: ProductListener):
+    """Registers a callback invoked with ("added" | "deleted", product) after commit."""
+    product_listeners.append(listener)
+
+
+def emit_product_event(event: str, product: Product):
+    # The change is already committed, so a failing listener mustn't keep the
+    # others from seeing it.
+    for listener in product_listeners:
+        try:
+            listener(event, product)
+        except Exception:
+            logger.exception("Product listener %r failed on %s", listener, event)
+
+
+SubscriptionListener = Callable[[str, int, List[int]], None]
+subscription_listeners: List[SubscriptionListener] = []
+
+
+def add_subscription_listener(listener: SubscriptionListener):
+    """Registers a callback invoked with ("added" | "removed", user_id, product_ids)
+    after commit."""
+    subscription_listeners.append(listener)
+
+
+def emit_subscription_event(event: str, user_id: int, product_ids: List[int]):
+    if not product_ids:
+        return
+    for listener in subscription_listeners:
+        try:
+            listener(event, user_id, product_ids)
+        except Exception:
+            logger.exception("Subscription listener %r failed on %s", listener, event)
+
+
+@timed(DB_SECONDS)
 async def add_product(name: str, url: str, indicator: str) -> Product:
     async with global_async_session() as session:
         async with session.begin():
             product = Product(name=name, url=url, indicator=indicator)
             session.add(product)
-            return product
+    emit_product_event("added", product)
+    return product
+
+
+@timed(DB_SECONDS)
+async def add_products(rows: List[dict]) -> tuple[List[Product], int]:
+    """Inserts products in one transaction, skipping those equal to an existing
+    product or to an earlier row. Returns the new products and the number of
+    duplicates skipped.
+
+    Product events only reach this process's listeners. Other processes notice
+    the new products by their ids being above the highest they know.
+    """
+    added = []
+    duplicates = 0
+    async with global_async_session() as session:
+        async with session.begin():
+            for i in range(0, len(rows), CHUNK_SIZE):
+                chunk = rows[i : i + CHUNK_SIZE]
+                existing = set(
+                    await session.execute(
+                        select(Product.name, Product.url, Product.indicator).where(
+                            Product.url.in_({row["url"] for row in chunk})
+                        )
+                    )
+                )
+                new_rows = []
+                for row in chunk:
+                    key = (row["name"], row["url"], row["indicator"])
+                    if key in existing:
+                        duplicates += 1
+                    else:
+                        existing.add(key)
+                        new_rows.append(row)
+                if new_rows:
+                    added.extend(
+                        await session.scalars(
+                            insert(Product).returning(Product), new_rows
+                        )
+                    )
+    for product in added:
+        emit_product_event("added", product)
+    return added, duplicates
+
+
+async def stream_product_rows(
+    batch_size: int = 1000,
+) -> AsyncIterator[tuple[str, str, str]]:
+    """Yields (name, url, indicator) of every product, fetching ``batch_size`` at
+    a time."""
+    async with global_async_session() as session:
+        result = await session.stream(
+            select(Product.name, Product.url, Product.indicator)
+            .order_by(Product.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for row in result:
+            yield tuple(row)
 
 
+@timed(DB_SECONDS)
 async def delete_product(**kwargs: dict) -> List[Product]:
     async with global_async_session() as session:
         async with session.begin():
@@ -72,9 +330,20 @@ async def delete_product(**kwargs: dict) -> List[Product]:
                 assert isinstance(product, Product)
                 results.append(product)
                 await session.delete(product)
-            return results
-
-
+            if results:
+                product_ids = [p.id for p in results]
+                await session.execute(
+                    delete(PollState).where(PollState.product_id.in_(product_ids))
+                )
+                await session.execute(
+                    delete(Notification).where(Notification.product_id.in_(product_ids))
+                )
+    for product in results:
+        emit_product_event("deleted", product)
+    return results
+
+
+@timed(DB_SECONDS)
 async def add_discord_user(name: str, discord_id: int) -> User:
     async with global_async_session() as session:
         async with session.begin():
@@ -83,6 +352,7 @@ async def add_discord_user(name: str, discord_id: int) -> User:
             return user
 
 
+@timed(DB_SECONDS)
 async def add_discord_user_if_not_exist(name: str, discord_id: int) -> User:
     async with global_async_session() as session:
         async with session.begin():
@@ -93,6 +363,7 @@ async def add_discord_user_if_not_exist(name: str, discord_id: int) -> User:
             return user
 
 
+@timed(DB_SECONDS)
 async def add_discord_subscription(discord_id: int, **kwargs) -> List[Product]:
     """Adds a discord subscription. Returns a list of successfully subscribed products."""
     async with global_async_session() as session:
@@ -109,9 +380,11 @@ async def add_discord_subscription(discord_id: int, **kwargs) -> List[Product]:
                 assert isinstance(product, Product)
                 product.subscribers.append(user)
                 results.append(product)
-            return results
+    emit_subscription_event("added", user.id, [p.id for p in results])
+    return results
 
 
+@timed(DB_SECONDS)
 async def remove_discord_subscription(discord_id: int, **kwargs) -> List[Product]:
     async with global_async_session() as session:
         async with session.begin():
@@ -129,9 +402,41 @@ async def remove_discord_subscription(discord_id: int, **kwargs) -> List[Product
                 user.products.remove(product)
                 products_to_remove.append(product)
             await session.flush()
-            return products_to_remove
+    emit_subscription_event("removed", user.id, [p.id for p in products_to_remove])
+    return products_to_remove
 
 
+@timed(DB_SECONDS)
+async def remove_subscriptions(product_id: int, user_ids: Iterable[int]) -> List[int]:
+    """Removes many users' subscriptions to a product with set-based DELETEs.
+
+    Returns the ids of the users whose subscription was removed.
+    """
+    async with global_async_session() as session:
+        async with session.begin():
+            removed = await _delete_subscriptions(session, product_id, user_ids)
+    for user_id in removed:
+        emit_subscription_event("removed", user_id, [product_id])
+    return removed
+
+
+async def _delete_subscriptions(
+    session: AsyncSession, product_id: int, user_ids: Iterable[int]
+) -> List[int]:
+    user_ids = list(user_ids)
+    removed = []
+    for i in range(0, len(user_ids), CHUNK_SIZE):
+        result = await session.execute(
+            delete(subscription_table)
+            .where(subscription_table.c.product_id == product_id)
+            .where(subscription_table.c.user_id.in_(user_ids[i : i + CHUNK_SIZE]))
+            .returning(subscription_table.c.user_id)
+        )
+        removed.extend(result.scalars())
+    return removed
+
+
+@timed(DB_SECONDS)
 async def remove_discord_subscription_all(
     discord_id: int, product_name: str
 ) -> List[Product]:
@@ -149,9 +454,11 @@ async def remove_discord_subscription_all(
             for product in products_to_remove:
                 user.products.remove(product)
             await session.flush()
-            return products_to_remove
+    emit_subscription_event("removed", user.id, [p.id for p in products_to_remove])
+    return products_to_remove
 
 
+@timed(DB_SECONDS)
 async def get_product_names() -> List[str]:
     """Returns a unique set of product names."""
     async with global_async_session() as session:
@@ -162,6 +469,7 @@ async def get_product_names() -> List[str]:
         return list(set(results))
 
 
+@timed(DB_SECONDS)
 async def get_products() -> List[Product]:
     """Returns a unique set of product names."""
     async with global_async_session() as session:
@@ -171,6 +479,7 @@ async def get_products() -> List[Product]:
         return list(results)
 
 
+@timed(DB_SECONDS)
 async def get_subscribed_product_names(discord_id: int) -> List[str]:
     async with global_async_session() as session:
         results = set()
@@ -184,6 +493,7 @@ async def get_subscribed_product_names(discord_id: int) -> List[str]:
         return list(results)
 
 
+@timed(DB_SECONDS)
 async def get_unsubscribed_product_names(discord_id: int) -> List[str]:
     """Get a unique list of unsubscribed product names. Returns all product names if no user exists."""
     async with global_async_session() as session:
@@ -196,3 +506,501 @@ async def get_unsubscribed_product_names(discord_id: int) -> List[str]:
         ):
             results.add(product.name)
         return list(results)
+
+
+@timed(DB_SECONDS)
+async def get_user_id(discord_id: int) -> Optional[int]:
+    async with global_async_session() as session:
+        return await session.scalar(select(User.id).filter_by(discord_id=discord_id))
+
+
+@timed(DB_SECONDS)
+async def get_product_rows(after: int = 0) -> List[tuple[int, str, str, str]]:
+    """Returns (id, name, url, indicator) of every product with an id above
+    ``after``."""
+    async with global_async_session() as session:
+        return [
+            tuple(row)
+            for row in await session.execute(
+                select(Product.id, Product.name, Product.url, Product.indicator).where(
+                    Product.id > after
+                )
+            )
+        ]
+
+
+@timed(DB_SECONDS)
+async def get_product_name_rows(after: int = 0) -> List[tuple[int, str]]:
+    """Returns (id, name) of every product with an id above ``after``."""
+    async with global_async_session() as session:
+        return [
+            tuple(row)
+            for row in await session.execute(
+                select(Product.id, Product.name).where(Product.id > after)
+            )
+        ]
+
+
+@timed(DB_SECONDS)
+async def get_subscription_rows() -> List[tuple[int, int]]:
+    """Returns (user_id, product_id) of every subscription."""
+    async with global_async_session() as session:
+        return [
+            tuple(row)
+            for row in await session.execute(
+                select(subscription_table.c.user_id, subscription_table.c.product_id)
+            )
+        ]
+
+
+@timed(DB_SECONDS)
+async def get_subscriber_counts() -> Dict[int, int]:
+    """Returns the number of subscribers of every product that has any."""
+    async with global_async_session() as session:
+        rows = await session.execute(
+            select(
+                subscription_table.c.product_id,
+                func.count(subscription_table.c.user_id),
+            ).group_by(subscription_table.c.product_id)
+        )
+        return {product_id: count for product_id, count in rows}
+
+
+@timed(DB_SECONDS)
+async def get_poll_states() -> List[PollState]:
+    async with global_async_session() as session:
+        return list(await session.scalars(select(PollState)))
+
+
+@timed(DB_SECONDS)
+async def save_poll_states(states: Iterable[PollState]):
+    """Replaces the stored poll state of the given products in one transaction."""
+    rows = [
+        dict(
+            product_id=state.product_id,
+            interval=state.interval,
+            last_checked=state.last_checked,
+            last_changed=state.last_changed,
+            last_restock=state.last_restock,
+        )
+        for state in states
+    ]
+    if not rows:
+        return
+    async with global_async_session() as session:
+        async with session.begin():
+            for i in range(0, len(rows), CHUNK_SIZE):
+                chunk = rows[i : i + CHUNK_SIZE]
+                await session.execute(
+                    delete(PollState).where(
+                        PollState.product_id.in_([row["product_id"] for row in chunk])
+                    )
+                )
+                await session.execute(insert(PollState), chunk)
+
+
+@timed(DB_SECONDS)
+async def enqueue_notifications(product_id: int) -> int:
+    """Writes an outbox row for every subscriber of a product in one statement.
+
+    Subscribers who already have a pending notification for the product are
+    skipped. Returns the number of rows queued.
+    """
+    already_pending = (
+        select(Notification.id)
+        .where(Notification.product_id == product_id)
+        .where(Notification.user_id == subscription_table.c.user_id)
+        .where(Notification.status == NOTIFICATION_PENDING)
+        .exists()
+    )
+    now = datetime.now()
+    async with global_async_session() as session:
+        async with session.begin():
+            result = await session.execute(
+                insert(Notification).from_select(
+                    [
+                        "user_id",
+                        "product_id",
+                        "status",
+                        "attempts",
+                        "created_at",
+                        "next_attempt_at",
+                    ],
+                    select(
+                        subscription_table.c.user_id,
+                        subscription_table.c.product_id,
+                        literal(NOTIFICATION_PENDING),
+                        literal(0),
+                        literal(now),
+                        literal(now),
+                    )
+                    .where(subscription_table.c.product_id == product_id)
+                    .where(not_(already_pending)),
+                )
+            )
+            return result.rowcount
+
+
+@timed(DB_SECONDS)
+async def get_pending_notifications(
+    limit: int, created_before: Optional[datetime] = None
+) -> List[Notification]:
+    """Returns pending notifications that are due, oldest first.
+
+    With ``created_before``, only notifications queued before then are returned.
+    """
+    query = (
+        select(Notification)
+        .where(Notification.status == NOTIFICATION_PENDING)
+        .where(Notification.next_attempt_at <= datetime.now())
+    )
+    if created_before is not None:
+        query = query.where(Notification.created_at <= created_before)
+    async with global_async_session() as session:
+        return list(await session.scalars(query.order_by(Notification.id).limit(limit)))
+
+
+@timed(DB_SECONDS)
+async def get_pending_notifications_of_users(
+    user_ids: Iterable[int],
+) -> List[Notification]:
+    """Returns the due pending notifications of the users, oldest first.
+
+    Unlike get_pending_notifications, these may have been queued just now, but
+    notifications waiting out a retry backoff are left out.
+    """
+    user_ids = list(user_ids)
+    notifications = []
+    now = datetime.now()
+    async with global_async_session() as session:
+        for i in range(0, len(user_ids), CHUNK_SIZE):
+            notifications.extend(
+                await session.scalars(
+                    select(Notification)
+                    .where(Notification.status == NOTIFICATION_PENDING)
+                    .where(Notification.next_attempt_at <= now)
+                    .where(Notification.user_id.in_(user_ids[i : i + CHUNK_SIZE]))
+                )
+            )
+    return sorted(notifications, key=lambda notification: notification.id)
+
+
+@timed(DB_SECONDS)
+async def complete_notifications(
+    ids: Iterable[int], notified_users: dict[int, List[int]]
+) -> dict[int, List[int]]:
+    """Deletes sent notifications and the subscriptions of the notified users.
+
+    Both happen in one transaction, so a crash can't leave a subscription whose
+    notification is gone, which would be detected and sent again. Returns the
+    ids of the users whose subscription was removed, per product.
+    """
+    ids = list(ids)
+    removed = {}
+    async with global_async_session() as session:
+        async with session.begin():
+            for i in range(0, len(ids), CHUNK_SIZE):
+                await session.execute(
+                    delete(Notification).where(
+                        Notification.id.in_(ids[i : i + CHUNK_SIZE])
+                    )
+                )
+            for product_id, user_ids in notified_users.items():
+                removed[product_id] = await _delete_subscriptions(
+                    session, product_id, user_ids
+                )
+    for product_id, user_ids in removed.items():
+        for user_id in user_ids:
+            emit_subscription_event("removed", user_id, [product_id])
+    return removed
+
+
+@timed(DB_SECONDS)
+async def retry_notifications(ids: Iterable[int], next_attempt_at: datetime):
+    ids = list(ids)
+    async with global_async_session() as session:
+        async with session.begin():
+            for i in range(0, len(ids), CHUNK_SIZE):
+                await session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(ids[i : i + CHUNK_SIZE]))
+                    .values(
+                        attempts=Notification.attempts + 1,
+                        next_attempt_at=next_attempt_at,
+                    )
+                )
+
+
+@timed(DB_SECONDS)
+async def fail_notifications(ids: Iterable[int]):
+    ids = list(ids)
+    async with global_async_session() as session:
+        async with session.begin():
+            for i in range(0, len(ids), CHUNK_SIZE):
+                await session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(ids[i : i + CHUNK_SIZE]))
+                    .values(
+                        attempts=Notification.attempts + 1,
+                        status=NOTIFICATION_FAILED,
+                    )
+                )
+
+
+@timed(DB_SECONDS)
+async def save_check_results(rows: List[dict]):
+    """Inserts buffered check results with a single executemany."""
+    if not rows:
+        return
+    async with global_async_session() as session:
+        async with session.begin():
+            await session.execute(insert(CheckResult), rows)
+
+
+class hour_of(FunctionElement):
+    """Truncates a timestamp to the start of its hour."""
+
+    type = DateTime()
+    name = "hour_of"
+    inherit_cache = True
+
+
+@compiles(hour_of)
+def _hour_of(element, compiler, **kw):
+    return compiler.process(func.date_trunc("hour", *element.clauses), **kw)
+
+
+@compiles(hour_of, "sqlite")
+def _hour_of_sqlite(element, compiler, **kw):
+    # Stored as text by SQLite, so strftime truncates to the hour.
+    return compiler.process(func.strftime("%Y-%m-%d %H:00:00", *element.clauses), **kw)
+
+
+@compiles(hour_of, "mysql")
+def _hour_of_mysql(element, compiler, **kw):
+    return compiler.process(
+        func.date_format(*element.clauses, "%Y-%m-%d %H:00:00"), **kw
+    )
+
+
+@timed(DB_SECONDS)
+async def compact_check_results(before: datetime, drop_hourly_before: datetime):
+    """Rolls check results older than ``before`` up into hourly stats per host,
+    then deletes them, along with hourly stats older than ``drop_hourly_before``.
+    Returns the number of raw rows compacted."""
+    hour = hour_of(CheckResult.checked_at)
+    is_error = (CheckResult.error.is_not(None)) | (CheckResult.status >= 400)
+    async with global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                insert(HourlyCheckStats).from_select(
+                    [
+                        HourlyCheckStats.hour,
+                        HourlyCheckStats.host,
+                        HourlyCheckStats.checks,
+                        HourlyCheckStats.errors,
+                        HourlyCheckStats.not_modified,
+                        HourlyCheckStats.changed,
+                        HourlyCheckStats.matched,
+                        HourlyCheckStats.total_bytes,
+                        HourlyCheckStats.avg_latency,
+                        HourlyCheckStats.max_latency,
+                    ],
+                    select(
+                        hour,
+                        CheckResult.host,
+                        func.count(),
+                        func.sum(case((is_error, 1), else_=0)),
+                        func.sum(case((CheckResult.not_modified, 1), else_=0)),
+                        func.sum(case((CheckResult.changed, 1), else_=0)),
+                        func.sum(case((CheckResult.matched, 1), else_=0)),
+                        func.sum(CheckResult.size),
+                        func.avg(CheckResult.latency),
+                        func.max(CheckResult.latency),
+                    )
+                    .where(CheckResult.checked_at < before)
+                    .group_by(hour, CheckResult.host),
+                )
+            )
+            compacted = await session.execute(
+                delete(CheckResult).where(CheckResult.checked_at < before)
+            )
+            await session.execute(
+                delete(HourlyCheckStats).where(
+                    HourlyCheckStats.hour < drop_hourly_before
+                )
+            )
+            return compacted.rowcount
+
+
+@timed(DB_SECONDS)
+async def get_check_results(url: str, limit: int = 100) -> List[CheckResult]:
+    """Returns the most recent check results of a page, newest first."""
+    async with global_async_session() as session:
+        return list(
+            await session.scalars(
+                select(CheckResult)
+                .where(CheckResult.url == url)
+                .order_by(CheckResult.checked_at.desc())
+                .limit(limit)
+            )
+        )
+
+
+@timed(DB_SECONDS)
+async def get_hourly_check_stats(host: str) -> List[HourlyCheckStats]:
+    async with global_async_session() as session:
+        return list(
+            await session.scalars(
+                select(HourlyCheckStats)
+                .where(HourlyCheckStats.host == host)
+                .order_by(HourlyCheckStats.hour)
+            )
+        )
+
+
+def _insert_ignoring_conflicts(session: AsyncSession, model):
+    """An INSERT that skips rows whose primary key already exists."""
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert(model).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        # Imported here, the PostgreSQL dialect is slow to import and rarely used.
+        from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+        return postgresql_insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+
+@timed(DB_SECONDS)
+async def heartbeat_worker(
+    worker_id: str, now: datetime, live_since: datetime
+) -> List[str]:
+    """Records that a worker is alive and returns the ids of every live worker.
+
+    Workers that haven't sent a heartbeat since ``live_since`` are removed.
+    """
+    async with global_async_session() as session:
+        async with session.begin():
+            # Writing first takes SQLite's write lock for the whole transaction.
+            result = await session.execute(
+                update(Worker).where(Worker.id == worker_id).values(heartbeat_at=now)
+            )
+            if not result.rowcount:
+                await session.execute(
+                    _insert_ignoring_conflicts(session, Worker),
+                    [dict(id=worker_id, started_at=now, heartbeat_at=now)],
+                )
+            await session.execute(
+                delete(Worker).where(Worker.heartbeat_at < live_since)
+            )
+            return list(await session.scalars(select(Worker.id).order_by(Worker.id)))
+
+
+@timed(DB_SECONDS)
+async def sync_host_leases(
+    worker_id: str, hosts: Iterable[str], now: datetime, expires_at: datetime
+) -> set[str]:
+    """Makes a worker's leases match ``hosts`` as far as other leases allow.
+
+    Leases on other hosts are released, held ones renewed, and hosts that are
+    unleased or whose lease expired before ``now`` are claimed. Returns the hosts
+    the worker holds afterwards.
+    """
+    hosts = set(hosts)
+    async with global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(HostLease)
+                .where(HostLease.worker_id == worker_id)
+                .values(expires_at=expires_at)
+            )
+            held = set(
+                await session.scalars(
+                    select(HostLease.host).where(HostLease.worker_id == worker_id)
+                )
+            )
+            released = list(held - hosts)
+            for i in range(0, len(released), CHUNK_SIZE):
+                await session.execute(
+                    delete(HostLease)
+                    .where(HostLease.worker_id == worker_id)
+                    .where(HostLease.host.in_(released[i : i + CHUNK_SIZE]))
+                )
+            wanted = list(hosts - held)
+            for i in range(0, len(wanted), CHUNK_SIZE):
+                chunk = wanted[i : i + CHUNK_SIZE]
+                await session.execute(
+                    update(HostLease)
+                    .where(HostLease.host.in_(chunk))
+                    .where(HostLease.expires_at < now)
+                    .values(worker_id=worker_id, expires_at=expires_at)
+                )
+                await session.execute(
+                    _insert_ignoring_conflicts(session, HostLease),
+                    [
+                        dict(host=host, worker_id=worker_id, expires_at=expires_at)
+                        for host in chunk
+                    ],
+                )
+            return set(
+                await session.scalars(
+                    select(HostLease.host).where(HostLease.worker_id == worker_id)
+                )
+            )
+
+
+@timed(DB_SECONDS)
+async def release_worker(worker_id: str):
+    """Gives up a worker's leases so other workers can take its hosts at once."""
+    async with global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                delete(HostLease).where(HostLease.worker_id == worker_id)
+            )
+            await session.execute(delete(Worker).where(Worker.id == worker_id))
+
+
+@timed(DB_SECONDS)
+async def get_host_leases() -> List[HostLease]:
+    async with global_async_session() as session:
+        return list(await session.scalars(select(HostLease).order_by(HostLease.host)))
+
+
+@timed(DB_SECONDS)
+async def quarantine_pattern(pattern: str, reason: str):
+    async with global_async_session() as session:
+        async with session.begin():
+            await session.execute(
+                _insert_ignoring_conflicts(session, QuarantinedPattern),
+                [dict(pattern=pattern, reason=reason, quarantined_at=datetime.now())],
+            )
+
+
+@timed(DB_SECONDS)
+async def get_quarantined_patterns() -> Dict[str, str]:
+    """Returns the reason each quarantined pattern was quarantined for."""
+    async with global_async_session() as session:
+        return {
+            pattern: reason
+            for pattern, reason in await session.execute(
+                select(QuarantinedPattern.pattern, QuarantinedPattern.reason)
+            )
+        }
+
+
+@timed(DB_SECONDS)
+async def get_quarantined_products() -> List[tuple[int, str, str]]:
+    """Returns the id, name and indicator of products whose indicator is
+    quarantined."""
+    async with global_async_session() as session:
+        return [
+            tuple(row)
+            for row in await session.execute(
+                select(Product.id, Product.name, Product.indicator)
+                .join(
+                    QuarantinedPattern, QuarantinedPattern.pattern == Product.indicator
+                )
+                .order_by(Product.id)
+            )
+        ]
@@ -0,0 +1,194 @@
+import bisect
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+from stock_notifier import models
+
+# Discord shows at most 25 autocomplete options.
+AUTOCOMPLETE_LIMIT = 25
+
+
+class ProductNameIndex:
+    """In-memory product names and per-user subscriptions for autocomplete.
+
+    Names are kept in a list sorted by their case-folded form, so prefix queries
+    are a binary search and only the top matches are collected. The index is
+    loaded once and then kept current through the models listeners, and through
+    ``catch_up()`` for products added by other processes.
+    """
+
+    def __init__(
+        self, catch_up_seconds: float = 10, clock: Callable[[], float] = time.monotonic
+    ):
+        self.catch_up_seconds = catch_up_seconds
+        self.clock = clock
+        self._caught_up_at: Optional[float] = None
+        self.clear()
+
+    def clear(self):
+        self._keys: list[str] = []
+        self._names: list[str] = []
+        self._name_ids: dict[str, set[int]] = {}
+        self._product_names: dict[int, str] = {}
+        self._subscriptions: dict[int, set[int]] = defaultdict(set)
+        self._user_ids: dict[int, int] = {}
+        self.max_product_id = 0
+        # All keys joined by NUL, rebuilt lazily, so substring queries run in C.
+        self._haystack: Optional[str] = None
+        self._offsets: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def load(
+        self,
+        products: Iterable[tuple[int, str]],
+        subscriptions: Iterable[tuple[int, int]],
+    ):
+        self.clear()
+        for product_id, name in products:
+            self.add_product(product_id, name)
+        for user_id, product_id in subscriptions:
+            self._subscriptions[user_id].add(product_id)
+
+    def add_product(self, product_id: int, name: str):
+        self._product_names[product_id] = name
+        self.max_product_id = max(self.max_product_id, product_id)
+        ids = self._name_ids.get(name)
+        if ids is None:
+            ids = self._name_ids[name] = set()
+            key = name.casefold()
+            i = bisect.bisect_left(self._keys, key)
+            self._keys.insert(i, key)
+            self._names.insert(i, name)
+            self._haystack = None
+        ids.add(product_id)
+
+    def remove_product(self, product_id: int):
+        name = self._product_names.pop(product_id, None)
+        if name is None:
+            return
+        ids = self._name_ids[name]
+        ids.discard(product_id)
+        if ids:
+            return
+        del self._name_ids[name]
+        key = name.casefold()
+        i = bisect.bisect_left(self._keys, key)
+        while self._names[i] != name:
+            i += 1
+        del self._keys[i]
+        del self._names[i]
+        self._haystack = None
+
+    def on_product_event(self, event: str, product: models.Product):
+        if event == "added":
+            self.add_product(product.id, product.name)
+        elif event == "deleted":
+            self.remove_product(product.id)
+
+    async def catch_up(self):
+        """Adds the products inserted since the index last looked, such as by a
+        catalog import, looking at most every ``catch_up_seconds``."""
+        now = self.clock()
+        if (
+            self._caught_up_at is not None
+            and now - self._caught_up_at < self.catch_up_seconds
+        ):
+            return
+        self._caught_up_at = now
+        for product_id, name in await models.get_product_name_rows(self.max_product_id):
+            self.add_product(product_id, name)
+
+    def on_subscription_event(self, event: str, user_id: int, product_ids: list[int]):
+        if event == "added":
+            self._subscriptions[user_id].update(product_ids)
+        elif event == "removed":
+            self._subscriptions[user_id].difference_update(product_ids)
+
+    def remember_user(self, discord_id: int, user_id: int):
+        self._user_ids[discord_id] = user_id
+
+    def user_id(self, discord_id: int) -> Optional[int]:
+        return self._user_ids.get(discord_id)
+
+    def search(
+        self,
+        text: str = "",
+        limit: int = AUTOCOMPLETE_LIMIT,
+        predicate: Optional[Callable[[str], bool]] = None,
+    ) -> list[str]:
+        """Names starting with ``text`` first, then names containing it."""
+        key = text.casefold()
+        results = []
+        i = bisect.bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i].startswith(key):
+            name = self._names[i]
+            if predicate is None or predicate(name):
+                results.append(name)
+                if len(results) >= limit:
+                    return results
+            i += 1
+        if not key:
+            return results
+        haystack = self._build_haystack()
+        position = haystack.find(key)
+        while position != -1:
+            i = bisect.bisect_right(self._offsets, position) - 1
+            if position != self._offsets[i]:
+                name = self._names[i]
+                if predicate is None or predicate(name):
+                    results.append(name)
+                    if len(results) >= limit:
+                        break
+            # Continue from the next key.
+            position = haystack.find(key, self._offsets[i] + len(self._keys[i]) + 1)
+        return results
+
+    def _build_haystack(self) -> str:
+        if self._haystack is None:
+            self._offsets = []
+            offset = 0
+            for key in self._keys:
+                self._offsets.append(offset)
+                offset += len(key) + 1
+            self._haystack = "\0".join(self._keys)
+        return self._haystack
+
+    def subscribed_names(
+        self, user_id: Optional[int], text: str = "", limit: int = AUTOCOMPLETE_LIMIT
+    ) -> list[str]:
+        # A user's subscriptions are few, so filter those rather than the catalog.
+        names = {
+            self._product_names[product_id]
+            for product_id in self._subscriptions.get(user_id, ())
+            if product_id in self._product_names
+        }
+        key = text.casefold()
+        prefixed = sorted(
+            (n for n in names if n.casefold().startswith(key)), key=str.casefold
+        )
+        contained = sorted(
+            (
+                n
+                for n in names
+                if key in n.casefold() and not n.casefold().startswith(key)
+            ),
+            key=str.casefold,
+        )
+        return (prefixed + contained)[:limit]
+
+    def unsubscribed_names(
+        self, user_id: Optional[int], text: str = "", limit: int = AUTOCOMPLETE_LIMIT
+    ) -> list[str]:
+        """Names with at least one product the user isn't subscribed to."""
+        subscribed = self._subscriptions.get(user_id, set())
+        if not subscribed:
+            return self.search(text, limit)
+        return self.search(
+            text, limit, lambda name: not self._name_ids[name] <= subscribed
+        )
+
+
+global_name_index = ProductNameIndex()
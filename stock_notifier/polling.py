@@ -0,0 +1,161 @@
+import math
+from datetime import datetime
+from typing import Iterable, Optional
+
+from stock_notifier import models
+
+
+class PollingPolicy:
+    """Decides how often a product is polled from its change and restock history.
+
+    Pages that stay the same back off geometrically towards ``max_interval``.
+    A page change speeds polling back up and a restock resets it to
+    ``min_interval``. Popular products are polled more often.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 30,
+        max_interval: float = 1800,
+        initial_interval: float = 60,
+        backoff: float = 1.25,
+        speedup: float = 0.5,
+        subscriber_weight: float = 0.25,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.backoff = backoff
+        self.speedup = speedup
+        self.subscriber_weight = subscriber_weight
+
+    @classmethod
+    def from_config(
+        cls, polling_config: dict, default_interval: float
+    ) -> "PollingPolicy":
+        return cls(
+            min_interval=polling_config.get("min_interval", default_interval / 2),
+            max_interval=polling_config.get("max_interval", default_interval * 30),
+            initial_interval=polling_config.get("initial_interval", default_interval),
+            backoff=polling_config.get("backoff", 1.25),
+            speedup=polling_config.get("speedup", 0.5),
+            subscriber_weight=polling_config.get("subscriber_weight", 0.25),
+        )
+
+    def clamp(self, interval: float) -> float:
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def observe(
+        self, state: models.PollState, changed: bool, restocked: bool, now: datetime
+    ):
+        state.last_checked = now
+        if restocked:
+            state.last_restock = now
+            state.interval = self.min_interval
+        elif changed:
+            state.last_changed = now
+            state.interval = self.clamp(state.interval * self.speedup)
+        else:
+            state.interval = self.clamp(state.interval * self.backoff)
+
+    def effective_interval(self, state: models.PollState, subscribers: int) -> float:
+        """Scales the learned interval down logarithmically with the subscriber count."""
+        boost = 1 + self.subscriber_weight * math.log2(1 + subscribers)
+        return self.clamp(state.interval / boost)
+
+
+class AdaptivePoller:
+    """Per-product polling state on top of a ``PollingPolicy``."""
+
+    def __init__(self, policy: PollingPolicy):
+        self.policy = policy
+        self.states: dict[int, models.PollState] = {}
+        self.subscribers: dict[int, int] = {}
+        self._dirty: set[int] = set()
+
+    def load(self, states: Iterable[models.PollState]):
+        for state in states:
+            self.states[state.product_id] = models.PollState(
+                product_id=state.product_id,
+                interval=self.policy.clamp(state.interval),
+                last_checked=state.last_checked,
+                last_changed=state.last_changed,
+                last_restock=state.last_restock,
+            )
+
+    def set_subscribers(self, counts: dict[int, int]):
+        self.subscribers = counts
+
+    def should_poll(self, product: models.Product) -> bool:
+        """Products without subscribers aren't polled at all."""
+        return self.subscribers.get(product.id, 0) > 0
+
+    def state(self, product_id: int) -> models.PollState:
+        state = self.states.get(product_id)
+        if state is None:
+            state = models.PollState(
+                product_id=product_id, interval=self.policy.initial_interval
+            )
+            self.states[product_id] = state
+        return state
+
+    def interval(self, products: Iterable[models.Product]) -> float:
+        """Interval for a page shared by several products: the most urgent one wins."""
+        return min(
+            (
+                self.policy.effective_interval(
+                    self.state(product.id), self.subscribers.get(product.id, 0)
+                )
+                for product in products
+            ),
+            default=self.policy.initial_interval,
+        )
+
+    def initial_delay(
+        self, products: Iterable[models.Product], now: Optional[datetime] = None
+    ) -> float:
+        """Seconds until a page is due, based on when it was last checked."""
+        now = now or datetime.now()
+        products = list(products)
+        last_checked = [
+            self.states[p.id].last_checked
+            for p in products
+            if p.id in self.states and self.states[p.id].last_checked
+        ]
+        if not last_checked:
+            return 0.0
+        elapsed = (now - max(last_checked)).total_seconds()
+        return max(self.interval(products) - elapsed, 0.0)
+
+    def record(
+        self,
+        products: Iterable[models.Product],
+        changed: bool,
+        matches: dict[str, bool],
+        now: Optional[datetime] = None,
+    ) -> float:
+        """Updates each product's state after a check and returns the page's interval."""
+        now = now or datetime.now()
+        products = list(products)
+        for product in products:
+            self.policy.observe(
+                self.state(product.id),
+                changed,
+                matches.get(product.indicator, False),
+                now,
+            )
+            self._dirty.add(product.id)
+        return self.interval(products)
+
+    def forget(self, product_id: int):
+        self.states.pop(product_id, None)
+        self._dirty.discard(product_id)
+
+    def on_product_event(self, event: str, product: models.Product):
+        if event == "deleted":
+            self.forget(product.id)
+
+    def pop_dirty(self) -> list[models.PollState]:
+        dirty = [self.states[i] for i in self._dirty if i in self.states]
+        self._dirty.clear()
+        return dirty
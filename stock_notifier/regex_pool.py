@@ -0,0 +1,196 @@
+import asyncio
+import multiprocessing
+import re
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Optional
+
+from stock_notifier import regex_worker
+from stock_notifier.logger import logger
+
+
+def free_threaded() -> bool:
+    """Whether this is a free-threaded build running without the GIL."""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+class RegexTimeoutError(Exception):
+    def __init__(self, pattern: str, seconds: float):
+        super().__init__(f"Pattern {pattern!r} ran longer than {seconds}s")
+        self.pattern = pattern
+        self.seconds = seconds
+
+
+class RegexPool:
+    """Runs user regexes in worker processes with a time limit per evaluation.
+
+    A search that exceeds ``timeout`` is abandoned, its workers are killed and
+    the pattern gets a strike. After ``quarantine_after`` strikes in a row the
+    pattern is quarantined, no longer evaluated, and passed to ``on_quarantine``.
+    Searches wait for a free worker before their time limit starts, so a backlog
+    doesn't make fast patterns time out. On free-threaded builds threads are used
+    instead; they can't be killed, so a runaway search keeps its thread busy
+    until it finishes, but no longer blocks anything else.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        timeout: float = 2,
+        quarantine_after: int = 3,
+        validation_timeout: float = 1,
+        validation_corpus_chars: int = 20000,
+        use_threads: Optional[bool] = None,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.quarantine_after = quarantine_after
+        self.validation_timeout = validation_timeout
+        self.validation_corpus_chars = validation_corpus_chars
+        self.use_threads = free_threaded() if use_threads is None else use_threads
+        self.strikes: dict[str, int] = {}
+        self.quarantined: dict[str, str] = {}
+        self.on_quarantine: Optional[Callable[[str, str], Awaitable]] = None
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(workers)
+
+    @classmethod
+    def from_config(cls, regex_config: dict) -> "RegexPool":
+        executor = regex_config.get("executor", "auto")
+        return cls(
+            workers=regex_config.get("workers", 2),
+            timeout=regex_config.get("timeout", 2),
+            quarantine_after=regex_config.get("quarantine_after", 3),
+            validation_timeout=regex_config.get("validation_timeout", 1),
+            validation_corpus_chars=regex_config.get("validation_corpus_chars", 20000),
+            use_threads=None if executor == "auto" else executor == "thread",
+        )
+
+    async def start(self):
+        """Starts the workers now rather than on the first search."""
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, regex_worker.ping)
+                for _ in range(self.workers)
+            )
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._kill(self._executor)
+            self._executor = None
+
+    async def __aenter__(self) -> "RegexPool":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_threads:
+                self._executor = ThreadPoolExecutor(self.workers, "regex")
+            else:
+                # fork keeps workers from re-importing the application; they only
+                # ever run the re module.
+                method = (
+                    "fork"
+                    if "fork" in multiprocessing.get_all_start_methods()
+                    else None
+                )
+                self._executor = ProcessPoolExecutor(
+                    self.workers, multiprocessing.get_context(method)
+                )
+        return self._executor
+
+    def _kill(self, executor: Executor):
+        if isinstance(executor, ProcessPoolExecutor):
+            terminate_workers = getattr(executor, "terminate_workers", None)
+            if terminate_workers is not None:
+                terminate_workers()
+            else:
+                for process in list((executor._processes or {}).values()):
+                    process.terminate()
+        # Queued searches fail with BrokenProcessPool and are retried by _run().
+        executor.shutdown(wait=False)
+
+    def _restart(self, executor: Executor):
+        if executor is self._executor:
+            self._kill(executor)
+            self._executor = None
+
+    async def _run(self, timeout: float, pattern: str, fn, *args):
+        loop = asyncio.get_running_loop()
+        # One job per worker, so the time limit only counts the search itself.
+        async with self._slots:
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(executor, fn, *args), timeout
+                    )
+                except BrokenProcessPool:
+                    # Killed because another search timed out, try once more.
+                    self._restart(executor)
+                    if attempt:
+                        raise
+                except asyncio.TimeoutError:
+                    self._restart(executor)
+                    raise RegexTimeoutError(pattern, timeout) from None
+
+    async def search(self, pattern: str, text: str) -> bool:
+        """Whether the pattern matches. Quarantined patterns never match."""
+        if pattern in self.quarantined:
+            return False
+        try:
+            matched = await self._run(
+                self.timeout, pattern, regex_worker.search, pattern, text
+            )
+        except RegexTimeoutError as e:
+            strikes = self.strikes.get(pattern, 0) + 1
+            self.strikes[pattern] = strikes
+            logger.warning("%s on %d characters, strike %d", e, len(text), strikes)
+            if strikes >= self.quarantine_after:
+                await self._quarantine(pattern, str(e))
+            return False
+        self.strikes.pop(pattern, None)
+        return matched
+
+    async def _quarantine(self, pattern: str, reason: str):
+        self.quarantined[pattern] = reason
+        self.strikes.pop(pattern, None)
+        logger.error("Quarantined indicator pattern %r: %s", pattern, reason)
+        if self.on_quarantine is not None:
+            try:
+                await self.on_quarantine(pattern, reason)
+            except Exception:
+                logger.exception("Couldn't record quarantine of %r", pattern)
+
+    async def validate(self, pattern: str) -> Optional[str]:
+        """Returns why a pattern is rejected, or None if it is acceptable."""
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"Invalid regular expression: {e}"
+        try:
+            await self._run(
+                self.validation_timeout,
+                pattern,
+                regex_worker.time_pattern,
+                pattern,
+                self.validation_corpus_chars,
+            )
+        except RegexTimeoutError:
+            return (
+                f"Regular expression is too slow: it took over "
+                f"{self.validation_timeout}s on a test page"
+            )
+        return None
+
+
+global_regex_pool: Optional[RegexPool] = None
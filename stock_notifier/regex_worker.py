@@ -0,0 +1,47 @@
+"""Functions run inside the regex worker processes.
+
+Only the standard library is imported here, so starting a worker doesn't pull in
+the bot, the database or the log file handlers.
+"""
+
+import functools
+import re
+import time
+from typing import Iterator
+
+SYNTHETIC_HTML = (
+    '<div class="product" id="item-1">\n'
+    '  <span class="price">$19.99</span> <button>Add to cart</button>\n'
+    "  <p>In stock: 12 left. Ships in 1-2 days.</p>\n"
+    "</div>\n"
+)
+# Long runs without a match are what make nested quantifiers backtrack.
+ADVERSARIAL_RUNS = ("a", "0", " ", "<", "-", "\n", "ab", "<a>", "a ")
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.DOTALL)
+
+
+def search(pattern: str, text: str) -> bool:
+    return compile_pattern(pattern).search(text) is not None
+
+
+def synthetic_corpus(size: int) -> Iterator[str]:
+    yield (SYNTHETIC_HTML * (size // len(SYNTHETIC_HTML) + 1))[:size]
+    for run in ADVERSARIAL_RUNS:
+        yield run * (size // len(run)) + "!"
+
+
+def time_pattern(pattern: str, size: int) -> float:
+    """Seconds taken to search every document of the synthetic corpus."""
+    regex = compile_pattern(pattern)
+    start = time.perf_counter()
+    for text in synthetic_corpus(size):
+        regex.search(text)
+    return time.perf_counter() - start
+
+
+def ping() -> bool:
+    return True
@@ -0,0 +1,145 @@
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from stock_notifier import models
+from stock_notifier.indicators import CompiledIndicator, IndicatorEngine
+from stock_notifier.scheduler import Target
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def split_page_url(url: str) -> tuple[str, str]:
+    """Returns the normalized page URL and its hostname."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    hostname = (parts.hostname or "").lower()
+    netloc = hostname
+    if parts.port and DEFAULT_PORTS.get(scheme) != parts.port:
+        netloc = f"{hostname}:{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, "")), hostname
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so that products registered against the same page share a fetch."""
+    return split_page_url(url)[0]
+
+
+class ProductRecord:
+    """What the scraper needs to know about a product, without an ORM object."""
+
+    __slots__ = ("id", "name", "url", "indicator", "page_url", "host", "compiled")
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        url: str,
+        indicator: str,
+        compiled: Optional[CompiledIndicator] = None,
+    ):
+        self.id = id
+        self.name = name
+        self.url = url
+        self.indicator = indicator
+        self.page_url, self.host = split_page_url(url)
+        self.compiled = compiled
+
+    def __repr__(self) -> str:
+        return f"ProductRecord(id={self.id!r}, name={self.name!r}, url={self.url!r}, indicator={self.indicator!r})"
+
+
+class ProductRegistry:
+    """Every product grouped by host and page, kept current by product events.
+
+    Loaded once from plain rows at startup. Afterwards ``models`` product events
+    add and remove single records, and the host index is updated in place rather
+    than rebuilt for every scheduling pass.
+    """
+
+    def __init__(self, engine: Optional[IndicatorEngine] = None):
+        self.engine = engine
+        self.records: dict[int, ProductRecord] = {}
+        # Products are numbered in insertion order, so any with a higher id were
+        # added since, possibly by another process.
+        self.max_id = 0
+        self._hosts: dict[str, dict[str, Target]] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, product_id: int) -> bool:
+        return product_id in self.records
+
+    def load(self, rows: Iterable[tuple[int, str, str, str]]):
+        """Reconciles the registry with (id, name, url, indicator) rows."""
+        seen = set()
+        for id, name, url, indicator in rows:
+            seen.add(id)
+            record = self.records.get(id)
+            if record is None or (record.name, record.url, record.indicator) != (
+                name,
+                url,
+                indicator,
+            ):
+                self.add(id, name, url, indicator)
+        for product_id in [i for i in self.records if i not in seen]:
+            self.remove(product_id)
+
+    def add(self, id: int, name: str, url: str, indicator: str) -> ProductRecord:
+        if id in self.records:
+            self.remove(id)
+        record = ProductRecord(id, name, url, indicator)
+        self.max_id = max(self.max_id, id)
+        if self.engine is not None:
+            record.compiled = self.engine.compile(record)
+        self.records[id] = record
+        targets = self._hosts.setdefault(record.host, {})
+        target = targets.get(record.page_url)
+        if target is None:
+            targets[record.page_url] = Target(record.page_url, record.host, [record])
+        else:
+            target.products.append(record)
+        return record
+
+    def remove(self, product_id: int):
+        record = self.records.pop(product_id, None)
+        if record is None:
+            return
+        if self.engine is not None:
+            self.engine.invalidate(product_id)
+        targets = self._hosts[record.host]
+        target = targets[record.page_url]
+        target.products.remove(record)
+        if not target.products:
+            del targets[record.page_url]
+            if not targets:
+                del self._hosts[record.host]
+
+    def on_product_event(self, event: str, product: models.Product):
+        if event == "added":
+            self.add(product.id, product.name, product.url, product.indicator)
+        elif event == "deleted":
+            self.remove(product.id)
+
+    @property
+    def hosts(self) -> dict[str, list[Target]]:
+        return {host: list(targets.values()) for host, targets in self._hosts.items()}
+
+    def page_count(self) -> int:
+        return sum(len(targets) for targets in self._hosts.values())
+
+    def targets(
+        self, predicate: Optional[Callable[[ProductRecord], bool]] = None
+    ) -> Iterator[Target]:
+        """Yields each page with the products passing ``predicate``, if any do.
+
+        The targets are copies, since the scheduler replaces the products of its
+        own targets with theirs.
+        """
+        for targets in self._hosts.values():
+            for target in targets.values():
+                products = [
+                    p for p in target.products if predicate is None or predicate(p)
+                ]
+                if products:
+                    yield Target(target.url, target.host, products)
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from stock_notifier.logger import logger
+
+
+def content_hasher():
+    """Returns a hash object for fingerprinting response bodies incrementally."""
+    return hashlib.blake2b(digest_size=16)
+
+
+@dataclass
+class CacheEntry:
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # Indicator pattern -> whether it matched the page with this content hash.
+    matches: dict[str, bool] = field(default_factory=dict)
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """Bounded LRU cache of per-URL validators, content hashes and match results.
+
+    With a ``path`` it is persisted as JSON, only when it changed since the last
+    save.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.dirty = False
+
+    @classmethod
+    def from_config(cls, cache_config: dict) -> "ResponseCache":
+        return cls(
+            max_entries=cache_config.get("max_entries", 10000),
+            path=cache_config.get("path"),
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, entry: CacheEntry):
+        self.dirty = True
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def update(
+        self,
+        url: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        body_hash: Optional[str],
+        matches: dict[str, bool],
+        not_modified: bool = False,
+    ):
+        """Record a fetch.
+
+        ``body_hash`` is None when the body wasn't read completely, in which case
+        the results are kept but can't be reused on an identical body.
+        """
+        entry = self.get(url)
+        if entry is None or not (
+            not_modified or (body_hash is not None and body_hash == entry.content_hash)
+        ):
+            entry = CacheEntry(content_hash=body_hash)
+        entry.etag = etag or entry.etag
+        entry.last_modified = last_modified or entry.last_modified
+        entry.matches.update(matches)
+        self.put(url, entry)
+
+    def invalidate(self, url: str):
+        if self._entries.pop(url, None) is not None:
+            self.dirty = True
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r") as stream:
+                data = json.load(stream)
+        except (OSError, ValueError) as e:
+            logger.warning("Couldn't load response cache from %s: %s", self.path, e)
+            return
+        for url, entry in data.items():
+            self.put(url, CacheEntry(**entry))
+        self.dirty = False
+        logger.info("Loaded %d response cache entries from %s", len(self), self.path)
+
+    def _snapshot(self) -> Optional[dict]:
+        """Returns the entries to save, or None if there is nothing new to save."""
+        if self.path is None or not self.dirty:
+            return None
+        self.dirty = False
+        return {url: asdict(e) for url, e in self._entries.items()}
+
+    def _write(self, data: dict):
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w") as stream:
+            json.dump(data, stream)
+        os.replace(tmp_path, self.path)
+
+    def save(self):
+        data = self._snapshot()
+        if data is not None:
+            self._write(data)
+
+    async def save_async(self):
+        """Saves in a thread so encoding and writing don't block the event loop.
+
+        The entries are copied first, as checks keep updating them meanwhile.
+        """
+        data = self._snapshot()
+        if data is None:
+            return
+        try:
+            await asyncio.to_thread(self._write, data)
+        except OSError as e:
+            self.dirty = True
+            logger.warning("Couldn't save response cache to %s: %s", self.path, e)
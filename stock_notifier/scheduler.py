@@ -0,0 +1,272 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Iterable, Optional
+
+from stock_notifier import models
+from stock_notifier.health import HealthTracker
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second with bursts of up to ``burst`` requests."""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float]):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def try_acquire(self) -> float:
+        """Takes a token if available. Returns 0, or the seconds until one is."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class HostRateLimiter:
+    """Per-host token buckets enforcing politeness towards each retailer.
+
+    ``max_in_flight`` caps the checks of a host running at once, so a host that
+    answers slowly can't tie up every worker.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        host_overrides: Optional[dict[str, dict]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        max_in_flight: int = 2,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.host_overrides = dict(host_overrides or {})
+        self.clock = clock
+        self._buckets: dict[str, TokenBucket] = {}
+
+    @classmethod
+    def from_config(
+        cls, rate_limits_config: dict, default_rate: float
+    ) -> "HostRateLimiter":
+        default = rate_limits_config.get("default", {})
+        return cls(
+            rate=default.get("rate", default_rate),
+            burst=default.get("burst", 1),
+            host_overrides=rate_limits_config.get("hosts", {}),
+            max_in_flight=default.get("max_in_flight", 2),
+        )
+
+    def bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            override = self.host_overrides.get(host, {})
+            bucket = TokenBucket(
+                override.get("rate", self.rate),
+                override.get("burst", self.burst),
+                self.clock,
+            )
+            self._buckets[host] = bucket
+        return bucket
+
+    def try_acquire(self, host: str) -> float:
+        return self.bucket(host).try_acquire()
+
+    def in_flight_limit(self, host: str) -> int:
+        return self.host_overrides.get(host, {}).get(
+            "max_in_flight", self.max_in_flight
+        )
+
+
+class Target:
+    """A normalized URL and every product registered on it."""
+
+    __slots__ = ("url", "host", "products")
+
+    def __init__(self, url: str, host: str, products: list[models.Product]):
+        self.url = url
+        self.host = host
+        self.products = products
+
+
+class Scheduler:
+    """Priority queue of (next_due_time, target) gated by per-host token buckets.
+
+    Each host keeps its own queue ordered by due time, and a global heap orders
+    hosts by when their earliest target can run (due and holding a token), so a
+    rate limited or unhealthy host neither blocks other hosts nor reorders its own
+    targets. A host with as many checks running as the limiter allows isn't
+    ready until one of them is rescheduled.
+    Workers call ``get()`` to receive the next runnable target and
+    ``reschedule()`` it once checked. There is no cycle barrier: a slow host only
+    delays its own targets.
+    """
+
+    def __init__(
+        self,
+        limiter: HostRateLimiter,
+        clock: Callable[[], float] = time.monotonic,
+        initial_delay: Callable[[Target], float] = lambda target: 0.0,
+        health: Optional[HealthTracker] = None,
+    ):
+        self.limiter = limiter
+        self.health = health
+        self.clock = clock
+        self.initial_delay = initial_delay
+        self.targets: dict[str, Target] = {}
+        self._due: dict[str, float] = {}
+        self._host_queues: dict[str, list[tuple[float, int, str]]] = {}
+        self._host_ready: dict[str, float] = {}
+        self._host_not_before: dict[str, float] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._in_flight: set[str] = set()
+        # Targets handed out by get(), each one check, and their count per host.
+        self._checks: set[str] = set()
+        self._host_checks: dict[str, int] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def sync(self, targets: Iterable[Target]):
+        """Replaces the set of targets. New targets are due after ``initial_delay``."""
+        targets = {target.url: target for target in targets}
+        for url in list(self.targets):
+            if url not in targets:
+                del self.targets[url]
+                self._due.pop(url, None)
+        for url, target in targets.items():
+            existing = self.targets.get(url)
+            if existing is not None:
+                existing.products = target.products
+                continue
+            self.targets[url] = target
+            if url not in self._in_flight:
+                self.schedule(url, self.clock() + self.initial_delay(target))
+
+    def schedule(self, url: str, due: float):
+        host = self.targets[url].host
+        self._due[url] = due
+        heapq.heappush(
+            self._host_queues.setdefault(host, []), (due, next(self._counter), url)
+        )
+        self._update_host(host)
+
+    def reschedule(self, target: Target, interval: float):
+        self._in_flight.discard(target.url)
+        if target.url in self._checks:
+            self._checks.discard(target.url)
+            self._host_checks[target.host] -= 1
+            if not self._host_checks[target.host]:
+                del self._host_checks[target.host]
+        if target.url in self.targets:
+            self.schedule(target.url, self.clock() + interval)
+        else:
+            self._update_host(target.host)
+
+    def take_due(self, host: str, limit: int) -> list[Target]:
+        """Hands out up to ``limit`` more due targets of a host without taking
+        rate limit tokens, for checking them in the request of a target from
+        ``get()``."""
+        now = self.clock()
+        targets = []
+        while len(targets) < limit:
+            head = self._host_head(host)
+            if head is None or head[0] > now:
+                break
+            url = head[1]
+            heapq.heappop(self._host_queues[host])
+            del self._due[url]
+            self._in_flight.add(url)
+            targets.append(self.targets[url])
+        self._update_host(host)
+        return targets
+
+    def queue_depth(self) -> int:
+        """Number of targets that are due but not yet handed to a worker."""
+        now = self.clock()
+        return sum(1 for due in self._due.values() if due <= now)
+
+    def _host_head(self, host: str) -> Optional[tuple[float, str]]:
+        queue = self._host_queues.get(host)
+        while queue:
+            due, _, url = queue[0]
+            if self._due.get(url) == due:
+                return due, url
+            # Stale entry for a removed or rescheduled target.
+            heapq.heappop(queue)
+        self._host_queues.pop(host, None)
+        return None
+
+    def _update_host(self, host: str):
+        head = self._host_head(host)
+        checks = self._host_checks.get(host, 0)
+        if head is None or checks >= self.limiter.in_flight_limit(host):
+            self._host_ready.pop(host, None)
+            return
+        ready = max(head[0], self._host_not_before.get(host, 0.0))
+        if self._host_ready.get(host) == ready:
+            return
+        self._host_ready[host] = ready
+        heapq.heappush(self._heap, (ready, next(self._counter), host))
+        if self._heap[0][2] == host:
+            self._wakeup.set()
+
+    def _peek(self) -> Optional[tuple[float, str]]:
+        while self._heap:
+            ready, _, host = self._heap[0]
+            if self._host_ready.get(host) == ready:
+                return ready, host
+            heapq.heappop(self._heap)
+        return None
+
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def get(self) -> Target:
+        while True:
+            head = self._peek()
+            if head is None:
+                await self._wait(None)
+                continue
+            ready, host = head
+            now = self.clock()
+            if ready > now:
+                await self._wait(ready - now)
+                continue
+            heapq.heappop(self._heap)
+            del self._host_ready[host]
+            host_head = self._host_head(host)
+            if host_head is None:
+                continue
+            due, url = host_head
+            if due > now:
+                self._update_host(host)
+                continue
+            # Hosts with an open circuit don't take up a worker until they are
+            # due for a probe, leaving the capacity to healthy hosts.
+            wait = self.health.ready_in(host) if self.health else 0.0
+            if wait <= 0:
+                wait = self.limiter.try_acquire(host)
+            if wait > 0:
+                self._host_not_before[host] = now + wait
+                self._update_host(host)
+                continue
+            heapq.heappop(self._host_queues[host])
+            del self._due[url]
+            self._in_flight.add(url)
+            self._checks.add(url)
+            self._host_checks[host] = self._host_checks.get(host, 0) + 1
+            self._update_host(host)
+            return self.targets[url]
@@ -1,141 +1,567 @@
 import asyncio
+import codecs
 import random
-import re
 import time
-from collections import defaultdict
 from datetime import datetime
-from urllib.parse import urlparse
+from typing import Iterable, NamedTuple, Optional, Sequence
+from urllib.parse import urlsplit
 
 import aiohttp
 import pytz
 
-from stock_notifier import config, models
+from stock_notifier import config, diagnostics, health, metrics, models
+from stock_notifier.extractors import Extractor, ExtractorRegistry
+from stock_notifier.health import CircuitOpenError, RetryLaterError, parse_retry_after
+from stock_notifier.history import record_check
+from stock_notifier.http_client import HttpClient
+from stock_notifier.indicators import IndicatorEngine, StreamMatcher
 from stock_notifier.interface import notify
-from stock_notifier.logger import logger
+from stock_notifier.logger import Join, check_logger, logger
+from stock_notifier.polling import AdaptivePoller, PollingPolicy
+from stock_notifier.registry import ProductRecord, ProductRegistry, normalize_url
+from stock_notifier.response_cache import ResponseCache, content_hasher
+from stock_notifier.scheduler import HostRateLimiter, Scheduler, Target
+from stock_notifier.sharding import ShardCoordinator
 
 # Configuration
 sleep_seconds_config = config.get("sleep_seconds", {})
 SLEEP_SAME_HOST = sleep_seconds_config.get("same_host", 1)
 SLEEP_GLOBAL = sleep_seconds_config.get("global", 60)
 SLEEP_GLOBAL_JITTER = sleep_seconds_config.get("global_jitter", 10)
+PRODUCT_REFRESH_SECONDS = sleep_seconds_config.get("product_refresh", SLEEP_GLOBAL)
+# Full reload of the product registry, catching changes made by other processes.
+PRODUCT_RESYNC_SECONDS = sleep_seconds_config.get("product_resync", 3600)
 CONCURRENT_HOSTS_LIMIT = config.get("concurrent_hosts_limit", 20)
-USER_AGENT = (
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:134.0) Gecko/20100101 Firefox/134.0"
-)
-HEADERS = {
-    "User-Agent": USER_AGENT,
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Accept-Encoding": "gzip, deflate, br, zstd",
-    "Connection": "keep-alive",
-    "DNT": "1",
-}
+streaming_config = config.get("streaming", {})
+STREAMING_ENABLED = streaming_config.get("enabled", True)
+STREAM_CHUNK_SIZE = streaming_config.get("chunk_size", 64 * 1024)
+STREAM_REGEX_OVERLAP = streaming_config.get("regex_overlap", 4096)
+MAX_BODY_BYTES = streaming_config.get("max_body_bytes", 8 * 1024 * 1024)
+
+global_response_cache = ResponseCache()
+global_indicator_engine = IndicatorEngine()
+global_registry = ProductRegistry(global_indicator_engine)
+global_extractors = ExtractorRegistry()
+# Set when several workers split the hosts, otherwise every host is scraped.
+global_shard: Optional[ShardCoordinator] = None
 
 # Timezone configuration
-EASTERN_TZ = pytz.timezone("US/Eastern")
-WORK_HOURS_START = 8
-WORK_HOURS_END = 16
+polling_config = config.get("polling", {})
+work_hours_config = polling_config.get("work_hours", {})
+WORK_HOURS_TZ = pytz.timezone(work_hours_config.get("timezone", "US/Eastern"))
+WORK_HOURS_START = work_hours_config.get("start", 8)
+WORK_HOURS_END = work_hours_config.get("end", 16)
+OFF_HOURS_MULTIPLIER = work_hours_config.get("off_hours_multiplier", 2)
+
+global_poller = AdaptivePoller(PollingPolicy.from_config(polling_config, SLEEP_GLOBAL))
 
 
 def in_work_hours() -> bool:
-    """Check if current time is within work hours in Eastern Time"""
-    now = datetime.now(EASTERN_TZ)
+    """Check if current time is within the configured work hours"""
+    now = datetime.now(WORK_HOURS_TZ)
     return WORK_HOURS_START <= now.hour < WORK_HOURS_END
 
 
-async def get_html(url, session):
+class CheckOutcome(NamedTuple):
+    # Whether the page content differs from the previous fetch.
+    changed: bool
+    matches: dict[str, bool]
+
+
+class Page(NamedTuple):
+    status: int
+    html: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # None unless the whole body was read.
+    content_hash: Optional[str]
+    size: int = 0
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+async def read_page(
+    response: aiohttp.ClientResponse, matcher: Optional[StreamMatcher] = None
+) -> Page:
+    """Reads and decodes a response body incrementally, at most MAX_BODY_BYTES.
+
+    With a matcher, chunks are searched as they arrive and reading stops as soon as
+    every indicator has matched. Without one, the decoded body is returned.
+    """
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if response.status == 304:
+        return Page(304, None, etag, last_modified, None)
+
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset or "utf-8")("replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    hasher = content_hasher()
+    chunks = []
+    size = 0
+    truncated = False
+    complete = True
+    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+        if size + len(chunk) > MAX_BODY_BYTES:
+            logger.warning("Body of %s exceeds %d bytes", response.url, MAX_BODY_BYTES)
+            chunk = chunk[: MAX_BODY_BYTES - size]
+            truncated = True
+        size += len(chunk)
+        hasher.update(chunk)
+        text = decoder.decode(chunk)
+        if matcher is None:
+            chunks.append(text)
+        elif await matcher.feed(text):
+            # Stopping early only hashed the whole body if nothing was left.
+            complete = not truncated and response.content.at_eof()
+            break
+        if truncated:
+            complete = False
+            break
+    else:
+        text = decoder.decode(b"", final=True)
+        if matcher is None:
+            chunks.append(text)
+        elif text:
+            await matcher.feed(text)
+
+    return Page(
+        response.status,
+        "".join(chunks) if matcher is None else None,
+        etag,
+        last_modified,
+        hasher.hexdigest() if complete else None,
+        size,
+    )
+
+
+async def get_page(
+    url,
+    client: HttpClient,
+    headers: Optional[dict] = None,
+    matcher: Optional[StreamMatcher] = None,
+) -> Page:
+    host = urlsplit(url).hostname
+    tracker = health.global_host_health
     retries = 3
     for attempt in range(retries):
+        retry_in = tracker.ready_in(host)
+        if retry_in > 0:
+            raise CircuitOpenError(host, retry_in)
+        tracker.begin(host)
+        start_time = time.monotonic()
         try:
-            async with session.get(url) as response:
-                return await response.text()
+            if matcher is not None:
+                matcher.reset()
+            async with client.get(url, headers=headers) as response:
+                if response.status in (429, 503):
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    tracker.record_failure(
+                        host,
+                        f"HTTP {response.status}",
+                        time.monotonic() - start_time,
+                        retry_after,
+                    )
+                    metrics.FETCH_ERRORS.inc(1, host)
+                    raise RetryLaterError(url, response.status, retry_after)
+                if response.status >= 500:
+                    response.raise_for_status()
+                page = await read_page(response, matcher)
+            latency = time.monotonic() - start_time
+            tracker.record_success(host, latency)
+            metrics.FETCH_SECONDS.observe(latency, host)
+            metrics.FETCH_BYTES.inc(page.size, host)
+            return page
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            tracker.record_failure(host, repr(e), time.monotonic() - start_time)
+            metrics.FETCH_ERRORS.inc(1, host)
             if attempt == retries - 1:
-                logger.error(f"Final failed fetching {url}: {e}")
+                logger.error("Final failed fetching %s: %s", url, e)
                 raise e
             wait = 2**attempt
-            logger.warning(f"Retry {attempt + 1}/{retries} for {url} in {wait}s")
+            logger.warning("Retry %d/%d for %s in %ds", attempt + 1, retries, url, wait)
             await asyncio.sleep(wait)
 
 
-async def check(product: models.Product, session: aiohttp.ClientSession):
-    logger.info(
-        f"Checking {product.name} for indicator {product.indicator} at {product.url}"
+async def check(
+    products: Sequence[ProductRecord], client: HttpClient
+) -> Optional[CheckOutcome]:
+    """Fetch a page once and evaluate the indicator of every product registered on it."""
+    url = normalize_url(products[0].url)
+    host = urlsplit(url).hostname
+    indicators = {product.indicator for product in products}
+    check_logger.info(
+        "Checking %s for indicators %s at %s",
+        Join(products, "name"),
+        Join(indicators),
+        url,
     )
 
     try:
-        html = await get_html(product.url, session)
-        if re.search(product.indicator, html, re.DOTALL):
-            await notify(product)
+        # Only revalidate when we still know the result for every indicator,
+        # otherwise the body is needed to run the regexes.
+        cached = global_response_cache.get(url)
+        previous_hash = cached.content_hash if cached else None
+        if cached is None or not indicators.issubset(cached.matches):
+            cached = None
+        # With a known hash the whole body is read and hashed before any
+        # indicator runs, so an unchanged page costs no matching. Streaming
+        # matchers stop reading at the first match instead, which leaves no hash.
+        matcher = None
+        if STREAMING_ENABLED and not (cached and cached.content_hash):
+            matcher = global_indicator_engine.stream_matcher(
+                products, STREAM_REGEX_OVERLAP
+            )
+        start_time = time.monotonic()
+        page = await get_page(
+            products[0].url,
+            client,
+            cached.conditional_headers() if cached else None,
+            matcher,
+        )
+        if cached and (
+            page.not_modified
+            or (page.content_hash and page.content_hash == cached.content_hash)
+        ):
+            logger.debug("Page unchanged at %s, reusing last results", url)
+            matches = {indicator: cached.matches[indicator] for indicator in indicators}
+        elif matcher is not None:
+            matches = matcher.results
+        else:
+            matches = await global_indicator_engine.match(products, page.html)
+        global_response_cache.update(
+            url,
+            page.etag,
+            page.last_modified,
+            page.content_hash,
+            matches,
+            not_modified=page.not_modified,
+        )
+    except CircuitOpenError as e:
+        logger.warning("Skipped checking %s: %s", url, e)
+        return None
+    except RetryLaterError as e:
+        logger.warning("Skipped checking %s: %s", url, e)
+        record_check(
+            url,
+            host,
+            status=e.status,
+            latency=time.monotonic() - start_time,
+            error=str(e),
+        )
+        return None
     except Exception as e:
-        logger.exception(f"Critical error checking {product.name}: {e}")
+        logger.exception("Critical error checking %s: %s", url, e)
+        record_check(url, host, error=repr(e))
+        return None
+
+    for product in products:
+        if matches[product.indicator]:
+            try:
+                await notify(product)
+            except Exception as e:
+                logger.exception("Critical error notifying for %s: %s", product.name, e)
 
+    changed = (
+        not page.not_modified
+        and previous_hash is not None
+        and page.content_hash is not None
+        and page.content_hash != previous_hash
+    )
+    record_check(
+        url,
+        host,
+        status=page.status,
+        latency=time.monotonic() - start_time,
+        size=page.size,
+        not_modified=page.not_modified,
+        changed=changed,
+        matched=any(matches.values()),
+    )
+    return CheckOutcome(changed, matches)
 
-async def get_products():
-    async with models.global_async_session() as session:
-        return await session.scalars(models.select(models.Product))
 
+async def check_extracted(
+    pages: Sequence[Sequence[ProductRecord]], extractor: Extractor, client: HttpClient
+) -> list[Optional[CheckOutcome]]:
+    """Checks pages of one host with a single request to the extractor's endpoint.
+
+    Pages the extractor has no item id for are checked with their indicators.
+    """
+    outcomes: list[Optional[CheckOutcome]] = [None] * len(pages)
+    item_ids = {}
+    for i, products in enumerate(pages):
+        item_id = extractor.item_id(products[0].url)
+        if item_id is None:
+            outcomes[i] = await check(products, client)
+        else:
+            item_ids[i] = item_id
+    if not item_ids:
+        return outcomes
 
-async def check_product_list(host_products: list[models.Product]):
-    connector = aiohttp.TCPConnector(limit=5)
-    timeout = aiohttp.ClientTimeout(total=30)
+    ids = list(dict.fromkeys(item_ids.values()))
+    url = extractor.endpoint(pages[next(iter(item_ids))][0].url, ids)
+    host = urlsplit(url).hostname
+    check_logger.info(
+        "Checking %s through %s",
+        Join([p for i in item_ids for p in pages[i]], "name"),
+        url,
+    )
+    start_time = time.monotonic()
+    try:
+        page = await get_page(url, client)
+        if page.status != 200:
+            raise ValueError(f"HTTP {page.status}")
+        availability = extractor.parse(page.html, ids)
+    except CircuitOpenError as e:
+        logger.warning("Skipped checking %s: %s", url, e)
+        return outcomes
+    except RetryLaterError as e:
+        logger.warning("Skipped checking %s: %s", url, e)
+        record_check(url, host, status=e.status, error=str(e))
+        return outcomes
+    except Exception as e:
+        logger.exception("Critical error checking %s: %s", url, e)
+        record_check(url, host, error=repr(e))
+        return outcomes
+    latency = time.monotonic() - start_time
 
-    async with aiohttp.ClientSession(
-        timeout=timeout, connector=connector, headers=HEADERS
-    ) as session:
-        for i, product in enumerate(host_products):
+    for i, item_id in item_ids.items():
+        products = pages[i]
+        page_url = normalize_url(products[0].url)
+        if item_id not in availability:
+            logger.warning("%s has no item %s for %s", url, item_id, page_url)
+            continue
+        available = availability[item_id]
+        matches = {product.indicator: available for product in products}
+        # The response covers many pages, so a page changed when its results did.
+        cached = global_response_cache.get(page_url)
+        changed = cached is not None and any(
+            cached.matches.get(indicator) != match
+            for indicator, match in matches.items()
+        )
+        global_response_cache.update(page_url, None, None, None, matches)
+        for product in products if available else ():
             try:
-                await check(product, session)
-                if i < len(host_products) - 1:
-                    jitter = random.uniform(-0.5, 0.5)
-                    await asyncio.sleep(max(SLEEP_SAME_HOST + jitter, 0.1))
+                await notify(product)
             except Exception as e:
-                logger.error(f"Error checking product {product.name}: {e}")
+                logger.exception("Critical error notifying for %s: %s", product.name, e)
+        record_check(
+            page_url,
+            products[0].host,
+            status=page.status,
+            latency=latency,
+            size=page.size // len(item_ids),
+            changed=changed,
+            matched=available,
+        )
+        outcomes[i] = CheckOutcome(changed, matches)
+    return outcomes
+
+
+async def check_pages(
+    pages: Sequence[Sequence[ProductRecord]], client: HttpClient
+) -> list[Optional[CheckOutcome]]:
+    """Checks pages of one host, through its extractor if it has one."""
+    extractor = global_extractors.get(pages[0][0].host)
+    if extractor is None:
+        return [await check(products, client) for products in pages]
+    outcomes = []
+    for i in range(0, len(pages), extractor.batch_size):
+        batch = pages[i : i + extractor.batch_size]
+        outcomes += await check_extracted(batch, extractor, client)
+    return outcomes
+
+
+def plan_checks(products: Iterable[models.Product]) -> dict[str, list[Target]]:
+    """Group products by host, then by normalized URL so each page is fetched once."""
+    registry = ProductRegistry()
+    for product in products:
+        registry.add(product.id, product.name, product.url, product.indicator)
+    return registry.hosts
+
+
+async def check_product_list(host_targets: list[Target], client: HttpClient):
+    if not host_targets:
+        return
+    batch_size = global_extractors.batch_size(host_targets[0].host)
+    for i in range(0, len(host_targets), batch_size):
+        batch = host_targets[i : i + batch_size]
+        try:
+            with metrics.CHECK_SECONDS.time(batch[0].host):
+                await check_pages([list(t.products) for t in batch], client)
+            if i + batch_size < len(host_targets):
+                jitter = random.uniform(-0.5, 0.5)
+                await asyncio.sleep(max(SLEEP_SAME_HOST + jitter, 0.1))
+        except Exception as e:
+            logger.error("Error checking URL %s: %s", batch[0].url, e)
+
+
+async def check_products(client: HttpClient):
+    """Checks every product once, walking each host sequentially."""
+    with diagnostics.global_profiler.cycle("check_products"):
+        start_time = time.monotonic()
+        global_registry.load(await models.get_product_rows())
+        hosts = global_registry.hosts
+        products = len(global_registry)
+        fetches = global_registry.page_count()
+        logger.info(
+            "Checking %d products with %d fetches across %d hosts "
+            "(%d fetches saved by dedup)",
+            products,
+            fetches,
+            len(hosts),
+            products - fetches,
+        )
 
+        semaphore = asyncio.Semaphore(CONCURRENT_HOSTS_LIMIT)
 
-async def check_products():
-    products = await get_products()
-    hosts = defaultdict(list)
-    for p in products:
-        o = urlparse(p.url)
-        hosts[o.hostname].append(p)
+        async def limited_task(host_targets):
+            wait_start = time.monotonic()
+            async with semaphore:
+                metrics.SEMAPHORE_WAIT_SECONDS.observe(
+                    time.monotonic() - wait_start, "hosts"
+                )
+                await check_product_list(host_targets, client)
 
-    semaphore = asyncio.Semaphore(CONCURRENT_HOSTS_LIMIT)
+        tasks = []
+        for host_targets in hosts.values():
+            tasks.append(asyncio.create_task(limited_task(host_targets)))
 
-    async def limited_task(host_products):
-        async with semaphore:
-            await check_product_list(host_products)
+        await asyncio.gather(*tasks)
+        metrics.CYCLE_SECONDS.observe(time.monotonic() - start_time, "one_shot")
 
-    tasks = []
-    for host_products in hosts.values():
-        tasks.append(asyncio.create_task(limited_task(host_products)))
 
-    await asyncio.gather(*tasks)
+def check_interval(interval: float) -> float:
+    # Poll less often outside work hours
+    if not in_work_hours():
+        interval *= OFF_HOURS_MULTIPLIER
 
+    jitter = random.uniform(-SLEEP_GLOBAL_JITTER, SLEEP_GLOBAL_JITTER)
+    return max(interval + jitter, SLEEP_SAME_HOST)
 
-async def scraper_loop():
+
+async def check_worker(scheduler: Scheduler, client: HttpClient):
     while True:
-        start_check_time = time.time()
-        logger.info("Checking product stock...")
+        target = await scheduler.get()
+        # Hosts with a batching extractor check every due page in one request.
+        targets = [target] + scheduler.take_due(
+            target.host, global_extractors.batch_size(target.host) - 1
+        )
+        # Lost the host since the last resync, which will drop it.
+        owned = global_shard is None or global_shard.owns(target.host)
+        # The registry may change the pages' products while they are being checked.
+        pages = [list(t.products) if owned else [] for t in targets]
+        intervals = [global_poller.interval(products) for products in pages]
         try:
-            await check_products()
+            checked = [i for i, products in enumerate(pages) if products]
+            if checked:
+                with metrics.CHECK_SECONDS.time(target.host):
+                    outcomes = await check_pages([pages[i] for i in checked], client)
+                for i, outcome in zip(checked, outcomes):
+                    if outcome is not None:
+                        intervals[i] = global_poller.record(
+                            pages[i], outcome.changed, outcome.matches
+                        )
         except Exception as e:
-            logger.error(f"Error in main check cycle: {e}")
-        finish_check_time = time.time()
-        time_spent_checking = finish_check_time - start_check_time
+            logger.error("Error checking URL %s: %s", target.url, e)
+        finally:
+            for target, interval in zip(targets, intervals):
+                scheduler.reschedule(target, check_interval(interval))
 
-        # Determine base sleep time based on work hours
-        if in_work_hours():
-            base_sleep = SLEEP_GLOBAL
-        else:
-            base_sleep = 2 * SLEEP_GLOBAL  # double sleep outside work hours
 
-        jitter = random.uniform(-SLEEP_GLOBAL_JITTER, SLEEP_GLOBAL_JITTER)
-        sleep_time = max(base_sleep - time_spent_checking + jitter, 0)
+async def wait_for_refresh():
+    """Sleeps until the next refresh, cut short when the shard's hosts change."""
+    if global_shard is None:
+        await asyncio.sleep(PRODUCT_REFRESH_SECONDS)
+        return
+    try:
+        await asyncio.wait_for(global_shard.changed.wait(), PRODUCT_REFRESH_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    global_shard.changed.clear()
 
-        logger.info(
-            f"Time spent checking stock: {round(time_spent_checking, 2)} seconds\n"
-            f"Base sleep: {base_sleep}s, Jitter: {round(jitter, 2)}s\n"
-            f"Sleeping for {round(sleep_time, 2)} seconds..."
+
+async def scraper_loop(client: HttpClient):
+    """Continuously checks products as they fall due, without a cycle barrier.
+
+    Workers pull due targets from the scheduler whenever their host has a rate
+    limit token; the loop itself only refreshes the product list periodically.
+    With ``global_shard`` set, only hosts leased to this worker are scheduled and
+    the schedule is refreshed as soon as the leases change.
+    """
+    limiter = HostRateLimiter.from_config(
+        config.get("rate_limits", {}), default_rate=1 / SLEEP_SAME_HOST
+    )
+    scheduler = Scheduler(
+        limiter,
+        initial_delay=lambda t: global_poller.initial_delay(t.products),
+        health=health.global_host_health,
+    )
+    metrics.QUEUE_DEPTH.set_function(scheduler.queue_depth)
+    global_poller.load(await models.get_poll_states())
+    global_registry.load(await models.get_product_rows())
+    resynced_at = time.monotonic()
+    workers = [
+        asyncio.create_task(check_worker(scheduler, client))
+        for _ in range(CONCURRENT_HOSTS_LIMIT)
+    ]
+    if global_shard is not None:
+        await global_shard.sync(global_registry.hosts)
+        # The first refresh below picks up the initial leases.
+        global_shard.changed.clear()
+        workers.append(
+            asyncio.create_task(global_shard.run(lambda: global_registry.hosts))
         )
-        await asyncio.sleep(sleep_time)
+    try:
+        while True:
+            diagnostics.global_profiler.start_cycle("scraper_loop")
+            refresh_start = time.monotonic()
+            try:
+                if time.monotonic() - resynced_at > PRODUCT_RESYNC_SECONDS:
+                    global_registry.load(await models.get_product_rows())
+                    resynced_at = time.monotonic()
+                else:
+                    # Products added by other processes, such as catalog imports.
+                    for row in await models.get_product_rows(global_registry.max_id):
+                        global_registry.add(*row)
+                global_poller.set_subscribers(await models.get_subscriber_counts())
+                targets = list(global_registry.targets(global_poller.should_poll))
+                if global_shard is not None:
+                    targets = [t for t in targets if global_shard.owns(t.host)]
+                scheduler.sync(targets)
+                products = sum(len(target.products) for target in targets)
+                hosts = len({target.host for target in targets})
+                logger.info(
+                    "Scheduling %d subscribed products as %d fetches across %d "
+                    "hosts (%d fetches saved by dedup)",
+                    products,
+                    len(scheduler),
+                    hosts,
+                    products - len(scheduler),
+                )
+                await models.save_poll_states(global_poller.pop_dirty())
+            except Exception as e:
+                logger.error("Error refreshing products: %s", e)
+            metrics.CYCLE_SECONDS.observe(time.monotonic() - refresh_start, "refresh")
+
+            logger.info(
+                "Queue depth: %d, HTTP client pool stats: %s",
+                scheduler.queue_depth(),
+                client.stats(),
+            )
+            degraded_hosts = health.global_host_health.degraded_hosts()
+            if degraded_hosts:
+                logger.warning("Degraded hosts: %s", degraded_hosts)
+            await global_response_cache.save_async()
+            await wait_for_refresh()
+    finally:
+        diagnostics.global_profiler.end_cycle()
+        for worker in workers:
+            worker.cancel()
+        await models.save_poll_states(global_poller.pop_dirty())
+        if global_shard is not None:
+            await global_shard.release()
@@ -0,0 +1,133 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from stock_notifier import models
+from stock_notifier.logger import logger
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of hosts onto workers.
+
+    Each worker is placed on the ring ``replicas`` times, so when a worker joins
+    or leaves only about 1/n of the hosts change owner.
+    """
+
+    def __init__(self, workers: Iterable[str], replicas: int = 64):
+        points = sorted(
+            (_hash(f"{worker}#{i}"), worker)
+            for worker in set(workers)
+            for i in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def __len__(self) -> int:
+        return len(set(self._workers))
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._workers[i]
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardCoordinator:
+    """Splits hosts between scraper workers sharing a database.
+
+    Every ``heartbeat_seconds`` the worker records a heartbeat, hashes every
+    host onto the workers that are alive, and renews or claims leases on the
+    hosts that hash to it. A host is only scraped by the worker holding its
+    lease, so during a rebalance a host moves once its previous owner released
+    it or, if that worker died, once the lease expired after ``lease_seconds``.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        lease_seconds: float = 30,
+        heartbeat_seconds: float = 10,
+        replicas: int = 64,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.replicas = replicas
+        self.clock = clock
+        self.owned: frozenset[str] = frozenset()
+        self.workers: list[str] = []
+        # Set whenever the owned hosts change, so the scheduler is resynced.
+        self.changed = asyncio.Event()
+        self._valid_until = 0.0
+
+    @classmethod
+    def from_config(
+        cls, sharding_config: dict, worker_id: Optional[str] = None
+    ) -> "ShardCoordinator":
+        return cls(
+            worker_id=worker_id
+            or sharding_config.get("worker_id")
+            or default_worker_id(),
+            lease_seconds=sharding_config.get("lease_seconds", 30),
+            heartbeat_seconds=sharding_config.get("heartbeat_seconds", 10),
+            replicas=sharding_config.get("replicas", 64),
+        )
+
+    def owns(self, host: str) -> bool:
+        # Leases this worker couldn't renew may already belong to another one.
+        return host in self.owned and time.monotonic() < self._valid_until
+
+    async def sync(self, hosts: Iterable[str]) -> frozenset[str]:
+        """Heartbeats and updates leases. Returns the hosts this worker owns."""
+        started = time.monotonic()
+        now = self.clock()
+        lease = timedelta(seconds=self.lease_seconds)
+        workers = await models.heartbeat_worker(self.worker_id, now, now - lease)
+        ring = HashRing(workers, self.replicas)
+        hosts = set(hosts)
+        assigned = {host for host in hosts if ring.owner(host) == self.worker_id}
+        owned = frozenset(
+            await models.sync_host_leases(self.worker_id, assigned, now, now + lease)
+        )
+        self._valid_until = started + self.lease_seconds
+        if owned != self.owned or workers != self.workers:
+            logger.info(
+                "Worker %s owns %d of %d hosts with %d live workers "
+                "(%d assigned hosts still leased by others)",
+                self.worker_id,
+                len(owned),
+                len(hosts),
+                len(workers),
+                len(assigned - owned),
+            )
+        if owned != self.owned:
+            self.changed.set()
+        self.owned = owned
+        self.workers = workers
+        return owned
+
+    async def run(self, hosts: Callable[[], Iterable[str]]):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.sync(hosts())
+            except Exception as e:
+                logger.exception("Error renewing host leases: %s", e)
+
+    async def release(self):
+        self.owned = frozenset()
+        await models.release_worker(self.worker_id)
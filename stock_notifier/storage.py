@@ -0,0 +1,77 @@
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from stock_notifier import models
+
+DEFAULT_URL = "sqlite+aiosqlite:///sqlite.db"
+
+# WAL lets the scraper read while the bot writes. synchronous=normal is safe
+# with WAL and avoids an fsync per commit. A negative cache_size is in KiB.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -20000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
+# Workers sharing a database may start at once and race to create the schema.
+SCHEMA_ATTEMPTS = 3
+
+# Engine keyword arguments that may be set from the database config.
+POOL_SETTINGS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle")
+
+
+def apply_pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def create_engine(database_config: dict) -> AsyncEngine:
+    """Creates the engine described by the ``database`` config section.
+
+    For SQLite, the configured pragmas are applied to every new connection.
+    """
+    engine = create_async_engine(
+        database_config.get("url", DEFAULT_URL),
+        echo=database_config.get("echo", False),
+        **{k: database_config[k] for k in POOL_SETTINGS if k in database_config},
+    )
+    if engine.dialect.name == "sqlite":
+        pragmas = {**DEFAULT_PRAGMAS, **database_config.get("pragmas", {})}
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+    return engine
+
+
+def create_schema(connection):
+    """Creates missing tables and the indexes missing from existing tables."""
+    models.Base.metadata.create_all(connection)
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+async def setup(database_config: dict) -> AsyncEngine:
+    """Creates the engine and schema and installs models.global_async_session."""
+    engine = create_engine(database_config)
+    for attempt in range(SCHEMA_ATTEMPTS):
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(create_schema)
+            break
+        except (OperationalError, ProgrammingError):
+            # Another worker starting at the same time created some of the
+            # tables between the existence check and CREATE; check again.
+            if attempt == SCHEMA_ATTEMPTS - 1:
+                raise
+    models.global_async_session = async_sessionmaker(engine, expire_on_commit=False)
+    return engine
@@ -0,0 +1,16 @@
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from stock_notifier import models
+
+
+@pytest.fixture()
+async def global_session(monkeypatch):
+    """An in-memory database installed as models.global_async_session."""
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async_session = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(models, "global_async_session", async_session, raising=False)
+    yield async_session
+    await engine.dispose()
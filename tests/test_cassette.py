@@ -0,0 +1,78 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stock_notifier import scraper
+from stock_notifier.cassette import (
+    Cassette,
+    CassetteError,
+    CassetteWriter,
+    RecordingClient,
+    ReplayClient,
+)
+from stock_notifier.http_client import HttpClient
+from stock_notifier.models import Product
+
+
+@pytest.fixture()
+async def shop_server():
+    async def page(request: web.Request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        name = request.match_info["name"]
+        body = f"<html>{name} " + ("Add to cart" if name == "gum" else "Sold out")
+        return web.Response(
+            text=body + "x" * 100000,
+            content_type="text/html",
+            charset="latin-1",
+            headers={"ETag": '"v1"'},
+        )
+
+    app = web.Application()
+    app.router.add_get("/{name}", page)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_mmap", [True, False])
+async def test_replays_recorded_pages(shop_server, tmp_path, use_mmap):
+    path = tmp_path / "pages.cassette"
+    urls = [str(shop_server.make_url(f"/{name}")) for name in ("gum", "mint")]
+    async with HttpClient() as client:
+        with CassetteWriter(path) as writer:
+            recorder = RecordingClient(client, writer)
+            for url in urls:
+                # Recorded with a body even though the server would answer 304.
+                page = await scraper.get_page(url, recorder, {"If-None-Match": '"v1"'})
+                assert page.status == 200
+    assert path.stat().st_size < 2000
+
+    await shop_server.close()
+    with Cassette(path, use_mmap=use_mmap) as cassette:
+        replay = ReplayClient(cassette)
+        product = Product(id=1, name="gum", url=urls[0], indicator="Add to cart")
+        matcher = scraper.global_indicator_engine.stream_matcher([product], 0)
+        page = await scraper.get_page(urls[0], replay, None, matcher)
+        assert matcher.results == {"Add to cart": True}
+
+        page = await scraper.get_page(urls[1], replay)
+        assert page.html.startswith("<html>mint Sold out")
+        assert page.etag == '"v1"'
+        assert page.size == 100000 + len("<html>mint Sold out")
+
+        page = await scraper.get_page(urls[1], replay, {"If-None-Match": '"v1"'})
+        assert page.not_modified
+        page = await scraper.get_page(urls[1] + "x", replay)
+        assert page.status == 404
+    assert replay.stats() == dict(requests=4, replayed=3, missing=1)
+
+
+def test_rejects_unfinished_cassette(tmp_path):
+    path = tmp_path / "pages.cassette"
+    writer = CassetteWriter(path)
+    writer._file.close()
+    with pytest.raises(CassetteError):
+        Cassette(writer._tmp_path)
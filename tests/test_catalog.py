@@ -0,0 +1,61 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from stock_notifier import models
+from stock_notifier.catalog import CatalogImporter, export_products, open_text
+
+
+def write_csv(path, rows):
+    with open_text(path, "w") as file:
+        writer = csv.DictWriter(file, ["name", "url", "indicator", "regex"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.mark.asyncio
+async def test_import_skips_duplicates_and_invalid_rows(global_session, tmp_path):
+    await models.add_product("candy", "https://candy.com", "in\\-stock")
+    path = tmp_path / "products.csv"
+    write_csv(
+        path,
+        [
+            dict(name="candy", url="https://candy.com", indicator="in-stock"),
+            dict(name="gum", url="https://gum.com", indicator="In Stock"),
+            dict(name="gum", url="https://gum.com", indicator="In Stock"),
+            dict(name="mint", url="https://mint.com", indicator=r"\d+ left", regex=1),
+            dict(name="bad", url="not a url", indicator="x"),
+            dict(name="bad", url="https://bad.com", indicator="(", regex="true"),
+        ],
+    )
+
+    report = await CatalogImporter(batch_size=2).import_file(path)
+    assert (report.rows, report.inserted, report.duplicates, report.invalid) == (
+        6,
+        2,
+        2,
+        2,
+    )
+    assert [e.split(":")[0] for e in report.errors] == ["line 6", "line 7"]
+    products = {p.name: p.indicator for p in await models.get_products()}
+    assert products == {"candy": "in\\-stock", "gum": "In\\ Stock", "mint": r"\d+ left"}
+
+
+@pytest.mark.asyncio
+async def test_export_round_trips(global_session, tmp_path):
+    await models.add_product("gum", "https://gum.com", "In\\ Stock")
+    await models.add_product("mint", "https://mint.com", r"\d+ left")
+    path = tmp_path / "products.jsonl.gz"
+    assert await export_products(path, batch_size=1) == 2
+
+    with gzip.open(path, "rt") as file:
+        rows = [json.loads(line) for line in file]
+    assert rows == [
+        dict(name="gum", url="https://gum.com", indicator="In Stock", regex=False),
+        dict(name="mint", url="https://mint.com", indicator=r"\d+ left", regex=True),
+    ]
+
+    report = await CatalogImporter().import_file(path)
+    assert (report.inserted, report.duplicates) == (0, 2)
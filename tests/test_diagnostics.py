@@ -0,0 +1,46 @@
+import asyncio
+import pstats
+import time
+
+import pytest
+
+from stock_notifier.diagnostics import CycleProfiler, LoopLagMonitor
+
+
+def block_the_loop():
+    time.sleep(0.4)
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_reports_blocking_stack():
+    monitor = LoopLagMonitor(threshold=0.15, interval=0.02)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        assert monitor.stalls == 0
+        block_the_loop()
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+    # One stall, reported once, naming the blocking call.
+    assert monitor.stalls == 1
+    assert "block_the_loop" in monitor.last_stack
+
+
+@pytest.mark.asyncio
+async def test_profiler_writes_armed_cycles(tmp_path):
+    profiler = CycleProfiler(cycles=1, directory=tmp_path)
+    with profiler.cycle("check_products"):
+        assert not profiler.active
+
+    profiler.arm()
+    with profiler.cycle("check_products"):
+        assert profiler.active
+        await asyncio.sleep(0)
+        sum(range(1000))
+    with profiler.cycle("check_products"):
+        assert not profiler.active
+
+    (path,) = tmp_path.iterdir()
+    assert path.name.startswith("check_products-")
+    assert pstats.Stats(str(path)).total_calls > 0
@@ -0,0 +1,65 @@
+import pytest
+
+from stock_notifier import models
+from stock_notifier.interface.directory import DirectMessageDirectory, TTLCache
+from stock_notifier.interface.discord import digest_parts, format_digest
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TTLCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" was the least recently used.
+    assert cache.get("b") is None
+    assert len(cache) == 2
+    now[0] = 10
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+
+
+@pytest.mark.asyncio
+async def test_directory_opens_each_channel_once():
+    opened = []
+
+    async def open_channel(discord_id: int):
+        opened.append(discord_id)
+        return f"channel{discord_id}"
+
+    directory = DirectMessageDirectory(open_channel)
+    for _ in range(3):
+        assert await directory.get(1) == "channel1"
+    assert await directory.get(2) == "channel2"
+    assert opened == [1, 2]
+    assert (directory.hits, directory.misses) == (2, 2)
+
+    directory.invalidate(1)
+    await directory.get(1)
+    assert opened == [1, 2, 1]
+
+
+def test_format_digest_splits_long_digests():
+    products = [
+        models.Product(id=i, name=f"product {i}", url=f"https://shop.com/{i}")
+        for i in range(30)
+    ]
+    assert format_digest(products[:1])[0].startswith("Product product 0 in stock!")
+
+    messages = format_digest(products, limit=200)
+    assert len(messages) > 1
+    assert all(len(message) <= 200 for message in messages)
+    assert messages[0].startswith("30 of your products are in stock!")
+    assert sum(message.count("https://shop.com/") for message in messages) == 30
+
+
+def test_digest_parts_list_each_product_once():
+    products = [
+        models.Product(id=i, name=f"product {i}", url=f"https://shop.com/{i}")
+        for i in range(30)
+    ]
+    parts = digest_parts(products, limit=200)
+    assert [p for _, listed in parts for p in listed] == products
+    for message, listed in parts:
+        assert message.count("https://shop.com/") == len(listed)
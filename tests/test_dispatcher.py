@@ -0,0 +1,175 @@
+import pytest
+
+from stock_notifier import models
+from stock_notifier.dispatcher import NotificationDispatcher, PartiallySent
+
+
+async def add_subscribers(count: int) -> models.Product:
+    product = await models.add_product("candy", "https://candy.com", "in-stock")
+    for discord_id in range(1, count + 1):
+        await models.add_discord_user(f"user{discord_id}", discord_id)
+        await models.add_discord_subscription(discord_id, id=product.id)
+    return product
+
+
+@pytest.mark.asyncio
+async def test_enqueue_skips_already_pending(global_session):
+    product = await add_subscribers(3)
+    assert await models.enqueue_notifications(product.id) == 3
+    assert await models.enqueue_notifications(product.id) == 0
+    pending = await models.get_pending_notifications(10)
+    assert [n.user.discord_id for n in pending] == [1, 2, 3]
+    assert all(n.product.id == product.id for n in pending)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_retries_and_gives_up(global_session):
+    product = await add_subscribers(3)
+    await models.enqueue_notifications(product.id)
+    sent = []
+
+    async def send(user: models.User, notifications) -> bool:
+        if user.discord_id == 2:
+            raise ConnectionError("discord is down")
+        if user.discord_id == 3:
+            return False
+        sent.append(user.discord_id)
+        return True
+
+    dispatcher = NotificationDispatcher(
+        send, retry_seconds=0, max_attempts=2, digest_seconds=0
+    )
+    assert await dispatcher.dispatch_pending() == 3
+    assert sent == [1]
+    assert await models.get_subscribed_product_names(1) == []
+    assert await models.get_subscribed_product_names(2) == ["candy"]
+
+    async with global_session() as session:
+        rows = {
+            n.user_id: n
+            for n in await session.scalars(models.select(models.Notification))
+        }
+    assert rows.keys() == {2, 3}
+    assert rows[2].status == models.NOTIFICATION_PENDING
+    assert rows[2].attempts == 1
+    assert rows[3].status == models.NOTIFICATION_FAILED
+
+    assert await dispatcher.dispatch_pending() == 1
+    assert await models.get_pending_notifications(10) == []
+
+
+@pytest.mark.asyncio
+async def test_remove_subscriptions_in_bulk(global_session):
+    product = await add_subscribers(3)
+    other = await models.add_product("gum", "https://gum.com", "in-stock")
+    await models.add_discord_subscription(1, id=other.id)
+
+    removed = await models.remove_subscriptions(product.id, [1, 3, 4])
+    assert sorted(removed) == [1, 3]
+    assert await models.get_subscriber_counts() == {product.id: 1, other.id: 1}
+
+
+@pytest.mark.asyncio
+async def test_dispatch_sends_one_digest_per_user(global_session):
+    products = [
+        await models.add_product(f"candy{i}", f"https://candy.com/{i}", "in-stock")
+        for i in range(3)
+    ]
+    for discord_id in (1, 2):
+        await models.add_discord_user(f"user{discord_id}", discord_id)
+    for product in products:
+        await models.add_discord_subscription(1, id=product.id)
+    await models.add_discord_subscription(2, id=products[0].id)
+    for product in products:
+        await models.enqueue_notifications(product.id)
+    sent = []
+
+    async def send(user: models.User, notifications) -> bool:
+        sent.append((user.discord_id, sorted(n.product.name for n in notifications)))
+        return True
+
+    dispatcher = NotificationDispatcher(send, digest_seconds=60)
+    # Nothing is sent while the detections may still be joined by others.
+    assert await dispatcher.dispatch_pending() == 0
+
+    dispatcher.digest_seconds = 0
+    assert await dispatcher.dispatch_pending() == 4
+    assert sorted(sent) == [(1, ["candy0", "candy1", "candy2"]), (2, ["candy0"])]
+    assert await models.get_subscribed_product_names(1) == []
+    assert await models.get_pending_notifications(10) == []
+
+
+@pytest.mark.asyncio
+async def test_sent_notification_kept_if_unsubscribing_fails(
+    global_session, monkeypatch
+):
+    product = await add_subscribers(1)
+    await models.enqueue_notifications(product.id)
+
+    async def send(user: models.User, notifications) -> bool:
+        return True
+
+    async def fail(*args):
+        raise ConnectionError("database went away")
+
+    monkeypatch.setattr(models, "_delete_subscriptions", fail)
+    dispatcher = NotificationDispatcher(send, digest_seconds=0)
+    with pytest.raises(ConnectionError):
+        await dispatcher.dispatch_pending()
+    # The notification isn't deleted while the subscription remains, which would
+    # let the next detection notify the user again.
+    assert len(await models.get_pending_notifications(10)) == 1
+    assert await models.get_subscribed_product_names(1) == ["candy"]
+
+
+@pytest.mark.asyncio
+async def test_partially_sent_digest_retries_only_the_rest(global_session):
+    products = [
+        await models.add_product(f"candy{i}", f"https://candy.com/{i}", "in-stock")
+        for i in range(3)
+    ]
+    await models.add_discord_user("user1", 1)
+    for product in products:
+        await models.add_discord_subscription(1, id=product.id)
+        await models.enqueue_notifications(product.id)
+    sent = []
+
+    async def send(user: models.User, notifications) -> bool:
+        sent.append(sorted(n.product.name for n in notifications))
+        if len(notifications) > 1:
+            raise PartiallySent(notifications[:1])
+        return True
+
+    dispatcher = NotificationDispatcher(send, retry_seconds=0, digest_seconds=0)
+    assert await dispatcher.dispatch_pending() == 3
+    assert sorted(await models.get_subscribed_product_names(1)) == ["candy1", "candy2"]
+    assert await dispatcher.dispatch_pending() == 2
+    # The first product wasn't sent again.
+    assert sent == [["candy0", "candy1", "candy2"], ["candy1", "candy2"]]
+
+
+@pytest.mark.asyncio
+async def test_digest_leaves_out_notifications_in_backoff(global_session):
+    products = [
+        await models.add_product(f"candy{i}", f"https://candy.com/{i}", "in-stock")
+        for i in range(2)
+    ]
+    await models.add_discord_user("user1", 1)
+    for product in products:
+        await models.add_discord_subscription(1, id=product.id)
+    await models.enqueue_notifications(products[0].id)
+    sent = []
+
+    async def send(user: models.User, notifications) -> bool:
+        sent.append([n.product.name for n in notifications])
+        if len(sent) == 1:
+            raise ConnectionError("discord is down")
+        return True
+
+    dispatcher = NotificationDispatcher(send, retry_seconds=60, digest_seconds=0)
+    assert await dispatcher.dispatch_pending() == 1
+    # A new detection doesn't bring forward the retry of the first one.
+    await models.enqueue_notifications(products[1].id)
+    assert await dispatcher.dispatch_pending() == 1
+    assert sent == [["candy0"], ["candy1"]]
+    assert await models.get_subscribed_product_names(1) == ["candy0"]
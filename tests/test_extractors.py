@@ -0,0 +1,171 @@
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stock_notifier import scraper
+from stock_notifier.extractors import (
+    Extractor,
+    ExtractorError,
+    ExtractorRegistry,
+    JsonApiExtractor,
+    ShopifyExtractor,
+)
+from stock_notifier.http_client import HttpClient
+from stock_notifier.registry import ProductRegistry
+from stock_notifier.response_cache import ResponseCache
+
+IN_STOCK = {"gum", "mint"}
+
+
+@pytest.fixture()
+async def shop_server():
+    """A retailer with 500 KB product pages, a Shopify style product JSON and a
+    multi-SKU stock API. Counts the requests and body bytes it serves."""
+
+    async def product(request: web.Request):
+        handle = request.match_info["handle"]
+        if handle.endswith(".js"):
+            handle = handle[: -len(".js")]
+            body = json.dumps(
+                dict(handle=handle, available=handle in IN_STOCK, variants=[])
+            )
+        else:
+            token = "Add to cart" if handle in IN_STOCK else "Sold out"
+            body = f"<html><h1>{handle}</h1>{'x' * 500_000}{token}</html>"
+        server.served.append(len(body))
+        return web.Response(text=body, content_type="text/html")
+
+    async def stock(request: web.Request):
+        ids = request.query["ids"].split(",")
+        body = json.dumps({"items": [dict(sku=i, inStock=i in IN_STOCK) for i in ids]})
+        server.served.append(len(body))
+        return web.json_response(text=body)
+
+    app = web.Application()
+    app.router.add_get("/products/{handle}", product)
+    app.router.add_get("/api/stock", stock)
+    server = TestServer(app)
+    server.served = []
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.fixture()
+def extractors(monkeypatch):
+    monkeypatch.setattr(scraper, "global_response_cache", ResponseCache())
+    monkeypatch.setattr(scraper, "global_extractors", ExtractorRegistry())
+    return scraper.global_extractors
+
+
+def product_pages(server: TestServer, handles: list[str]) -> list[list]:
+    registry = ProductRegistry(scraper.global_indicator_engine)
+    for i, handle in enumerate(handles, 1):
+        url = str(server.make_url(f"/products/{handle}"))
+        registry.add(i, handle, url, "Add to cart")
+    return [target.products for target in registry.targets()]
+
+
+@pytest.mark.asyncio
+async def test_shopify_extractor_saves_bytes(
+    global_session, shop_server, extractors, record_property
+):
+    pages = product_pages(shop_server, ["gum", "candy", "mint"])
+    async with HttpClient() as client:
+        html_outcomes = await scraper.check_pages(pages, client)
+        html_bytes = sum(shop_server.served)
+
+        shop_server.served.clear()
+        extractors.extractors["127.0.0.1"] = ShopifyExtractor({})
+        json_outcomes = await scraper.check_pages(pages, client)
+        json_bytes = sum(shop_server.served)
+
+    assert [o.matches for o in json_outcomes] == [o.matches for o in html_outcomes]
+    assert [o.matches["Add to cart"] for o in json_outcomes] == [True, False, True]
+    assert len(shop_server.served) == 3
+    record_property("html_bytes_per_check", html_bytes // 3)
+    record_property("extractor_bytes_per_check", json_bytes // 3)
+    assert json_bytes * 1000 < html_bytes
+
+
+@pytest.mark.asyncio
+async def test_json_api_batches_pages(
+    global_session, shop_server, extractors, record_property
+):
+    extractors.extractors["127.0.0.1"] = JsonApiExtractor(
+        dict(
+            endpoint=str(shop_server.make_url("/api/stock")) + "?ids={ids}",
+            id_pattern=r"/products/(\w+)$",
+            items_field="items",
+            id_field="sku",
+            available_field="inStock",
+            batch_size=10,
+        )
+    )
+    # The last page has no SKU in its URL and is checked with its indicator.
+    pages = product_pages(shop_server, ["gum", "candy", "mint", "fudge", "taffy-2"])
+    async with HttpClient() as client:
+        outcomes = await scraper.check_pages(pages, client)
+        assert [o.matches["Add to cart"] for o in outcomes] == [
+            True,
+            False,
+            True,
+            False,
+            False,
+        ]
+        assert not any(o.changed for o in outcomes)
+        assert len(shop_server.served) == 2
+
+        # Availability changes are reported, as the response is never the same.
+        IN_STOCK.add("candy")
+        try:
+            outcomes = await scraper.check_pages(pages[:4], client)
+        finally:
+            IN_STOCK.discard("candy")
+    assert [o.changed for o in outcomes] == [False, True, False, False]
+    record_property("api_bytes_per_check", shop_server.served[-1] // 4)
+
+
+def test_registry_from_config():
+    registry = ExtractorRegistry.from_config(
+        {
+            "Shop.com": {"plugin": "shopify"},
+            "api.com": {
+                "plugin": "json_api",
+                "endpoint": "https://api.com/stock?ids={ids}",
+                "id_pattern": r"/p/(\d+)",
+            },
+        }
+    )
+    assert isinstance(registry.get("shop.com"), ShopifyExtractor)
+    assert registry.batch_size("api.com") == 50
+    assert registry.batch_size("other.com") == 1
+    assert registry.get("api.com").endpoint("", ["1", "2"]) == (
+        "https://api.com/stock?ids=1,2"
+    )
+    with pytest.raises(ExtractorError):
+        ExtractorRegistry.from_config({"x.com": {"plugin": "magento"}})
+    with pytest.raises(ExtractorError):
+        ExtractorRegistry.from_config({"x.com": {"plugin": "json_api"}})
+
+
+def test_incomplete_extractor_cannot_be_built():
+    class NoParse(Extractor):
+        def item_id(self, url):
+            return url
+
+        def endpoint(self, url, item_ids):
+            return url
+
+    with pytest.raises(TypeError):
+        NoParse({})
+
+
+def test_for_url_finds_pages_ignoring_their_indicator():
+    registry = ExtractorRegistry.from_config({"shop.com": {"plugin": "shopify"}})
+    assert registry.for_url("https://shop.com/products/gum").name == "shopify"
+    # Pages without an item id are still checked with their indicator.
+    assert registry.for_url("https://shop.com/pages/about") is None
+    assert registry.for_url("https://other.com/products/gum") is None
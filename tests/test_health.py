@@ -0,0 +1,74 @@
+import pytest
+
+from stock_notifier.health import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    HealthTracker,
+    parse_retry_after,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture()
+def tracker(clock: FakeClock) -> HealthTracker:
+    return HealthTracker(
+        failure_threshold=3, open_seconds=10, max_open_seconds=30, clock=clock
+    )
+
+
+def test_circuit_opens_after_repeated_failures(tracker: HealthTracker):
+    for _ in range(2):
+        tracker.record_failure("a.com", "timeout")
+    assert tracker.ready_in("a.com") == 0
+    tracker.record_failure("a.com", "timeout")
+    assert tracker.host("a.com").state == OPEN
+    assert tracker.ready_in("a.com") == 10
+    assert "a.com" in tracker.degraded_hosts()
+
+
+def test_half_open_probe(tracker: HealthTracker, clock: FakeClock):
+    for _ in range(3):
+        tracker.record_failure("a.com", "timeout")
+    clock.now = 10
+    assert tracker.ready_in("a.com") == 0
+    assert tracker.host("a.com").state == HALF_OPEN
+    tracker.begin("a.com")
+    assert tracker.ready_in("a.com") > 0
+
+    tracker.record_failure("a.com", "timeout")
+    assert tracker.host("a.com").state == OPEN
+    assert tracker.ready_in("a.com") == 20
+
+    clock.now = 30
+    assert tracker.ready_in("a.com") == 0
+    tracker.begin("a.com")
+    tracker.record_success("a.com", latency=0.5)
+    assert tracker.host("a.com").state == CLOSED
+    assert tracker.ready_in("a.com") == 0
+
+
+def test_retry_after(tracker: HealthTracker):
+    tracker.record_failure("a.com", "HTTP 429", retry_after=120)
+    assert tracker.host("a.com").state == CLOSED
+    assert tracker.ready_in("a.com") == 120
+    assert tracker.snapshot("a.com")["retry_in"] == 120
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("30") == 30
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from stock_notifier import models
+from stock_notifier.history import CheckHistory
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_in_one_batch(global_session):
+    history = CheckHistory(batch_size=3)
+    history.record("https://shop.com/a", "shop.com", status=200, latency=0.1, size=10)
+    history.record("https://shop.com/a", "shop.com", status=304, not_modified=True)
+    assert not history._wakeup.is_set()
+    history.record("https://shop.com/b", "shop.com", error="TimeoutError()")
+    # The batch size was reached, so the run loop is woken.
+    assert history._wakeup.is_set()
+
+    assert await history.flush() == 3
+    assert len(history) == 0
+    results = await models.get_check_results("https://shop.com/a")
+    assert [r.status for r in results] == [304, 200]
+
+
+@pytest.mark.asyncio
+async def test_compaction_rolls_up_old_results(global_session):
+    now = datetime(2026, 1, 10, 12, 30)
+    history = CheckHistory(
+        retention_hours=24, hourly_retention_days=7, clock=lambda: now
+    )
+    old = datetime(2026, 1, 8, 9, 0)
+    for minute, status, latency in [(5, 200, 0.2), (25, 500, 0.4), (45, 200, 0.6)]:
+        history.clock = lambda minute=minute: old + timedelta(minutes=minute)
+        history.record("https://shop.com/a", "shop.com", status=status, latency=latency)
+    history.clock = lambda: datetime(2025, 12, 1)
+    history.record("https://shop.com/a", "shop.com", status=200)
+    history.clock = lambda: now
+    history.record("https://shop.com/a", "shop.com", status=200, matched=True)
+    await history.flush()
+
+    assert await history.compact() == 4
+    (recent,) = await models.get_check_results("https://shop.com/a")
+    assert recent.matched
+    # The hour from over 7 days ago was aggregated, then dropped.
+    (stats,) = await models.get_hourly_check_stats("shop.com")
+    assert stats.hour == datetime(2026, 1, 8, 9)
+    assert (stats.checks, stats.errors) == (3, 1)
+    assert stats.avg_latency == pytest.approx(0.4)
+    assert stats.max_latency == pytest.approx(0.6)
+
+
+@pytest.mark.parametrize(
+    "dialect, function",
+    [
+        (sqlite.dialect(), "strftime"),
+        (postgresql.dialect(), "date_trunc"),
+        (mysql.dialect(), "date_format"),
+    ],
+)
+def test_hour_of_compiles_per_dialect(dialect, function):
+    sql = str(models.hour_of(models.CheckResult.checked_at).compile(dialect=dialect))
+    assert sql.startswith(f"{function}(")
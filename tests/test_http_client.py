@@ -0,0 +1,32 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stock_notifier.http_client import HttpClient
+
+
+@pytest.fixture()
+async def server():
+    async def page(request: web.Request):
+        return web.Response(text="in-stock")
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused(server: TestServer):
+    async with HttpClient(limit_per_host=1) as client:
+        for _ in range(5):
+            async with client.get(str(server.make_url("/"))) as response:
+                assert await response.text() == "in-stock"
+        stats = client.stats()
+    assert stats["requests"] == 5
+    assert stats["connections_created"] == 1
+    assert stats["connections_reused"] == 4
+    assert stats["reuse_ratio"] == pytest.approx(0.8)
+    assert client.session is None
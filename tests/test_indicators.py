@@ -0,0 +1,64 @@
+import re
+
+import pytest
+
+from stock_notifier.indicators import IndicatorEngine, LiteralSetMatcher, literal_of
+from stock_notifier.models import Product
+
+
+def test_literal_of():
+    assert literal_of(re.escape("Add to cart (2)")) == "Add to cart (2)"
+    assert literal_of("in-stock") == "in-stock"
+    assert literal_of(r"\d+ left") is None
+    assert literal_of("in.stock") is None
+
+
+def test_literal_set_matcher_finds_overlapping_literals():
+    matcher = LiteralSetMatcher(["in stock", "in", "stock", "sold out"])
+    assert matcher.find("now in stock!") == {"in stock", "in", "stock"}
+    assert matcher.find("nothing here") == {"in"}
+    assert matcher.find("") == set()
+
+
+@pytest.mark.asyncio
+async def test_engine_matches_literals_and_regexes():
+    engine = IndicatorEngine()
+    products = [
+        Product(id=1, name="a", url="u", indicator=re.escape("Add to cart")),
+        Product(id=2, name="b", url="u", indicator=re.escape("$5.00")),
+        Product(id=3, name="c", url="u", indicator=r"stock:\s*\d+"),
+        Product(id=4, name="d", url="u", indicator="[invalid"),
+    ]
+    results = await engine.match(products, "<b>Add to cart</b>\nstock: 3")
+    assert results == {
+        re.escape("Add to cart"): True,
+        re.escape("$5.00"): False,
+        r"stock:\s*\d+": True,
+        "[invalid": False,
+    }
+
+
+def test_engine_recompiles_edited_and_forgets_deleted_products():
+    engine = IndicatorEngine()
+    product = Product(id=1, name="a", url="u", indicator="sold out")
+    assert engine.compile(product).literal == "sold out"
+
+    product.indicator = r"sold\s+out"
+    assert engine.compile(product).regex is not None
+
+    engine.on_product_event("deleted", product)
+    assert 1 not in engine._compiled
+
+
+@pytest.mark.asyncio
+async def test_stream_matcher_finds_matches_across_chunks():
+    engine = IndicatorEngine()
+    products = [
+        Product(id=1, name="a", url="u", indicator=re.escape("Add to cart")),
+        Product(id=2, name="b", url="u", indicator=r"stock:\s*\d+"),
+    ]
+    matcher = engine.stream_matcher(products, regex_overlap=16)
+    assert not await matcher.feed("<b>Add to")
+    assert not await matcher.feed(" cart</b> stock:")
+    assert await matcher.feed(" 3")
+    assert matcher.results == {re.escape("Add to cart"): True, r"stock:\s*\d+": True}
@@ -0,0 +1,118 @@
+import gzip
+import logging
+import queue
+import time
+
+from stock_notifier.logger import (
+    DeferredQueueHandler,
+    Join,
+    LogPipeline,
+    SampleFilter,
+    create_file_handler,
+)
+
+
+def make_record(msg="message %s", args=("arg",)) -> logging.LogRecord:
+    return logging.makeLogRecord(dict(msg=msg, args=args, levelno=logging.INFO))
+
+
+def test_sample_filter_every():
+    sample = SampleFilter(every=3)
+    passed = [sample.filter(make_record()) for _ in range(9)]
+    assert passed.count(True) == 3
+    assert sample.suppressed == 6
+
+
+def test_sample_filter_max_per_second():
+    sample = SampleFilter(max_per_second=2)
+    passed = [sample.filter(make_record()) for _ in range(10)]
+    # All ten land in at most two one-second windows.
+    assert 2 <= passed.count(True) <= 4
+
+
+def test_join_formats_lazily():
+    class Item:
+        formatted = 0
+
+        @property
+        def name(self):
+            Item.formatted += 1
+            return "item"
+
+    items = [Item(), Item()]
+    record = make_record("Checking %s", (Join(items, "name"),))
+    assert Item.formatted == 0
+    assert record.getMessage() == "Checking item, item"
+    assert str(Join({"a"})) == "a"
+
+
+def test_deferred_queue_handler_keeps_args_and_drops_when_full():
+    log_queue = queue.Queue(2)
+    handler = DeferredQueueHandler(log_queue)
+    for i in range(4):
+        handler.handle(make_record(args=(i,)))
+    assert handler.dropped == 2
+    record = log_queue.get_nowait()
+    assert record.args == (0,)
+    assert record.getMessage() == "message 0"
+
+    # Once there's room again the drops are reported.
+    log_queue.get_nowait()
+    handler.handle(make_record(args=(4,)))
+    assert handler.dropped == 0
+    assert log_queue.get_nowait().args == (4,)
+    assert log_queue.get_nowait().getMessage() == (
+        "Dropped 2 log records, the log queue was full"
+    )
+
+
+def test_pipeline_rotates_and_compresses(tmp_path):
+    file_handler = create_file_handler(
+        dict(directory=tmp_path, file="test.log", max_bytes=200, backup_count=2)
+    )
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    pipeline = LogPipeline([file_handler])
+    test_logger = logging.getLogger("stock-notifier-test")
+    test_logger.addHandler(pipeline.handler)
+    test_logger.setLevel(logging.INFO)
+    pipeline.start()
+    try:
+        for i in range(20):
+            test_logger.info("line %d %s", i, "x" * 40)
+    finally:
+        pipeline.stop()
+        test_logger.removeHandler(pipeline.handler)
+        file_handler.close()
+
+    names = sorted(path.name for path in tmp_path.iterdir())
+    assert names == ["test.log", "test.log.1.gz", "test.log.2.gz"]
+    with gzip.open(tmp_path.joinpath("test.log.1.gz"), "rt") as file:
+        assert file.read().startswith("line ")
+    assert (
+        tmp_path.joinpath("test.log").read_text().endswith("line 19 " + "x" * 40 + "\n")
+    )
+
+
+def test_pipeline_pauses_for_forks_without_draining():
+    written = []
+
+    class SlowHandler(logging.Handler):
+        def emit(self, record):
+            time.sleep(0.05)
+            written.append(record.getMessage())
+
+    pipeline = LogPipeline([SlowHandler()])
+    pipeline.start()
+    try:
+        for i in range(20):
+            pipeline.handler.handle(make_record(args=(i,)))
+        start = time.monotonic()
+        pipeline.pause()
+        # Waited for at most the record being written, not the whole queue.
+        assert time.monotonic() - start < 0.5
+        assert not pipeline.queue.mutex.acquire(blocking=False)
+        pipeline.resume()
+        assert len(written) < 20
+    finally:
+        pipeline.stop()
+    assert len(written) == 20
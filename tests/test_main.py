@@ -0,0 +1,50 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from stock_notifier.main import parse_args
+
+ROOT = Path(__file__).parent.parent
+
+
+def loaded_modules(code: str, modules: tuple[str, ...]) -> list[str]:
+    code += f"\nimport json, sys\nprint(json.dumps([m for m in {modules!r} if m in sys.modules]))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        ("scrape", ["stock_notifier.scraper"]),
+        ("bot", ["discord"]),
+        ("all", ["discord", "stock_notifier.scraper"]),
+    ],
+)
+def test_modes_import_only_what_they_run(mode, expected):
+    code = f"from stock_notifier import main\nmain.import_mode({mode!r})"
+    assert loaded_modules(code, ("discord", "stock_notifier.scraper")) == expected
+
+
+def test_package_import_defers_config():
+    assert loaded_modules("import stock_notifier", ("yaml",)) == []
+    assert loaded_modules("from stock_notifier import config", ("yaml",)) == ["yaml"]
+
+
+def test_parse_args():
+    assert parse_args([]).mode == "all"
+    args = parse_args(["scrape", "--worker-id", "w1"])
+    assert (args.mode, args.worker_id) == ("scrape", "w1")
+
+
+def test_replay_only_in_scrape_mode():
+    assert parse_args(["scrape", "--replay", "pages.cassette"]).replay
+    for mode in ([], ["all"], ["bot"]):
+        with pytest.raises(SystemExit):
+            parse_args(mode + ["--replay", "pages.cassette"])
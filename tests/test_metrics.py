@@ -0,0 +1,83 @@
+import aiohttp
+import pytest
+
+from stock_notifier import metrics
+from stock_notifier.metrics import (
+    NULL_METRIC,
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    timed,
+)
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    fetches = registry.register(Counter("fetches_total", "Fetches.", ("host",)))
+    depth = registry.register(Gauge("queue_depth", "Queue depth."))
+    latency = registry.register(
+        Histogram("latency_seconds", "Latency.", ("host",), buckets=(0.1, 1))
+    )
+    fetches.inc(1, "shop.com")
+    fetches.inc(2, 'a"b.com')
+    depth.set_function(lambda: 7)
+    latency.observe(0.05, "shop.com")
+    latency.observe(0.5, "shop.com")
+    latency.observe(5, "shop.com")
+
+    assert registry.render().splitlines() == [
+        "# HELP fetches_total Fetches.",
+        "# TYPE fetches_total counter",
+        'fetches_total{host="shop.com"} 1',
+        'fetches_total{host="a\\"b.com"} 2',
+        "# HELP queue_depth Queue depth.",
+        "# TYPE queue_depth gauge",
+        "queue_depth 7",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{host="shop.com",le="0.1"} 1',
+        'latency_seconds_bucket{host="shop.com",le="1.0"} 2',
+        'latency_seconds_bucket{host="shop.com",le="+Inf"} 3',
+        'latency_seconds_sum{host="shop.com"} 5.55',
+        'latency_seconds_count{host="shop.com"} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_timed_labels_by_function_name():
+    histogram = Histogram("db_seconds", "DB time.", ("function",))
+
+    @timed(histogram)
+    async def get_things():
+        return 1
+
+    assert await get_things() == 1
+    assert 'db_seconds_count{function="get_things"} 1' in histogram.render()
+
+
+def test_disabled_metrics_cost_nothing():
+    async def get_things():
+        return 1
+
+    assert timed(NULL_METRIC)(get_things) is get_things
+    with NULL_METRIC.time("x"):
+        NULL_METRIC.observe(1, "x")
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(monkeypatch, unused_tcp_port):
+    registry = Registry()
+    registry.register(Counter("checks_total", "Checks.")).inc(3)
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    runner = await metrics.start_server("127.0.0.1", unused_tcp_port)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"http://127.0.0.1:{unused_tcp_port}/metrics"
+            ) as response:
+                assert response.headers["Content-Type"].startswith("text/plain")
+                assert "checks_total 3" in await response.text()
+    finally:
+        await runner.cleanup()
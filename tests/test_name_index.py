@@ -0,0 +1,94 @@
+import pytest
+
+from stock_notifier import models
+from stock_notifier.name_index import ProductNameIndex
+
+
+@pytest.fixture()
+def index() -> ProductNameIndex:
+    index = ProductNameIndex()
+    index.load(
+        [
+            (1, "Switch OLED"),
+            (2, "switch lite"),
+            (3, "PS5"),
+            (4, "Steam Deck"),
+            (5, "PS5"),
+        ],
+        [(10, 3), (10, 4)],
+    )
+    return index
+
+
+def test_prefix_before_substring(index: ProductNameIndex):
+    assert index.search("sw") == ["switch lite", "Switch OLED"]
+    assert index.search("e") == ["Steam Deck", "switch lite", "Switch OLED"]
+    assert index.search("", limit=2) == ["PS5", "Steam Deck"]
+
+
+def test_subscribed_and_unsubscribed(index: ProductNameIndex):
+    assert index.subscribed_names(10) == ["PS5", "Steam Deck"]
+    # Product 5 is also named PS5 and isn't subscribed yet.
+    assert index.unsubscribed_names(10) == ["PS5", "switch lite", "Switch OLED"]
+    assert index.unsubscribed_names(None, "ps") == ["PS5"]
+    assert index.subscribed_names(None) == []
+
+
+def test_write_through_updates(index: ProductNameIndex):
+    index.on_product_event("added", models.Product(id=6, name="Xbox"))
+    index.on_product_event("deleted", models.Product(id=3, name="PS5"))
+    index.on_subscription_event("added", 10, [5, 6])
+    index.on_subscription_event("removed", 10, [4])
+    assert index.subscribed_names(10) == ["PS5", "Xbox"]
+    assert index.unsubscribed_names(10) == ["Steam Deck", "switch lite", "Switch OLED"]
+
+    index.on_product_event("deleted", models.Product(id=5, name="PS5"))
+    assert "PS5" not in index.search()
+
+
+@pytest.mark.asyncio
+async def test_models_emit_subscription_events(global_session, monkeypatch):
+    index = ProductNameIndex()
+    monkeypatch.setattr(models, "product_listeners", [index.on_product_event])
+    monkeypatch.setattr(models, "subscription_listeners", [index.on_subscription_event])
+    user = await models.add_discord_user("bob", 42)
+    product = await models.add_product("candy", "https://candy.com", "in-stock")
+    await models.add_discord_subscription(42, name="candy")
+    assert index.subscribed_names(user.id) == ["candy"]
+    await models.remove_subscriptions(product.id, [user.id])
+    assert index.subscribed_names(user.id) == []
+    await models.delete_product(id=product.id)
+    assert index.search() == []
+
+
+@pytest.mark.asyncio
+async def test_failing_listener_does_not_skip_others(global_session, monkeypatch):
+    def broken(event, product):
+        raise ValueError("broken")
+
+    index = ProductNameIndex()
+    monkeypatch.setattr(models, "product_listeners", [broken, index.on_product_event])
+    product = await models.add_product("candy", "https://candy.com", "in-stock")
+    assert index.search() == ["candy"]
+    assert await models.delete_product(id=product.id)
+    assert index.search() == []
+
+
+@pytest.mark.asyncio
+async def test_catch_up_finds_products_of_other_processes(global_session, monkeypatch):
+    # Events of an import in another process never reach this index.
+    monkeypatch.setattr(models, "product_listeners", [])
+    now = 0.0
+    index = ProductNameIndex(catch_up_seconds=10, clock=lambda: now)
+    await models.add_product("candy", "https://candy.com", "in-stock")
+    await index.catch_up()
+    assert index.search() == ["candy"]
+
+    await models.add_products(
+        [dict(name="gum", url="https://gum.com", indicator="in-stock")]
+    )
+    await index.catch_up()
+    assert index.search() == ["candy"]
+    now = 10.0
+    await index.catch_up()
+    assert index.search() == ["candy", "gum"]
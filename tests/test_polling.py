@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from stock_notifier.models import Product
+from stock_notifier.polling import AdaptivePoller, PollingPolicy
+
+
+@pytest.fixture()
+def poller() -> AdaptivePoller:
+    policy = PollingPolicy(
+        min_interval=10, max_interval=100, initial_interval=40, backoff=2, speedup=0.5
+    )
+    poller = AdaptivePoller(policy)
+    poller.set_subscribers({1: 1, 2: 15})
+    return poller
+
+
+def test_unchanged_pages_back_off_to_max(poller: AdaptivePoller):
+    product = Product(id=1, name="a", url="u", indicator="x")
+    intervals = [poller.record([product], False, {"x": False}) for _ in range(4)]
+    assert poller.state(1).interval == 100
+    assert intervals == sorted(intervals)
+
+
+def test_changes_and_restocks_speed_up(poller: AdaptivePoller):
+    product = Product(id=1, name="a", url="u", indicator="x")
+    poller.record([product], True, {"x": False})
+    assert poller.state(1).interval == 20
+    assert poller.state(1).last_changed is not None
+    poller.record([product], False, {"x": True})
+    assert poller.state(1).interval == 10
+    assert poller.state(1).last_restock is not None
+
+
+def test_subscribers_and_shared_pages(poller: AdaptivePoller):
+    lonely = Product(id=1, name="a", url="u", indicator="x")
+    popular = Product(id=2, name="b", url="u", indicator="y")
+    unsubscribed = Product(id=3, name="c", url="u", indicator="z")
+    assert poller.interval([popular]) < poller.interval([lonely])
+    assert poller.interval([lonely, popular]) == poller.interval([popular])
+    assert not poller.should_poll(unsubscribed)
+
+
+def test_initial_delay_and_dirty_states(poller: AdaptivePoller):
+    product = Product(id=1, name="a", url="u", indicator="x")
+    now = datetime.now()
+    assert poller.initial_delay([product], now) == 0
+    poller.record([product], False, {"x": False}, now=now - timedelta(seconds=30))
+    assert poller.initial_delay([product], now) == pytest.approx(
+        poller.interval([product]) - 30
+    )
+    assert [state.product_id for state in poller.pop_dirty()] == [1]
+    assert poller.pop_dirty() == []
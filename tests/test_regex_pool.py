@@ -0,0 +1,76 @@
+import asyncio
+import re
+import time
+
+import pytest
+
+from stock_notifier import models
+from stock_notifier.indicators import IndicatorEngine
+from stock_notifier.models import Product
+from stock_notifier.regex_pool import RegexPool
+
+CATASTROPHIC = r"(a+)+$"
+
+
+@pytest.fixture()
+async def pool():
+    async with RegexPool(
+        workers=2, timeout=0.5, validation_timeout=0.5, use_threads=False
+    ) as pool:
+        yield pool
+
+
+@pytest.mark.asyncio
+async def test_validate(pool):
+    assert await pool.validate(r"stock:\s*\d+") is None
+    assert "Invalid" in await pool.validate("[invalid")
+    assert "too slow" in await pool.validate(CATASTROPHIC)
+
+
+@pytest.mark.asyncio
+async def test_slow_pattern_is_quarantined_without_blocking(pool, global_session):
+    pool.quarantine_after = 2
+    pool.on_quarantine = models.quarantine_pattern
+    product = await models.add_product("gum", "https://gum.com", CATASTROPHIC)
+    start = time.monotonic()
+    assert not await pool.search(CATASTROPHIC, "a" * 40 + "!")
+    assert time.monotonic() - start < 5
+    assert CATASTROPHIC not in pool.quarantined
+    assert not await pool.search(CATASTROPHIC, "a" * 40 + "!")
+    assert CATASTROPHIC in pool.quarantined
+    assert await models.get_quarantined_products() == [
+        (product.id, "gum", CATASTROPHIC)
+    ]
+    # Quarantined patterns are skipped, and the restarted pool keeps working.
+    assert not await pool.search(CATASTROPHIC, "aaa")
+    assert await pool.search(r"stock:\s*\d+", "stock: 3")
+
+
+@pytest.mark.asyncio
+async def test_engine_evaluates_regexes_in_pool(pool):
+    engine = IndicatorEngine(pool=pool)
+    products = [
+        Product(id=1, name="a", url="u", indicator=re.escape("Add to cart")),
+        Product(id=2, name="b", url="u", indicator=r"stock:\s*\d+"),
+        Product(id=3, name="c", url="u", indicator=r"sold\s+out"),
+    ]
+    assert await engine.match(products, "<b>Add to cart</b>\nstock: 3") == {
+        re.escape("Add to cart"): True,
+        r"stock:\s*\d+": True,
+        r"sold\s+out": False,
+    }
+
+
+@pytest.mark.asyncio
+async def test_time_limit_excludes_waiting_for_a_worker(pool):
+    # Four times as many jobs as workers, each within the time limit.
+    await asyncio.gather(*(pool._run(0.5, "sleep", time.sleep, 0.2) for _ in range(8)))
+
+
+@pytest.mark.asyncio
+async def test_strikes_must_be_consecutive(pool):
+    pool.quarantine_after = 2
+    assert not await pool.search(CATASTROPHIC, "a" * 40 + "!")
+    assert await pool.search(CATASTROPHIC, "aaa")
+    assert not await pool.search(CATASTROPHIC, "a" * 40 + "!")
+    assert CATASTROPHIC not in pool.quarantined
@@ -0,0 +1,106 @@
+import pytest
+
+from stock_notifier import models
+from stock_notifier.indicators import IndicatorEngine
+from stock_notifier.models import Product
+from stock_notifier.registry import ProductRegistry
+from stock_notifier.scheduler import HostRateLimiter, Scheduler
+
+
+def test_registry_groups_pages_by_host():
+    registry = ProductRegistry(IndicatorEngine())
+    registry.load(
+        [
+            (1, "a", "https://shop.com/item", "x"),
+            (2, "b", "https://SHOP.com/item#top", "y"),
+            (3, "c", "https://store.com/item", "x"),
+        ]
+    )
+    assert len(registry) == 3
+    assert registry.page_count() == 2
+    (target,) = registry.hosts["shop.com"]
+    assert target.url == "https://shop.com/item"
+    assert [p.id for p in target.products] == [1, 2]
+    assert target.products[0].compiled.literal == "x"
+
+
+def test_registry_product_events_update_index():
+    registry = ProductRegistry()
+    registry.load([(1, "a", "https://shop.com/item", "x")])
+    (target,) = registry.hosts["shop.com"]
+
+    registry.on_product_event(
+        "added", Product(id=2, name="b", url="https://shop.com/item", indicator="y")
+    )
+    # The existing page is extended in place rather than rebuilt.
+    assert registry.hosts["shop.com"] == [target]
+    assert [p.id for p in target.products] == [1, 2]
+
+    registry.on_product_event("deleted", Product(id=1))
+    registry.on_product_event("deleted", Product(id=2))
+    assert registry.hosts == {}
+    assert len(registry) == 0
+
+
+def test_registry_load_reconciles():
+    registry = ProductRegistry()
+    registry.load(
+        [(1, "a", "https://shop.com/1", "x"), (2, "b", "https://shop.com/2", "x")]
+    )
+    registry.load(
+        [(2, "b", "https://shop.com/2", "in stock"), (3, "c", "https://b.com/", "x")]
+    )
+    assert sorted(registry.records) == [2, 3]
+    assert registry.records[2].indicator == "in stock"
+    assert set(registry.hosts) == {"shop.com", "b.com"}
+
+
+def test_registry_targets_filter_products():
+    registry = ProductRegistry()
+    registry.load(
+        [
+            (1, "a", "https://shop.com/item", "x"),
+            (2, "b", "https://shop.com/item", "y"),
+            (3, "c", "https://shop.com/other", "x"),
+        ]
+    )
+    targets = list(registry.targets(lambda p: p.id != 2 and p.id != 3))
+    assert [(t.url, [p.id for p in t.products]) for t in targets] == [
+        ("https://shop.com/item", [1])
+    ]
+
+
+def test_scheduling_filtered_targets_keeps_registry_intact():
+    registry = ProductRegistry()
+    registry.load(
+        [(1, "a", "https://shop.com/item", "x"), (2, "b", "https://shop.com/item", "y")]
+    )
+    scheduler = Scheduler(HostRateLimiter(rate=1, burst=1))
+    subscribed = {1, 2}
+
+    def sync() -> list[list[int]]:
+        targets = list(registry.targets(lambda p: p.id in subscribed))
+        scheduler.sync(targets)
+        return [[p.id for p in t.products] for t in scheduler.targets.values()]
+
+    assert sync() == [[1, 2]]
+    subscribed.discard(2)
+    assert sync() == [[1]]
+    subscribed.add(2)
+    assert sync() == [[1, 2]]
+    registry.remove(2)
+    assert [p.id for p in registry.hosts["shop.com"][0].products] == [1]
+
+
+@pytest.mark.asyncio
+async def test_registry_catches_up_by_id(global_session):
+    registry = ProductRegistry()
+    await models.add_product("a", "https://shop.com/a", "x")
+    registry.load(await models.get_product_rows())
+    await models.add_products([dict(name="b", url="https://shop.com/b", indicator="x")])
+    rows = await models.get_product_rows(registry.max_id)
+    assert [row[1] for row in rows] == ["b"]
+    for row in rows:
+        registry.add(*row)
+    assert registry.max_id == 2
+    assert not await models.get_product_rows(registry.max_id)
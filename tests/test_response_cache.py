@@ -0,0 +1,65 @@
+import pytest
+
+from stock_notifier.response_cache import CacheEntry, ResponseCache
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", CacheEntry(etag="1"))
+    cache.put("b", CacheEntry(etag="2"))
+    cache.get("a")
+    cache.put("c", CacheEntry(etag="3"))
+    assert cache.get("b") is None
+    assert cache.get("a").etag == "1"
+    assert cache.get("c").etag == "3"
+
+
+def test_update_resets_matches_on_new_content():
+    cache = ResponseCache()
+    cache.update("a", '"v1"', None, "hash1", {"in-stock": False})
+    cache.update("a", None, None, None, {"sold-out": True}, not_modified=True)
+    entry = cache.get("a")
+    assert entry.etag == '"v1"'
+    assert entry.matches == {"in-stock": False, "sold-out": True}
+
+    cache.update("a", '"v2"', None, "hash2", {"in-stock": True})
+    assert cache.get("a").matches == {"in-stock": True}
+    assert cache.get("a").conditional_headers() == {"If-None-Match": '"v2"'}
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = ResponseCache(path=str(path))
+    cache.update("a", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT", "h", {"x": True})
+    cache.save()
+
+    loaded = ResponseCache(path=str(path))
+    loaded.load()
+    assert loaded.get("a") == cache.get("a")
+
+
+@pytest.mark.asyncio
+async def test_saves_only_changes(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = ResponseCache(path=str(path))
+    await cache.save_async()
+    assert not path.exists()
+
+    cache.update("a", '"v1"', None, "h", {"x": True})
+    await cache.save_async()
+    path.write_text("{}")
+    await cache.save_async()
+    # Nothing changed since the last save, so the file wasn't rewritten.
+    assert path.read_text() == "{}"
+
+    path.write_text("stale")
+    cache.invalidate("a")
+    await cache.save_async()
+    assert path.read_text() == "{}"
+    cache.update("b", None, None, "h", {})
+    await cache.save_async()
+
+    loaded = ResponseCache(path=str(path))
+    loaded.load()
+    assert not loaded.dirty
+    assert loaded.get("b") == cache.get("b")
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from stock_notifier.scheduler import HostRateLimiter, Scheduler, Target, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.try_acquire() == 0
+
+
+def test_host_overrides():
+    limiter = HostRateLimiter(
+        rate=1, burst=1, host_overrides={"fast.com": {"rate": 10, "burst": 5}}
+    )
+    assert limiter.bucket("fast.com").burst == 5
+    assert limiter.bucket("slow.com").rate == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_host_does_not_block_other_hosts():
+    scheduler = Scheduler(HostRateLimiter(rate=20, burst=1, max_in_flight=3))
+    scheduler.sync(
+        [Target(f"https://a.com/{i}", "a.com", []) for i in range(3)]
+        + [Target("https://b.com/", "b.com", [])]
+    )
+    order = [(await scheduler.get()).host for _ in range(4)]
+    assert order[:2].count("b.com") == 1
+    assert order.count("a.com") == 3
+    assert scheduler.queue_depth() == 0
+
+
+@pytest.mark.asyncio
+async def test_reschedule_and_removal():
+    scheduler = Scheduler(HostRateLimiter(rate=100, burst=10))
+    target = Target("https://a.com/", "a.com", [])
+    scheduler.sync([target])
+    assert await scheduler.get() is target
+
+    scheduler.reschedule(target, 0.01)
+    assert await asyncio.wait_for(scheduler.get(), 1) is target
+
+    scheduler.reschedule(target, 0)
+    scheduler.sync([])
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(scheduler.get(), 0.05)
+
+
+@pytest.mark.asyncio
+async def test_take_due_batches_a_host_without_tokens():
+    clock = FakeClock()
+    scheduler = Scheduler(HostRateLimiter(rate=1, burst=1, clock=clock), clock)
+    targets = [Target(f"https://a.com/{i}", "a.com", []) for i in range(4)]
+    scheduler.sync(targets + [Target("https://b.com/", "b.com", [])])
+    scheduler.schedule("https://a.com/3", 10)
+
+    first = await scheduler.get()
+    assert first.host == "a.com"
+    batch = scheduler.take_due("a.com", 5)
+    assert {first, *batch} == set(targets[:3])
+    assert scheduler.queue_depth() == 1
+
+    # Rescheduled pages are due again together.
+    for target in [first, *batch]:
+        scheduler.reschedule(target, 0)
+    clock.now = 10
+    assert (await scheduler.get()).host == "b.com"
+    assert len([await scheduler.get(), *scheduler.take_due("a.com", 5)]) == 4
+
+
+@pytest.mark.asyncio
+async def test_hanging_host_keeps_only_its_checks_in_flight():
+    scheduler = Scheduler(HostRateLimiter(rate=1000, burst=10, max_in_flight=2))
+    scheduler.sync(
+        [Target(f"https://slow.com/{i}", "slow.com", []) for i in range(10)]
+        + [Target(f"https://fast.com/{i}", "fast.com", []) for i in range(10)]
+    )
+    running = {"slow.com": 0, "fast.com": 0}
+    peak = 0
+    fast_checks = 0
+
+    async def worker():
+        nonlocal peak, fast_checks
+        while True:
+            target = await scheduler.get()
+            running[target.host] += 1
+            peak = max(peak, running["slow.com"])
+            try:
+                if target.host == "slow.com":
+                    await asyncio.sleep(10)
+                else:
+                    await asyncio.sleep(0.001)
+                    fast_checks += 1
+            finally:
+                running[target.host] -= 1
+                scheduler.reschedule(target, 0)
+
+    workers = [asyncio.create_task(worker()) for _ in range(8)]
+    await asyncio.sleep(0.2)
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    assert peak == 2
+    # The other six workers kept checking the fast host.
+    assert fast_checks > 100
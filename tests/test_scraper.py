@@ -0,0 +1,127 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stock_notifier import scraper
+from stock_notifier.http_client import HttpClient
+from stock_notifier.indicators import IndicatorEngine
+from stock_notifier.models import Product
+from stock_notifier.registry import ProductRecord
+from stock_notifier.response_cache import ResponseCache
+from stock_notifier.scraper import get_page, normalize_url, plan_checks
+
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://Shop.Example.com:443/item?id=1#reviews") == (
+        "https://shop.example.com/item?id=1"
+    )
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/a") == "http://example.com:8080/a"
+
+
+def test_plan_checks_dedups_urls():
+    products = [
+        Product(id=1, name="a", url="https://shop.com/item", indicator="x"),
+        Product(id=2, name="b", url="https://SHOP.com/item#top", indicator="y"),
+        Product(id=3, name="c", url="https://shop.com/other", indicator="x"),
+        Product(id=4, name="d", url="https://store.com/item", indicator="x"),
+    ]
+    hosts = plan_checks(products)
+    assert set(hosts) == {"shop.com", "store.com"}
+    assert [[p.id for p in target.products] for target in hosts["shop.com"]] == [
+        [1, 2],
+        [3],
+    ]
+    assert [[p.id for p in target.products] for target in hosts["store.com"]] == [[4]]
+
+
+@pytest.fixture()
+async def large_page_server():
+    async def page(request: web.Request):
+        response = web.StreamResponse()
+        response.content_type = "text/html"
+        await response.prepare(request)
+        await response.write(b"<html>" + b"x" * 1000 + b"Add to cart")
+        for _ in range(100):
+            await response.write(b"y" * 10000)
+        await response.write_eof()
+        return response
+
+    async def small_page(request: web.Request):
+        return web.Response(
+            body=b"<html>" + b"x" * 1000 + b"Add to cart" + b"y" * 100,
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app.router.add_get("/", page)
+    app.router.add_get("/small", small_page)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_streaming_stops_reading_after_match(large_page_server, monkeypatch):
+    monkeypatch.setattr(scraper, "STREAM_CHUNK_SIZE", 1024)
+    product = Product(id=1, name="a", url="u", indicator="Add to cart")
+    matcher = IndicatorEngine().stream_matcher([product], regex_overlap=0)
+    async with HttpClient() as client:
+        page = await get_page(
+            str(large_page_server.make_url("/")), client, None, matcher
+        )
+    assert matcher.results == {"Add to cart": True}
+    assert page.size < 10000
+    assert page.content_hash is None
+
+
+@pytest.mark.asyncio
+async def test_body_size_is_bounded(large_page_server, monkeypatch):
+    monkeypatch.setattr(scraper, "MAX_BODY_BYTES", 5000)
+    async with HttpClient() as client:
+        page = await get_page(str(large_page_server.make_url("/")), client)
+    assert page.size == 5000
+    assert len(page.html) == 5000
+    assert page.content_hash is None
+
+
+@pytest.mark.asyncio
+async def test_match_in_truncated_body_is_incomplete(large_page_server, monkeypatch):
+    monkeypatch.setattr(scraper, "MAX_BODY_BYTES", 1050)
+    product = Product(id=1, name="a", url="u", indicator="Add to cart")
+    matcher = IndicatorEngine().stream_matcher([product], regex_overlap=0)
+    async with HttpClient() as client:
+        page = await get_page(
+            str(large_page_server.make_url("/small")), client, None, matcher
+        )
+    assert matcher.results == {"Add to cart": True}
+    assert page.size == 1050
+    assert page.content_hash is None
+
+
+@pytest.mark.asyncio
+async def test_unchanged_page_skips_matching(large_page_server, monkeypatch):
+    monkeypatch.setattr(scraper, "global_response_cache", ResponseCache())
+    engine = IndicatorEngine()
+    monkeypatch.setattr(scraper, "global_indicator_engine", engine)
+    evaluated = []
+    # Every indicator evaluation goes through match_compiled, streamed or not.
+    match_compiled = engine.match_compiled
+
+    def counting_match_compiled(compiled, text):
+        evaluated.append(len(text))
+        return match_compiled(compiled, text)
+
+    monkeypatch.setattr(engine, "match_compiled", counting_match_compiled)
+    url = str(large_page_server.make_url("/small"))
+    products = [ProductRecord(1, "a", url, "Sold out")]
+    async with HttpClient() as client:
+        first = await scraper.check(products, client)
+        assert evaluated
+        evaluated.clear()
+        second = await scraper.check(products, client)
+    assert first.matches == second.matches == {"Sold out": False}
+    assert not second.changed
+    # The body was only hashed, and its hash was known.
+    assert evaluated == []
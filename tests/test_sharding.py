@@ -0,0 +1,108 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from stock_notifier import models
+from stock_notifier.sharding import HashRing, ShardCoordinator
+
+HOSTS = [f"shop{i}.example.com" for i in range(200)]
+
+
+def test_hash_ring_spreads_hosts_and_moves_few_on_join():
+    ring = HashRing(["a", "b", "c"])
+    owners = {host: ring.owner(host) for host in HOSTS}
+    counts = {worker: list(owners.values()).count(worker) for worker in "abc"}
+    assert all(30 < count < 110 for count in counts.values())
+
+    grown = HashRing(["a", "b", "c", "d"])
+    moved = [host for host in HOSTS if grown.owner(host) != owners[host]]
+    # Only hosts taken over by the new worker move.
+    assert all(grown.owner(host) == "d" for host in moved)
+    assert len(moved) < len(HOSTS) / 2
+
+    assert HashRing([]).owner("shop.example.com") is None
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_workers_split_hosts_and_take_over_from_dead_worker(global_session):
+    clock = Clock()
+    a = ShardCoordinator("a", lease_seconds=30, clock=clock)
+    b = ShardCoordinator("b", lease_seconds=30, clock=clock)
+
+    assert await a.sync(HOSTS) == set(HOSTS)
+    # b takes its share once a releases it on its next heartbeat.
+    await b.sync(HOSTS)
+    await a.sync(HOSTS)
+    await b.sync(HOSTS)
+    assert a.owned and b.owned
+    assert a.owned.isdisjoint(b.owned)
+    assert a.owned | b.owned == set(HOSTS)
+    assert a.owns(next(iter(a.owned)))
+    assert not a.owns(next(iter(b.owned)))
+    assert b.changed.is_set()
+
+    # a stops heartbeating; after its lease expires, b takes over every host.
+    clock.now += timedelta(seconds=31)
+    assert await b.sync(HOSTS) == set(HOSTS)
+    assert b.workers == ["b"]
+
+    await b.release()
+    assert await models.get_host_leases() == []
+
+
+@pytest.mark.asyncio
+async def test_released_hosts_are_claimed_without_waiting(global_session):
+    clock = Clock()
+    a = ShardCoordinator("a", clock=clock)
+    b = ShardCoordinator("b", clock=clock)
+    await a.sync(HOSTS)
+    await b.sync(HOSTS)
+    await a.release()
+    # a's heartbeat row is gone too, so b owns the whole ring.
+    assert await b.sync(HOSTS) == set(HOSTS)
+
+
+def run_worker(database_url: str, worker_id: str, workers: int) -> set[str]:
+    async def work():
+        from stock_notifier import storage
+
+        engine = await storage.setup({"url": database_url})
+        shard = ShardCoordinator(worker_id, lease_seconds=30)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 30
+        # Keep heartbeating until every worker is seen, then a few more rounds so
+        # the others can release and claim.
+        rounds = 0
+        while rounds < 5 and loop.time() < deadline:
+            await shard.sync(HOSTS)
+            if len(shard.workers) == workers:
+                rounds += 1
+            await asyncio.sleep(0.2)
+        await engine.dispose()
+        return set(shard.owned)
+
+    return asyncio.run(work())
+
+
+def test_processes_share_sqlite_file(tmp_path):
+    database_url = f"sqlite+aiosqlite:///{tmp_path}/shard.db"
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(3, mp_context=context) as executor:
+        futures = [
+            executor.submit(run_worker, database_url, f"worker{i}", 3) for i in range(3)
+        ]
+        owned = [future.result(timeout=60) for future in futures]
+    assert all(owned)
+    assert sum(len(hosts) for hosts in owned) == len(HOSTS)
+    assert set().union(*owned) == set(HOSTS)
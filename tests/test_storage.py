@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from stock_notifier import models, storage
+
+
+@pytest.fixture()
+async def file_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(models, "global_async_session", None, raising=False)
+    engine = await storage.setup({"url": f"sqlite+aiosqlite:///{tmp_path}/test.db"})
+    yield engine
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_pragmas_applied(file_engine):
+    async with file_engine.connect() as conn:
+        assert (await conn.scalar(text("PRAGMA journal_mode"))) == "wal"
+        assert (await conn.scalar(text("PRAGMA synchronous"))) == 1  # normal
+        assert (await conn.scalar(text("PRAGMA busy_timeout"))) == 5000
+
+
+@pytest.mark.asyncio
+async def test_secondary_indexes(file_engine):
+    async with file_engine.connect() as conn:
+        indexes = await conn.run_sync(
+            lambda sync_conn: {
+                index["name"]
+                for table in ("subscription_table", "notification_outbox")
+                for index in inspect(sync_conn).get_indexes(table)
+            }
+        )
+    assert {
+        "ix_subscription_table_product_id",
+        "ix_notification_outbox_due",
+        "ix_notification_outbox_product_user",
+    } <= indexes
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("journal_mode", ["delete", "wal"])
+async def test_reads_proceed_during_writes(tmp_path, monkeypatch, journal_mode):
+    """Scraper reads complete while another connection, such as the bot in its
+    own process, is committing a write, but only under WAL."""
+    monkeypatch.setattr(models, "global_async_session", None, raising=False)
+    path = tmp_path / "test.db"
+    engine = await storage.setup(
+        {
+            "url": f"sqlite+aiosqlite:///{path}",
+            "pragmas": {"journal_mode": journal_mode, "busy_timeout": 100},
+        }
+    )
+    product = await models.add_product("candy", "https://candy.com", "in-stock")
+    writer = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Committing takes the exclusive lock a rollback journal needs to write.
+        writer.execute("BEGIN EXCLUSIVE")
+        writer.execute(
+            "INSERT INTO product (name, url, indicator) VALUES ('gum', 'g', 'x')"
+        )
+        if journal_mode == "wal":
+            rows = await models.get_product_rows()
+            assert [row[0] for row in rows] == [product.id]
+        else:
+            with pytest.raises(OperationalError, match="locked"):
+                await models.get_product_rows()
+        writer.execute("COMMIT")
+    finally:
+        writer.close()
+    assert len(await models.get_product_rows()) == 2
+    await engine.dispose()